@@ -0,0 +1,249 @@
+from collections import deque
+import logging
+import threading
+import time
+from exchange import coin_balance
+from transport import ExchangeError, TransientError
+
+# Статусы ордеров, после которых ордер больше не считается активным
+CLOSED_ORDER_STATUSES = {"Filled", "Cancelled", "Rejected", "Deactivated", "PartiallyFilledCanceled"}
+
+
+class AccountState:
+    """
+    Локальное состояние аккаунта по приватным потокам WebSocket
+    (wallet, position, order, execution).
+
+    Баланс и позиции читаются из памяти без обращения к REST. Состояние
+    сверяется с REST при запуске, после переподключения и раз в resync_interval
+    секунд. Если поток недоступен дольше max_staleness секунд, чтение само
+    выполняет сверку, а если и она не удалась - поднимает TransientError.
+    После размещения ордера позиция символа ждёт обновления из потока (не
+    дольше fill_timeout секунд), иначе запрашивается через REST.
+
+    Объект можно передать в Trader вместо BybitAPI: он реализует get_balance,
+    get_open_positions, get_all_open_positions и place_order.
+    """
+
+    def __init__(self, api, coin="USDT", max_staleness=30, resync_interval=300, fill_timeout=2.0,
+                 check_interval=5, max_executions=1000):
+        self.api = api
+        self.coin = coin
+        self.max_staleness = max_staleness
+        self.resync_interval = resync_interval
+        self.fill_timeout = fill_timeout
+        self.check_interval = check_interval
+        self.ws = None
+        self.balance = None
+        self.positions = {}  # symbol -> {positionIdx: позиция}
+        self.orders = {}  # orderId -> активный ордер
+        self.executions = deque(maxlen=max_executions)
+        # Функции listener(execution), вызываемые для каждого исполнения из потока (например, OrderManager)
+        self.execution_listeners = []
+        self._condition = threading.Condition()
+        self._versions = {"wallet": 0, "position": 0}
+        self._pending = set()  # символы, по которым ждём обновления позиции после ордера
+        self._confirmed = None  # момент, когда состояние последний раз было заведомо актуальным
+        self._last_resync = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Подключение к приватным потокам, начальная сверка и запуск фонового контроля соединения.
+        """
+        self._connect()
+        self.resync()
+        self._thread = threading.Thread(target=self._monitor, name="AccountState", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.check_interval * 2)
+        self._close()
+
+    def _connect(self):
+        self.ws = self.api.open_websocket(channel_type="private")
+        self.ws.wallet_stream(callback=self._on_wallet)
+        self.ws.position_stream(callback=self._on_position)
+        self.ws.order_stream(callback=self._on_order)
+        self.ws.execution_stream(callback=self._on_execution)
+
+    def _close(self):
+        if self.ws is not None:
+            try:
+                self.ws.exit()
+            except Exception as e:
+                logging.error(f"Ошибка закрытия приватного WebSocket: {e}")
+            self.ws = None
+
+    def _connected(self):
+        return self.ws is not None and self.ws.is_connected()
+
+    def _monitor(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                if not self._connected():
+                    logging.warning("Приватный WebSocket отключён, переподключение...")
+                    self._close()
+                    self._connect()
+                    self.resync()
+                elif self._last_resync is None or time.monotonic() - self._last_resync >= self.resync_interval:
+                    self.resync()
+                else:
+                    with self._condition:
+                        self._confirmed = time.monotonic()
+            except Exception as e:
+                logging.error(f"Ошибка контроля приватного WebSocket: {e}", exc_info=True)
+
+    def resync(self):
+        """
+        Сверка баланса и позиций с REST.
+
+        Если за время запроса из потока пришло более новое обновление, оно не перезаписывается.
+
+        :return: True, если сверка выполнена.
+        """
+        with self._condition:
+            versions = dict(self._versions)
+        try:
+            positions = self.api.get_all_open_positions(settle_coin=self.coin)
+            balance = self.api.get_balance()
+        except ExchangeError as e:
+            logging.warning(f"Сверка состояния аккаунта не удалась: {e}")
+            return False
+
+        with self._condition:
+            if self._versions["position"] == versions["position"]:
+                self.positions = {
+                    symbol: {pos.get("positionIdx", 0): pos for pos in symbol_positions}
+                    for symbol, symbol_positions in positions.items()}
+                self._pending.clear()
+            if self._versions["wallet"] == versions["wallet"]:
+                self.balance = balance
+            now = time.monotonic()
+            self._confirmed = self._last_resync = now
+            self._condition.notify_all()
+        logging.info(f"Состояние аккаунта сверено с REST: баланс {self.balance}, позиций: {len(self.positions)}.")
+        return True
+
+    def _fresh(self):
+        if self._confirmed is None:
+            return False
+        return self._connected() or time.monotonic() - self._confirmed <= self.max_staleness
+
+    def _ensure_fresh(self):
+        if not self._fresh() and not self.resync():
+            raise TransientError("Состояние аккаунта устарело, а сверка с REST не удалась")
+
+    def _on_wallet(self, message):
+        balance = coin_balance(message.get("data", []), self.coin)
+        if balance is None:
+            return
+        with self._condition:
+            self.balance = balance
+            self._versions["wallet"] += 1
+
+    def _on_position(self, message):
+        with self._condition:
+            for pos in message.get("data", []):
+                if pos.get("category", "linear") != "linear":
+                    continue
+                symbol = pos["symbol"]
+                symbol_positions = self.positions.setdefault(symbol, {})
+                if float(pos.get("size") or 0) > 0:
+                    symbol_positions[pos.get("positionIdx", 0)] = pos
+                else:
+                    symbol_positions.pop(pos.get("positionIdx", 0), None)
+                if not symbol_positions:
+                    del self.positions[symbol]
+                self._pending.discard(symbol)
+            self._versions["position"] += 1
+            self._condition.notify_all()
+
+    def _on_order(self, message):
+        with self._condition:
+            for order in message.get("data", []):
+                if order.get("orderStatus") in CLOSED_ORDER_STATUSES:
+                    self.orders.pop(order["orderId"], None)
+                else:
+                    self.orders[order["orderId"]] = order
+
+    def _on_execution(self, message):
+        executions = message.get("data", [])
+        with self._condition:
+            self.executions.extend(executions)
+        for listener in self.execution_listeners:
+            for execution in executions:
+                listener(execution)
+
+    def get_balance(self):
+        """ Доступный баланс из памяти (при устаревшем состоянии - после сверки с REST) """
+        self._ensure_fresh()
+        return self.balance
+
+    def get_open_positions(self, symbol):
+        """ Открытые позиции символа из памяти """
+        with self._condition:
+            if symbol in self._pending:
+                # Ожидание обновления позиции после собственного ордера
+                self._condition.wait_for(lambda: symbol not in self._pending, self.fill_timeout)
+            if symbol not in self._pending and self._fresh():
+                return list(self.positions.get(symbol, {}).values())
+
+        positions = self.api.get_open_positions(symbol)
+        with self._condition:
+            self.positions[symbol] = {pos.get("positionIdx", 0): pos for pos in positions}
+            if not positions:
+                del self.positions[symbol]
+            self._pending.discard(symbol)
+        return positions
+
+    def get_all_open_positions(self, settle_coin="USDT"):
+        """ Открытые позиции по всем символам из памяти """
+        self._ensure_fresh()
+        with self._condition:
+            if self._pending:
+                self._condition.wait_for(lambda: not self._pending, self.fill_timeout)
+            if self._pending:
+                pending = list(self._pending)
+            else:
+                pending = []
+        for symbol in pending:
+            self.get_open_positions(symbol)
+        with self._condition:
+            return {symbol: list(positions.values()) for symbol, positions in self.positions.items()}
+
+    def place_order(self, symbol, side, qty, **kwargs):
+        """ Размещение ордера через REST; позиция символа считается неактуальной до обновления из потока """
+        with self._condition:
+            self._pending.add(symbol)
+        response = None
+        try:
+            response = self.api.place_order(symbol, side, qty, **kwargs)
+        finally:
+            # Ордер не размещён (ошибка или исключение): обновления позиции из потока не будет
+            if not response or response.get("retCode") != 0:
+                with self._condition:
+                    self._pending.discard(symbol)
+        return response
+
+    def place_batch_order(self, orders):
+        """ Пакетное размещение ордеров через REST; позиции их символов ждут обновления из потока """
+        with self._condition:
+            self._pending.update(order["symbol"] for order in orders)
+        try:
+            results = self.api.place_batch_order(orders)
+        except Exception:
+            with self._condition:
+                self._pending.difference_update(order["symbol"] for order in orders)
+            raise
+        with self._condition:
+            for order, result in zip(orders, results):
+                if isinstance(result, Exception):
+                    self._pending.discard(order["symbol"])
+        return results
+
+    def get_executions(self, symbol=None, order_link_id=None, limit=50):
+        return self.api.get_executions(symbol, order_link_id, limit)
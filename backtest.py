@@ -0,0 +1,186 @@
+import argparse
+from collections import namedtuple
+import csv
+import logging
+import numpy as np
+from candles import interval_ms
+from indicators import CROSS_NAMES, SIGNAL_NAMES, indicator_arrays
+from kline_cache import KlineCache
+from position import Position
+from trader import decide, get_position_size
+
+# Комиссия тейкера Bybit для бессрочных контрактов
+DEFAULT_FEE_RATE = 0.00055
+
+# Ограничение повторных закрытий по RSI на одной свече
+MAX_REPEATS = 100
+
+BacktestResult = namedtuple("BacktestResult", ["equity", "trades", "fees"])
+
+
+def polls_per_bar(interval, poll=None):
+    """
+    Сколько раз main.main() оценивает одну и ту же закрытую свечу.
+
+    Цикл main.py просыпается на границе свечи через SCHEDULE_GRACE секунд после
+    её закрытия (IntervalScheduler), поэтому каждая закрытая свеча оценивается один раз.
+
+    :param interval: Интервал свечей Bybit ("1", "15", "60", "D", "W", "M").
+    :param poll: Пауза опроса с фиксированным периодом, с (прежний цикл - раз в 60 секунд);
+        None - опрос по границам свечей.
+    """
+    if not poll:
+        return 1
+    return max(1, int(interval_ms(interval) // (poll * 1000)))
+
+
+class Backtest:
+    """
+    Воспроизведение решений main.main() на истории свечей.
+
+    Индикаторы считаются векторно по всей истории; по свечам проходит только
+    цикл правил trader.decide (фильтр облака, крест за 4 свечи, выход по RSI 50,
+    закрытие перед разворотом). Решение по закрытой свече исполняется
+    рыночным ордером по цене открытия следующей свечи с проскальзыванием
+    (main.py отправляет его через SCHEDULE_GRACE секунд после открытия).
+
+    :param polls: Оценок одной закрытой свечи (см. polls_per_bar).
+    """
+
+    def __init__(self, candles, balance=1000.0, risk_percent=1.0, rsi_overbought=70,
+                 rsi_oversold=30, fee_rate=DEFAULT_FEE_RATE, slippage=0.0, polls=1,
+                 **indicator_params):
+        self.candles = candles
+        self.balance = balance
+        self.risk_percent = risk_percent
+        self.rsi_overbought = rsi_overbought
+        self.rsi_oversold = rsi_oversold
+        self.fee_rate = fee_rate
+        self.slippage = slippage
+        self.polls = polls
+        self.indicator_params = indicator_params
+
+    def indicators(self):
+        return indicator_arrays(
+            self.candles.high, self.candles.low, self.candles.close,
+            self.rsi_overbought, self.rsi_oversold, **self.indicator_params)
+
+    def run(self, arrays=None):
+        """
+        :param arrays: Готовые IndicatorArrays (если уже рассчитаны для этих свечей).
+        :return: BacktestResult(equity, trades, fees).
+        """
+        if arrays is None:
+            arrays = self.indicators()
+        signals = arrays.signal.tolist()
+        crosses = arrays.cross.tolist()
+        rsis = arrays.rsi.tolist()
+        closes = self.candles.close.tolist()
+        opens = self.candles.open.tolist()
+        timestamps = self.candles.timestamp.tolist()
+
+        position = Position()
+        cash = self.balance
+        equity = np.empty(len(closes))
+        equity[0] = cash
+        trades = []
+        fees = {}
+
+        for index in range(1, len(closes)):
+            # Решение по закрытой свече index - 1, исполнение по открытию свечи index
+            decision_index = index - 1
+            signal = SIGNAL_NAMES[signals[decision_index]]
+            if signal != "HOLD" or position.side is not None:
+                cross_flag = CROSS_NAMES[crosses[decision_index]]
+                rsi_value = rsis[decision_index]
+                previous_close = closes[decision_index]
+
+                polls = 0
+                actions = 0
+                while polls < self.polls and actions < self.polls + MAX_REPEATS:
+                    action, _ = decide(signal, cross_flag, rsi_value, position.side)
+                    if action is None:
+                        break  # Следующие опросы той же свечи дадут тот же результат
+                    qty = get_position_size(cash, self.risk_percent, previous_close)
+                    if qty is None:
+                        break
+                    slip = self.slippage if action.side == "Buy" else -self.slippage
+                    price = opens[index] * (1 + slip)
+                    fee = qty * price * self.fee_rate
+                    pnl = position.fill(action.side, qty, price)
+                    cash += pnl - fee
+                    fees[action.reason_code] = fees.get(action.reason_code, 0.0) + fee
+                    trades.append({
+                        "timestamp": timestamps[index],
+                        "side": action.side,
+                        "reason_code": action.reason_code,
+                        "qty": qty,
+                        "price": price,
+                        "fee": fee,
+                        "pnl": pnl,
+                        "rsi": rsi_value,
+                        "cross_flag": cross_flag,
+                    })
+                    actions += 1
+                    # Закрытие по RSI повторяет оценку сразу, без паузы опроса
+                    if not action.repeat:
+                        polls += 1
+
+            equity[index] = cash + position.unrealized(closes[index])
+
+        return BacktestResult(equity, trades, fees)
+
+
+def summary(result, balance):
+    total_fees = sum(result.fees.values())
+    lines = [
+        f"Сделок: {len(result.trades)}",
+        f"Итоговый капитал: {result.equity[-1]:.2f} (начальный {balance:.2f})",
+        f"Реализованный PnL: {sum(trade['pnl'] for trade in result.trades):.2f}",
+        f"Комиссии: {total_fees:.2f}",
+    ]
+    for reason_code, fee in sorted(result.fees.items(), key=lambda item: -item[1]):
+        lines.append(f"  {reason_code}: {fee:.2f}")
+    peak = np.maximum.accumulate(result.equity)
+    lines.append(f"Максимальная просадка: {np.max((peak - result.equity) / peak) * 100:.2f}%")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэктест стратегии на свечах из локального кэша.")
+    parser.add_argument("symbol")
+    parser.add_argument("interval")
+    parser.add_argument("--cache-dir", default="kline_cache")
+    parser.add_argument("--balance", type=float, default=1000.0)
+    parser.add_argument("--risk-percent", type=float, default=1.0)
+    parser.add_argument("--rsi-overbought", type=int, default=70)
+    parser.add_argument("--rsi-oversold", type=int, default=30)
+    parser.add_argument("--fee-rate", type=float, default=DEFAULT_FEE_RATE)
+    parser.add_argument("--slippage", type=float, default=0.0)
+    parser.add_argument("--poll", type=float, default=0,
+                        help="Опрос с фиксированной паузой в секундах вместо одного опроса на свечу "
+                             "(граница свечи + SCHEDULE_GRACE, как в main.py)")
+    parser.add_argument("--trades-file", help="CSV со списком сделок")
+    parser.add_argument("--equity-file", help="CSV с кривой капитала")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR, format="%(asctime)s [%(levelname)s] %(message)s")
+    candles = KlineCache(args.cache_dir).load(args.symbol, args.interval).closed()
+    backtest = Backtest(candles, args.balance, args.risk_percent, args.rsi_overbought,
+                        args.rsi_oversold, args.fee_rate, args.slippage,
+                        polls=polls_per_bar(args.interval, args.poll))
+    result = backtest.run()
+    print(summary(result, args.balance))
+
+    if args.trades_file and result.trades:
+        with open(args.trades_file, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(result.trades[0]))
+            writer.writeheader()
+            writer.writerows(result.trades)
+    if args.equity_file:
+        np.savetxt(args.equity_file, np.column_stack([candles.timestamp, result.equity]),
+                   delimiter=",", header="timestamp,equity", comments="", fmt=["%d", "%.8f"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from candles import CandleSeries, interval_ms
+from indicators import CROSS_NAMES, SIGNAL_NAMES, indicator_arrays
+from strategy import Strategy
+from trade_logger import TradeLogger
+from trader import Trader
+
+DEFAULT_SIZES = (200, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# Свечей на прогрев движка перед замером обновления по одной свече
+WARMUP_BARS = 1000
+
+
+def synthetic_candles(bars, seed=0, interval="1", start=1_600_000_000_000):
+    """
+    Синтетические свечи: геометрическое случайное блуждание с шагом цены 0.1
+    и участками без движения, чтобы проверять равенства в max/min и крестах.
+
+    :return: CandleSeries в хронологическом порядке.
+    """
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 0.002, bars)
+    steps[rng.random(bars) < 0.05] = 0.0
+    close = np.round(30000 * np.exp(np.cumsum(steps)), 1)
+    open_ = np.concatenate([close[:1], close[:-1]])
+    spread = np.round(rng.random((2, bars)) * 20, 1)
+    high = np.maximum(open_, close) + spread[0]
+    low = np.minimum(open_, close) - spread[1]
+    volume = np.round(rng.random(bars) * 10, 3)
+    timestamp = start + np.arange(bars, dtype=np.int64) * interval_ms(interval)
+    return CandleSeries(timestamp, open_, high, low, close, volume, volume * close)
+
+
+class FakeAPI:
+    """
+    Замена BybitAPI для main.run_iteration: свечи отдаются из памяти
+    (как из KlineCache), ордера меняют чистую позицию без обращения к бирже.
+    """
+
+    def __init__(self, candles, position=0, balance=1000.0):
+        self.candles = candles
+        self.position = position  # индекс последней сформировавшейся свечи
+        self.balance = balance
+        self.side = None
+        self.orders = 0
+
+    def get_balance(self):
+        return self.balance
+
+    def get_candles(self, symbol, interval):
+        return self.candles[:self.position + 1]
+
+    def get_open_positions(self, symbol):
+        return [{"symbol": symbol, "side": self.side.capitalize(), "size": "1"}] if self.side else []
+
+    def get_all_open_positions(self, settle_coin="USDT"):
+        return {}
+
+    def place_order(self, symbol, side, qty, **kwargs):
+        side = side.lower()
+        self.side = side if self.side is None else (None if self.side != side else side)
+        self.orders += 1
+        return {"retCode": 0, "result": {"orderId": str(self.orders)}}
+
+
+def measure(func, repeat=3, min_time=0.2):
+    """
+    Время одного вызова: число вызовов в замере подбирается так, чтобы замер
+    длился не меньше min_time.
+
+    :return: Словарь best_s, median_s, loops.
+    """
+    loops = 1
+    while True:
+        elapsed = _run(func, loops)
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops *= max(2, min(10, int(min_time / max(elapsed, 1e-9)) + 1))
+    times = [elapsed / loops] + [_run(func, loops) / loops for _ in range(repeat - 1)]
+    return {"best_s": min(times), "median_s": statistics.median(times), "loops": loops}
+
+
+def _run(func, loops):
+    started = time.perf_counter()
+    for _ in range(loops):
+        func()
+    return time.perf_counter() - started
+
+
+def peak_memory(func):
+    """
+    Пиковый объём памяти, выделенной за один вызов (Python и NumPy), в байтах.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _warm_strategy(strategy, candles, end):
+    # Прогрев движка на последних WARMUP_BARS свечах до end (без прогона всей истории)
+    strategy.update(candles[max(0, end - WARMUP_BARS):end])
+
+
+def bench_update_bar(candles, count):
+    """
+    Обновление Strategy одной новой свечой при истории из len(candles) свечей.
+
+    :return: Среднее время на свечу в секундах.
+    """
+    strategy = Strategy(None, "BENCH", "1", 70, 30)
+    count = min(count, len(candles) - 1)
+    start = len(candles) - count
+    _warm_strategy(strategy, candles, start)
+    started = time.perf_counter()
+    for end in range(start + 1, len(candles) + 1):
+        strategy.update(candles[:end])
+    return (time.perf_counter() - started) / count
+
+
+def bench_main_iteration(candles, count):
+    """
+    main.run_iteration с FakeAPI: баланс, свечи, оценка, позиции и ордер по последней закрытой свече.
+
+    :return: Словарь с временем итерации и числом ордеров.
+    """
+    api = FakeAPI(candles)
+    count = min(count, len(candles) - 2)
+    start = len(candles) - count
+    main, trade_logger = _import_main()
+    strategy = Strategy(api, "BENCH", "1", main.RSI_OVERBOUGHT, main.RSI_OVERSOLD, main.CROSS_LOOKBACK)
+    _warm_strategy(strategy, candles, start - 1)
+    main.bybit_api = main.account = api
+    main.trader = Trader(api, strategy, trade_logger, main.RISK_PERCENT)
+
+    times = []
+    for position in range(start, len(candles)):
+        api.position = position
+        started = time.perf_counter()
+        main.run_iteration()
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return {
+        "mean_s": sum(times) / len(times),
+        "p50_s": times[len(times) // 2],
+        "p99_s": times[min(len(times) - 1, int(len(times) * 0.99))],
+        "iterations": len(times),
+        "orders": api.orders,
+    }
+
+
+_main = []
+
+
+def _import_main():
+    # main.setup() настраивает API, журнал и уведомления: журнал и снимки состояния
+    # отключаются через окружение, а файлы логов создаются во временном каталоге
+    if not _main:
+        import main
+        os.environ.setdefault("TRADE_JOURNAL_DB", "")
+        os.environ.setdefault("SNAPSHOT_FILE", "")
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                main.setup()
+            finally:
+                os.chdir(cwd)
+        main.trade_logger.disable()
+        _main.extend([main, TradeLogger(log_file=os.devnull)])
+    return _main
+
+
+def cross_check(candles, start=100, step=1):
+    """
+    Сверка быстрых путей с эталоном pandas/pandas_ta (Strategy.evaluate,
+    check_cross_flag, calculate_rsi) на каждой step-й свече.
+
+    Сравниваются: инкрементальный движок Strategy.update и векторный
+    indicator_arrays. Сигнал и крест должны совпадать точно, RSI - до 1e-9.
+
+    :return: Словарь с количеством проверок и списком расхождений.
+    """
+    reference = Strategy(None, "BENCH", "1", 70, 30)
+    incremental = Strategy(None, "BENCH", "1", 70, 30)
+    arrays = indicator_arrays(candles.high, candles.low, candles.close)
+    mismatches = []
+    checked = 0
+    for end in range(start, len(candles) + 1, step):
+        window = candles[:end]
+        expected = (reference.evaluate(window), reference.check_cross_flag(window),
+                    float(reference.calculate_rsi(window)))
+        engine = incremental.update(window)
+        vector = (SIGNAL_NAMES[int(arrays.signal[end - 1])], CROSS_NAMES[int(arrays.cross[end - 1])],
+                  float(arrays.rsi[end - 1]))
+        for name, actual in (("engine", tuple(engine)), ("vectorized", vector)):
+            if actual[:2] != expected[:2] or not np.isclose(actual[2], expected[2], rtol=1e-9, atol=1e-9,
+                                                            equal_nan=True):
+                mismatches.append({"path": name, "bar": end - 1, "expected": expected, "actual": actual})
+        checked += 1
+    return {"checked": checked, "mismatches": mismatches[:20], "mismatch_count": len(mismatches)}
+
+
+def run(sizes, repeat=3, min_time=0.2, bar_updates=1000, iterations=500, memory=True, seed=0):
+    results = []
+
+    def record(name, bars, **values):
+        row = {"name": name, "bars": bars}
+        row.update(values)
+        results.append(row)
+        print(f"{name:<24}{bars:>10} " + " ".join(
+            f"{key}={value:.3g}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in values.items()), flush=True)
+
+    for bars in sizes:
+        candles = synthetic_candles(bars, seed)
+        strategy = Strategy(None, "BENCH", "1", 70, 30)
+        cases = {
+            "evaluate": lambda: strategy.evaluate(candles),
+            "check_cross_flag": lambda: strategy.check_cross_flag(candles),
+            "calculate_rsi": lambda: strategy.calculate_rsi(candles),
+            "indicator_arrays": lambda: indicator_arrays(candles.high, candles.low, candles.close),
+        }
+        for name, func in cases.items():
+            values = measure(func, repeat, min_time)
+            if memory:
+                values["peak_bytes"] = peak_memory(func)
+            record(name, bars, **values)
+
+        record("strategy_update_bar", bars, mean_s=bench_update_bar(candles, bar_updates))
+        record("main_iteration", bars, **bench_main_iteration(candles, iterations))
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    """
+    Отношение времени к прошлому прогону по каждому замеру (меньше 1 - быстрее).
+    """
+    previous = {(row["name"], row["bars"]): row for row in baseline["results"]}
+    lines = [f"{'Замер':<24}{'Свечей':>10}{'Было':>12}{'Стало':>12}{'Отношение':>11}"]
+    for row in results:
+        old = previous.get((row["name"], row["bars"]))
+        key = "best_s" if "best_s" in row else "mean_s"
+        if old is None or key not in old:
+            continue
+        lines.append(f"{row['name']:<24}{row['bars']:>10}{old[key]:>12.4g}{row[key]:>12.4g}"
+                     f"{row[key] / old[key]:>11.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности стратегии и основного цикла.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="Размеры истории в свечах через запятую")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Минимальная длительность одного замера, с")
+    parser.add_argument("--bar-updates", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=500, help="Итераций main.run_iteration на размер")
+    parser.add_argument("--no-memory", action="store_true", help="Не измерять пиковую память")
+    parser.add_argument("--check-bars", type=int, default=2000,
+                        help="Свечей для сверки с pandas (0 - без сверки)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    # Логи стратегии на каждой итерации не должны попадать в замер
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.WARNING)
+    logging.basicConfig(level=logging.WARNING, handlers=[handler])
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "seed": args.seed,
+        },
+    }
+
+    failed = False
+    if args.check_bars:
+        checks = cross_check(synthetic_candles(args.check_bars, args.seed + 1))
+        report["checks"] = checks
+        failed = checks["mismatch_count"] > 0
+        print(f"Сверка с pandas: проверок {checks['checked']}, расхождений {checks['mismatch_count']}")
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    report["results"] = run(sizes, args.repeat, args.min_time, args.bar_updates, args.iterations,
+                            not args.no_memory, args.seed)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Результаты записаны в {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(report["results"], json.load(f)))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import datetime
+import numpy as np
+
+# Недельные свечи Bybit открываются в понедельник 00:00 UTC (эпоха Unix начинается с четверга)
+WEEK_OFFSET_MS = 4 * 86400000
+
+
+class CandleSeries:
+    """
+    Свечи в хронологическом порядке (старые первыми) в виде столбцов NumPy.
+
+    Ответ Bybit разбирается один раз на границе с биржей; срезы (например,
+    closed()) возвращают представления тех же массивов без копирования.
+    """
+
+    COLUMNS = ("timestamp", "open", "high", "low", "close", "volume", "turnover")
+
+    def __init__(self, timestamp, open, high, low, close, volume, turnover):
+        self.timestamp = timestamp  # int64, время открытия свечи в мс
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.turnover = turnover
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int64),
+                   *(np.empty(0, dtype=np.float64) for _ in cls.COLUMNS[1:]))
+
+    @classmethod
+    def from_bybit(cls, rows):
+        """
+        Разбор списка свечей Bybit ([start, open, high, low, close, volume, turnover],
+        строки, новые первыми) в столбцы за один проход.
+
+        :param rows: Список свечей из ответа get_kline.
+        :return: CandleSeries в хронологическом порядке.
+        """
+        if len(rows) == 0:
+            return cls.empty()
+        # Одна таблица float64 -> переворот и транспонирование в непрерывные столбцы
+        data = np.ascontiguousarray(
+            np.array([row[:7] for row in rows], dtype=np.float64)[::-1].T)
+        return cls(data[0].astype(np.int64), data[1], data[2], data[3], data[4], data[5], data[6])
+
+    @classmethod
+    def concat(cls, parts):
+        """
+        Склейка нескольких CandleSeries, идущих друг за другом по времени.
+
+        :param parts: Список CandleSeries в хронологическом порядке.
+        :return: Новая CandleSeries.
+        """
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+        return cls(*(np.concatenate([getattr(part, name) for part in parts])
+                     for name in cls.COLUMNS))
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("CandleSeries поддерживает только срезы.")
+        return CandleSeries(*(getattr(self, name)[index] for name in self.COLUMNS))
+
+    def closed(self):
+        """
+        Только закрытые свечи: последняя (ещё формирующаяся) свеча отбрасывается.
+
+        :return: CandleSeries-представление без копирования данных.
+        """
+        return self[:-1]
+
+    def key(self, index=-1):
+        """
+        Время и OHLC свечи: ключ для пропуска пересчёта, если входные данные не изменились.
+
+        :return: Кортеж (timestamp, open, high, low, close) или None для пустой серии.
+        """
+        if not len(self):
+            return None
+        return (int(self.timestamp[index]), float(self.open[index]), float(self.high[index]),
+                float(self.low[index]), float(self.close[index]))
+
+    def since(self, timestamp):
+        """
+        Свечи, открытые строго позже указанного времени.
+
+        :param timestamp: Время открытия свечи в мс.
+        :return: CandleSeries-представление без копирования данных.
+        """
+        start = int(np.searchsorted(self.timestamp, timestamp, side="right"))
+        return self[start:]
+
+
+def as_series(candles):
+    """
+    Приведение входных свечей к CandleSeries (списки Bybit разбираются один раз).
+
+    :param candles: CandleSeries или список свечей Bybit (новые первыми).
+    :return: CandleSeries.
+    """
+    if isinstance(candles, CandleSeries):
+        return candles
+    return CandleSeries.from_bybit(candles)
+
+
+def interval_ms(interval):
+    """
+    Длительность свечи в миллисекундах.
+
+    :param interval: Интервал свечей Bybit ("1", "15", "60", "D", "W", "M"; месяц считается за 30 дней).
+    """
+    minutes = {"D": 1440, "W": 10080, "M": 43200}
+    return (minutes.get(str(interval), None) or int(interval)) * 60000
+
+
+def is_continuous(candles, interval):
+    """
+    Свечи идут подряд с шагом интервала, без пропусков.
+
+    :param candles: CandleSeries в хронологическом порядке.
+    """
+    # Длина месячной свечи непостоянна: для "M" пропуски не проверяются
+    if len(candles) < 2 or str(interval) == "M":
+        return True
+    return bool(np.all(np.diff(candles.timestamp) == interval_ms(interval)))
+
+
+def candle_start_ms(timestamp, interval):
+    """
+    Время открытия свечи интервала, в которую попадает момент timestamp.
+
+    :param timestamp: Момент в мс (Unix).
+    :return: Время открытия свечи в мс.
+    """
+    timestamp = int(timestamp)
+    if str(interval) == "M":
+        moment = datetime.datetime.fromtimestamp(timestamp / 1000, datetime.timezone.utc)
+        return int(datetime.datetime(moment.year, moment.month, 1, tzinfo=datetime.timezone.utc).timestamp()) * 1000
+    step = interval_ms(interval)
+    offset = WEEK_OFFSET_MS if str(interval) == "W" else 0
+    return (timestamp - offset) // step * step + offset
+
+
+def next_candle_ms(timestamp, interval):
+    """
+    Время открытия первой свечи интервала, открывающейся строго после момента timestamp.
+
+    Свечи выровнены по UTC: недельные открываются в понедельник, месячные - первого числа.
+
+    :param timestamp: Момент в мс (Unix).
+    :return: Время открытия свечи в мс.
+    """
+    timestamp = int(timestamp)
+    if str(interval) == "M":
+        moment = datetime.datetime.fromtimestamp(timestamp / 1000, datetime.timezone.utc)
+        year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+        return int(datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc).timestamp()) * 1000
+    step = interval_ms(interval)
+    offset = WEEK_OFFSET_MS if str(interval) == "W" else 0
+    return (timestamp - offset) // step * step + step + offset
+
+
+class CandleBuffer:
+    """
+    Растущий буфер свечей для потоковых данных (WebSocket).
+
+    Закрытые свечи не изменяются, поэтому выданные ранее представления остаются
+    корректными; на месте обновляется только последняя (формирующаяся) свеча.
+    """
+
+    def __init__(self, candles=None, capacity=1024):
+        candles = candles if candles is not None else CandleSeries.empty()
+        capacity = max(capacity, 2 * len(candles), 1)
+        self._columns = [np.empty(capacity, dtype=getattr(candles, name).dtype)
+                         for name in CandleSeries.COLUMNS]
+        self._size = 0
+        self.extend(candles)
+
+    def __len__(self):
+        return self._size
+
+    def series(self):
+        """
+        Текущее содержимое в виде CandleSeries-представления без копирования.
+        """
+        return CandleSeries(*(column[:self._size] for column in self._columns))
+
+    def last_timestamp(self):
+        return int(self._columns[0][self._size - 1]) if self._size else None
+
+    def upsert(self, row):
+        """
+        Обновление последней свечи с тем же временем или добавление новой.
+
+        :param row: Кортеж (timestamp, open, high, low, close, volume, turnover).
+        :return: True, если свеча добавлена или обновлена; False для устаревших данных.
+        """
+        timestamp = row[0]
+        last = self.last_timestamp()
+        if last is not None and timestamp < last:
+            return False
+        if last is None or timestamp > last:
+            if self._size == len(self._columns[0]):
+                self._grow()
+            self._size += 1
+        index = self._size - 1
+        for column, value in zip(self._columns, row):
+            column[index] = value
+        return True
+
+    def extend(self, candles):
+        """
+        Слияние CandleSeries в хронологическом порядке (REST-догрузка пропусков).
+        """
+        last = self.last_timestamp()
+        if last is not None:
+            position = int(np.searchsorted(candles.timestamp, last))
+            if position < len(candles) and candles.timestamp[position] == last:
+                self.upsert([getattr(candles, name)[position] for name in CandleSeries.COLUMNS])
+            candles = candles.since(last)
+
+        count = len(candles)
+        while self._size + count > len(self._columns[0]):
+            self._grow()
+        for column, name in zip(self._columns, CandleSeries.COLUMNS):
+            column[self._size:self._size + count] = getattr(candles, name)
+        self._size += count
+
+    def _grow(self):
+        self._columns = [np.concatenate([column, np.empty_like(column)])
+                         for column in self._columns]
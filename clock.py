@@ -0,0 +1,115 @@
+import heapq
+import threading
+import time as _time
+
+
+class SystemClock:
+    """
+    Реальное время.
+    """
+
+    def time(self):
+        return _time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            _time.sleep(seconds)
+
+
+class VirtualClock:
+    """
+    Виртуальное время для симуляции и воспроизведения.
+
+    Время стоит, пока хотя бы один из participants потоков работает; когда все
+    участники уснули, часы сразу переводятся к ближайшему моменту пробуждения.
+    Так неделя работы бота с паузами по 60 секунд проходит за секунды, а порядок
+    событий не зависит от скорости машины.
+
+    :param start: Начальное время в секундах (Unix).
+    :param participants: Количество потоков, которые спят на этих часах.
+    """
+
+    def __init__(self, start, participants=1):
+        self._now = float(start)
+        self.participants = participants
+        self._sleepers = []  # куча (момент пробуждения, номер, событие)
+        self._sequence = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    def subscribe(self, listener):
+        """
+        Вызов listener(previous, now) при каждом переводе часов (в потоке, который их перевёл).
+        """
+        self._listeners.append(listener)
+
+    def advance(self, seconds):
+        """
+        Перевод часов вперёд вручную (например, из управляющего потока).
+        """
+        with self._lock:
+            self._advance_to(self._now + seconds)
+            self._wake()
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        event = threading.Event()
+        with self._lock:
+            self._sequence += 1
+            heapq.heappush(self._sleepers, (self._now + seconds, self._sequence, event))
+            self._step()
+        event.wait()
+
+    def leave(self):
+        """
+        Участник закончил работу и больше не будет спать на этих часах.
+        """
+        with self._lock:
+            self.participants -= 1
+            self._step()
+
+    def _advance_to(self, moment):
+        if moment <= self._now:
+            return
+        previous, self._now = self._now, moment
+        for listener in self._listeners:
+            listener(previous, moment)
+
+    def _wake(self):
+        # Будятся только потоки, чьё время наступило
+        while self._sleepers and self._sleepers[0][0] <= self._now:
+            heapq.heappop(self._sleepers)[2].set()
+
+    def _step(self):
+        # Все участники спят: время переходит к ближайшему пробуждению
+        if self._sleepers and len(self._sleepers) >= self.participants:
+            self._advance_to(self._sleepers[0][0])
+            self._wake()
+
+
+# Часы процесса; симулятор и воспроизведение подменяют их через set_clock
+_clock = SystemClock()
+
+
+def set_clock(clock):
+    global _clock
+    _clock = clock
+
+
+def get_clock():
+    return _clock
+
+
+def now():
+    """
+    Текущее время в секундах (Unix) по часам процесса.
+    """
+    return _clock.time()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
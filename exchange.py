@@ -1,134 +1,321 @@
-from pybit.unified_trading import HTTP, WebSocket
+from pybit.unified_trading import WebSocket
+from candles import CandleSeries
 import logging
+import random
 import time
+from replay import RecordingTransport
+from transport import ExchangeError, HttpTransport
+
+# Максимальное количество свечей в одном ответе get_kline
+KLINE_PAGE_LIMIT = 1000
+
+# Максимальное количество ордеров в одном запросе order/create-batch (linear)
+BATCH_ORDER_LIMIT = 10
+
+# Код Bybit "orderLinkId уже использован": ордер с этим идентификатором уже принят биржей
+DUPLICATE_LINK_ID_CODE = 110072
+
+
+def coin_balance(accounts, coin="USDT"):
+    """
+    Доступный баланс монеты из списка аккаунтов (ответ wallet-balance или поток wallet).
+
+    :return: Баланс или None, если монета не найдена.
+    """
+    for account in accounts:
+        for asset in account.get("coin", []):
+            if asset.get("coin") == coin:
+                available_balance = asset.get(
+                    "availableToWithdraw") or asset.get("walletBalance") or "0"
+                try:
+                    return float(available_balance)
+                except ValueError:
+                    logging.error(
+                        f"Ошибка преобразования баланса {coin}: {available_balance}")
+                    return 0
+    return None
 
 
 class BybitAPI:
-    def __init__(self, api_key, api_secret, testnet=True):
+    """
+    Методы REST поднимают transport.ExchangeError, если данные получить не удалось
+    (после повторов временных ошибок), а не возвращают пустой результат.
+
+    :param recorder: replay.Recorder для записи всех запросов и ответов (режим записи).
+    """
+
+    def __init__(self, api_key, api_secret, testnet=True, kline_cache=None, rate_limiter=None,
+                 transport=None, recorder=None):
         self.api_key = api_key
         self.api_secret = api_secret
         self.testnet = testnet
-        self.http = HTTP(testnet=testnet, api_key=api_key,
-                         api_secret=api_secret)
+        self.rate_limiter = rate_limiter
+        self.transport = transport or HttpTransport(
+            api_key, api_secret, testnet, rate_limiter=rate_limiter)
+        self.recorder = recorder
+        if recorder is not None:
+            self.transport = RecordingTransport(self.transport, recorder)
+        self.http = self.transport.http
         self.ws = None
+        self.kline_cache = kline_cache
+        self._tick_sizes = {}  # symbol -> шаг цены (priceFilter.tickSize)
 
-    def connect_websocket(self):
-        try:
-            self.ws = WebSocket(
-                testnet=self.testnet,
-                channel_type="linear",
-                api_key=self.api_key,
-                api_secret=self.api_secret
-            )
-            self.ws.on_message = self._on_message
-            logging.info("WebSocket connected.")
-        except Exception as e:
-            logging.error(f"Error connecting to WebSocket: {e}")
-            time.sleep(5)
-            self.connect_websocket()
+    def open_websocket(self, channel_type="linear", max_delay=60):
+        """ Новое подключение к WebSocket с экспоненциальной задержкой между попытками """
+        delay = 1
+        while True:
+            try:
+                private = channel_type == "private"
+                ws = WebSocket(
+                    testnet=self.testnet,
+                    channel_type=channel_type,
+                    api_key=self.api_key if private else None,
+                    api_secret=self.api_secret if private else None,
+                    retries=1,
+                    restart_on_error=False
+                )
+                ws.on_message = self._on_message
+                logging.info("WebSocket connected.")
+                return ws
+            except Exception as e:
+                logging.error(
+                    f"Error connecting to WebSocket: {e}. Retrying in {delay} s.")
+                time.sleep(delay + random.uniform(0, delay / 2))
+                delay = min(delay * 2, max_delay)
+
+    def connect_websocket(self, channel_type="linear", max_delay=60):
+        """ Подключение основного WebSocket (потоки свечей) """
+        self.ws = self.open_websocket(channel_type, max_delay)
+        return self.ws
+
+    def subscribe_kline(self, symbol, interval, callback):
+        """ Подписка на публичный поток свечей kline.{interval}.{symbol} """
+        self.ws.kline_stream(interval=interval, symbol=symbol, callback=callback)
+
+    def is_websocket_connected(self):
+        return self.ws is not None and self.ws.is_connected()
+
+    def close_websocket(self):
+        if self.ws is not None:
+            try:
+                self.ws.exit()
+            except Exception as e:
+                logging.error(f"Error closing WebSocket: {e}")
+            self.ws = None
 
     def _on_message(self, message):
-        try:
-            logging.info(f"WebSocket message received: {message}")
-        except Exception as e:
-            logging.error(f"Error processing WebSocket message: {e}")
+        # Каждое сообщение потока - только на уровне DEBUG и без форматирования, если он выключен
+        logging.debug("WebSocket message received: %s", message)
 
-    def get_kline_data(self, symbol, interval, start, end):
-        """ Получение исторических свечных данных """
-        try:
-            response = self.http.get_kline(
-                category="linear", symbol=symbol, interval=interval, start=start, end=end)
-            if response["retCode"] != 0:
-                logging.error(
-                    f"Ошибка получения Kline: {response['retMsg']} (Код ошибки: {response['retCode']})")
-                return []
+    def get_kline_data(self, symbol, interval, start, end, limit=None):
+        """ Получение исторических свечных данных в виде CandleSeries (старые свечи первыми) """
+        response = self.transport.call(
+            "market", "get_kline",
+            category="linear", symbol=symbol, interval=interval, start=start, end=end, limit=limit)
+        candles = response["result"]["list"]
+        if not candles:
+            logging.warning("Bybit вернул пустой список свечей.")
+            return CandleSeries.empty()
 
-            candles = response["result"]["list"]
-            if not candles:
-                logging.warning("Bybit вернул пустой список свечей.")
-                return []
+        # Разбор строк в столбцы выполняется один раз на границе с биржей
+        return CandleSeries.from_bybit(candles)
 
-            return candles
-        except Exception as e:
-            logging.error(f"Ошибка в get_kline_data: {e}", exc_info=True)
-            return []
+    def get_candles(self, symbol, interval):
+        """ Свечи с локальным кэшем: с биржи догружаются только свечи, начиная с последней сохранённой """
+        if self.kline_cache is None:
+            return self.get_kline_data(symbol, interval, start=None, end=None)
+        if self.recorder is not None:
+            self.recorder.cache(self.kline_cache, symbol, interval)
+
+        last_timestamp = self.kline_cache.last_timestamp(symbol, interval)
+        if last_timestamp is None:
+            logging.info(f"Кэш свечей {symbol} {interval} пуст, загрузка истории...")
+            fresh = self.get_kline_data(
+                symbol, interval, start=None, end=None, limit=KLINE_PAGE_LIMIT)
+        else:
+            fresh = self._get_kline_since(symbol, interval, last_timestamp)
+
+        if len(fresh):
+            self.kline_cache.store(symbol, interval, fresh)
+        return self.kline_cache.load(symbol, interval)
+
+    def _get_kline_since(self, symbol, interval, start):
+        """ Загрузка свечей начиная с start (включительно) постранично, от новых к старым """
+        pages = []
+        end = None
+        while True:
+            page = self.get_kline_data(
+                symbol, interval, start=start, end=end, limit=KLINE_PAGE_LIMIT)
+            if not len(page):
+                break
+            pages.append(page)
+            if page.timestamp[0] <= start or len(page) < KLINE_PAGE_LIMIT:
+                break
+            end = int(page.timestamp[0]) - 1
+        return CandleSeries.concat(pages[::-1])
+
+    def get_linear_usdt_symbols(self):
+        """ Список торгуемых бессрочных USDT-контрактов (linear) """
+        symbols = []
+        cursor = None
+        while True:
+            response = self.transport.call(
+                "market", "get_instruments_info", category="linear", limit=1000, cursor=cursor)
+            for instrument in response["result"]["list"]:
+                if (instrument.get("quoteCoin") == "USDT"
+                        and instrument.get("contractType") == "LinearPerpetual"
+                        and instrument.get("status") == "Trading"):
+                    symbols.append(instrument["symbol"])
+            cursor = response["result"].get("nextPageCursor")
+            if not cursor:
+                return symbols
+
+    def get_tick_size(self, symbol):
+        """
+        Шаг цены инструмента (priceFilter.tickSize): запрашивается один раз на символ.
+
+        :return: Шаг цены строкой, как его отдаёт Bybit (например, "0.10").
+        """
+        tick_size = self._tick_sizes.get(symbol)
+        if tick_size is None:
+            response = self.transport.call("market", "get_instruments_info", category="linear", symbol=symbol)
+            instruments = response["result"]["list"]
+            if not instruments:
+                raise ExchangeError(f"Инструмент {symbol} не найден")
+            tick_size = self._tick_sizes[symbol] = instruments[0]["priceFilter"]["tickSize"]
+        return tick_size
+
+    @staticmethod
+    def _order_params(symbol, side, qty, tp=None, sl=None, order_type="Market", order_link_id=None,
+                      reduce_only=False):
+        params = {
+            "symbol": symbol,
+            "side": side,
+            "orderType": order_type,
+            "qty": str(qty),
+            "timeInForce": "GTC",
+        }
+
+        # Добавляем takeProfit и stopLoss, только если они указаны
+        if tp is not None:
+            params["takeProfit"] = str(tp)
+        if sl is not None:
+            params["stopLoss"] = str(sl)
+        if order_link_id is not None:
+            params["orderLinkId"] = order_link_id
+        # Ордер только уменьшает позицию: без позиции биржа его отклонит, а не откроет встречную
+        if reduce_only:
+            params["reduceOnly"] = True
+        return params
+
+    def place_order(self, symbol, side, qty, tp=None, sl=None, order_type="Market", recv_window=10000,
+                    order_link_id=None, reduce_only=False):
+        """
+        Размещение ордера с тейк-профитом и стоп-лоссом.
+
+        С order_link_id запрос можно безопасно повторять после таймаута: повтор уже
+        принятого ордера биржа отклоняет как дубликат, и он считается размещённым.
+        """
+        # Подготовка параметров для запроса
+        params = self._order_params(symbol, side, qty, tp, sl, order_type, order_link_id, reduce_only)
+        params.update(category="linear", recvWindow=recv_window)
 
-    def place_order(self, symbol, side, qty, tp=None, sl=None, order_type="Market", recv_window=10000):
-        """ Размещение ордера с тейк-профитом и стоп-лоссом """
         try:
-            # Подготовка параметров для запроса
-            params = {
-                "category": "linear",
-                "symbol": symbol,
-                "side": side,
-                "orderType": order_type,
-                "qty": str(qty),
-                "timeInForce": "GTC",
-                "recvWindow": recv_window
-            }
-
-            # Добавляем takeProfit и stopLoss, только если они указаны
-            if tp is not None:
-                params["takeProfit"] = str(tp)
-            if sl is not None:
-                params["stopLoss"] = str(sl)
-
-            response = self.http.place_order(**params)
-            if response["retCode"] != 0:
-                logging.error(
-                    f"Ошибка размещения ордера: {response['retMsg']}")
-            else:
-                logging.info(f"Ордер размещён: {response}")
-            return response
+            response = self.transport.call("order/create", "place_order", idempotent=order_link_id is not None,
+                                           **params)
+        except ExchangeError as e:
+            if order_link_id is not None and e.code == DUPLICATE_LINK_ID_CODE:
+                # retried: дубликатом отклонён повтор после таймаута, т.е. принят первый запрос этого вызова
+                retried = e.attempts > 1
+                logging.warning(f"Ордер {order_link_id} уже принят биржей"
+                                + (" (первая попытка дошла до биржи)." if retried else ", повтор не отправлен."))
+                return {"retCode": 0, "result": {"orderId": None, "orderLinkId": order_link_id, "retried": retried}}
+            logging.error(f"Ошибка размещения ордера: {e}")
+            raise
         except Exception as e:
-            logging.error(f"Ошибка размещения ордера: {e}", exc_info=True)
-            return None
+            logging.error(f"Ошибка размещения ордера: {e}")
+            raise
+        logging.info("Ордер размещён: %s", response)
+        return response
+
+    def place_batch_order(self, orders):
+        """
+        Размещение нескольких ордеров одним запросом order/create-batch.
+
+        :param orders: Список словарей с ключами symbol, side, qty, order_link_id (обязателен)
+            и необязательными tp, sl, order_type, reduce_only; не больше BATCH_ORDER_LIMIT.
+        :return: Список ответов по ордерам в том же порядке: словарь с orderId и orderLinkId
+            (orderId None - ордер с этим orderLinkId уже был принят) или ExchangeError,
+            если биржа отклонила ордер.
+        """
+        request = [self._order_params(**order) for order in orders]
+        response = self.transport.call("order/create-batch", "place_batch_order", category="linear",
+                                       request=request)
+        results = response["result"]["list"]
+        statuses = response.get("retExtInfo", {}).get("list", [])
+        outcome = []
+        for i, order in enumerate(orders):
+            status = statuses[i] if i < len(statuses) else {"code": 0}
+            code = int(status.get("code", 0))
+            if code == 0:
+                outcome.append(results[i])
+            elif code == DUPLICATE_LINK_ID_CODE:
+                # Повтор пакета после таймаута не отличить от ордера, принятого раньше: retried неизвестен
+                outcome.append({"orderId": None, "orderLinkId": order["order_link_id"], "retried": None})
+            else:
+                outcome.append(ExchangeError(f"place_batch_order: {status.get('msg')}", code))
+        logging.info("Пакет из %d ордеров размещён: %s", len(orders), outcome)
+        return outcome
+
+    def get_executions(self, symbol=None, order_link_id=None, limit=50):
+        """ Исполнения (сделки) по символу или ордеру, новые первыми """
+        response = self.transport.call(
+            "execution/list", "get_executions",
+            category="linear", symbol=symbol, orderLinkId=order_link_id, limit=limit)
+        return response["result"]["list"]
+
+    def set_trading_stop(self, symbol, tp=None, sl=None):
+        """
+        Изменение тейк-профита и стоп-лосса открытой позиции (0 - снять уровень).
+        """
+        params = {"category": "linear", "symbol": symbol, "positionIdx": 0}
+        if tp is not None:
+            params["takeProfit"] = str(tp)
+        if sl is not None:
+            params["stopLoss"] = str(sl)
+        response = self.transport.call("position/trading-stop", "set_trading_stop", **params)
+        logging.info("TP/SL позиции %s изменены: tp=%s, sl=%s", symbol, tp, sl)
+        return response
 
     def get_open_positions(self, symbol):
         """ Получение открытых позиций для символа """
-        try:
-            response = self.http.get_positions(
-                accountType="UNIFIED", category="linear", symbol=symbol)
-            if response["retCode"] != 0:
-                logging.error(
-                    f"Ошибка получения позиций: {response['retMsg']} (Код ошибки: {response['retCode']})")
-                return []
+        response = self.transport.call(
+            "position/list", "get_positions", accountType="UNIFIED", category="linear", symbol=symbol)
+        return [pos for pos in response["result"]["list"] if float(pos["size"]) > 0]
 
-            positions = [pos for pos in response["result"]
-                         ["list"] if float(pos["size"]) > 0]
-            return positions
-        except Exception as e:
-            logging.error(f"Ошибка в get_open_positions: {e}", exc_info=True)
-            return []
+    def get_all_open_positions(self, settle_coin="USDT"):
+        """ Получение открытых позиций по всем символам одним запросом (с пагинацией) """
+        positions = {}
+        cursor = None
+        while True:
+            response = self.transport.call(
+                "position/list", "get_positions",
+                category="linear", settleCoin=settle_coin, limit=200, cursor=cursor)
+            for pos in response["result"]["list"]:
+                if float(pos["size"]) > 0:
+                    positions.setdefault(pos["symbol"], []).append(pos)
+            cursor = response["result"].get("nextPageCursor")
+            if not cursor:
+                return positions
 
     def get_balance(self):
         """ Получение доступного баланса USDT из UNIFIED аккаунта """
-        try:
-            response = self.http.get_wallet_balance(
-                accountType="UNIFIED", coin="USDT")
-            if response["retCode"] != 0:
-                logging.error(
-                    f"Ошибка получения баланса: {response['retMsg']} (Код ошибки: {response['retCode']})")
-                return 0
-
-            for account in response.get("result", {}).get("list", []):
-                for asset in account.get("coin", []):
-                    if asset.get("coin") == "USDT":
-                        available_balance = asset.get(
-                            "availableToWithdraw") or asset.get("walletBalance") or "0"
-                        try:
-                            available_balance = float(available_balance)
-                        except ValueError:
-                            logging.error(
-                                f"Ошибка преобразования баланса USDT: {available_balance}")
-                            return 0
-
-                        logging.info(
-                            f"Баланс USDT в UNIFIED: {available_balance}")
-                        return available_balance
-
+        response = self.transport.call(
+            "account/wallet-balance", "get_wallet_balance", accountType="UNIFIED", coin="USDT")
+        available_balance = coin_balance(response.get("result", {}).get("list", []))
+        if available_balance is None:
             logging.warning("Баланс USDT не найден в UNIFIED аккаунте!")
             return 0
-        except Exception as e:
-            logging.error(f"Ошибка получения баланса (UNIFIED): {e}")
-            return 0
+
+        logging.info("Баланс USDT в UNIFIED: %s", available_balance)
+        return available_balance
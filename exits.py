@@ -0,0 +1,249 @@
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP
+import logging
+import threading
+import time
+import metrics
+from transport import ExchangeError
+
+# Стоп-лосс ставится чуть дальше уровня Ишимоку, чтобы касание линии не закрывало позицию
+STOP_BUFFER = 0.001
+
+# Наименьшее расстояние от цены входа до стопа в шагах цены: цена исполнения рыночного
+# ордера отличается от цены закрытия свечи, и слишком близкий стоп биржа отклонит вместе с ордером
+MIN_STOP_TICKS = 2
+
+
+def _to_tick(value, tick_size, rounding):
+    tick = Decimal(str(tick_size))
+    return float((Decimal(repr(value)) / tick).to_integral_value(rounding) * tick)
+
+
+def exit_levels(side, price, kijun_sen, senkou_span_a, senkou_span_b, reward_ratio=2.0, buffer=STOP_BUFFER,
+                tick_size=None):
+    """
+    Тейк-профит и стоп-лосс новой позиции по структуре Ишимоку.
+
+    Стоп - за Kijun Sen, а если Kijun по другую сторону цены или ближе MIN_STOP_TICKS
+    шагов цены - за ближней, затем дальней границей облака; тейк-профит - на
+    reward_ratio расстояний до стопа. Уровни округляются до шага цены (стоп - от цены).
+
+    :param side: Сторона ордера открытия ("Buy" или "Sell").
+    :param price: Ожидаемая цена входа.
+    :param tick_size: Шаг цены инструмента (priceFilter.tickSize); None - округление до 8 знаков.
+    :return: Кортеж (tp, sl) или (None, None), если подходящего уровня нет.
+    """
+    direction = 1 if side == "Buy" else -1
+    upper, lower = max(senkou_span_a, senkou_span_b), min(senkou_span_a, senkou_span_b)
+    near, far = (upper, lower) if direction == 1 else (lower, upper)
+    for level in (kijun_sen, near, far):
+        # NaN не проходит сравнение: уровни без истории пропускаются
+        if not (price - level) * direction > 0:
+            continue
+        stop = level * (1 - buffer * direction)
+        take = price + (price - stop) * reward_ratio
+        if tick_size is None:
+            return round(take, 8), round(stop, 8)
+        stop = _to_tick(stop, tick_size, ROUND_FLOOR if direction == 1 else ROUND_CEILING)
+        take = _to_tick(take, tick_size, ROUND_HALF_UP)
+        if (price - stop) * direction >= MIN_STOP_TICKS * float(tick_size) and take != price:
+            return take, stop
+    return None, None
+
+
+class _Trail:
+    """ Отслеживаемая позиция: сторона, объём, лучшая цена, трейлинг-стоп и уровни SL/TP на бирже """
+
+    def __init__(self, side, qty, entry_price, stop=None, take=None):
+        self.side = side  # "Buy" - длинная позиция, "Sell" - короткая
+        self.qty = float(qty)
+        self.entry_price = float(entry_price)
+        self.best = float(entry_price)
+        self.stop = None  # трейлинг-стоп, пока не включён - None
+        self.exchange_stop = stop
+        self.take = take
+
+
+class ExitEngine:
+    """
+    Выход из позиции внутри свечи по потоку сделок publicTrade.
+
+    Для открываемой позиции уровни TP/SL считаются по Kijun Sen и облаку
+    (exit_levels) и передаются биржей вместе с ордером: они срабатывают и без
+    бота. Поверх них движок держит трейлинг-стоп на trail_percent от лучшей цены
+    после входа: каждая сделка из публичного потока сравнивается с уровнем, и при
+    его пробое сразу отправляется рыночный reduce-only ордер через OrderManager,
+    а не при следующей оценке по закрытой свече. Трейлинг включается, когда
+    прибыль достигла activation_percent.
+
+    :param api: BybitAPI (open_websocket для потока сделок).
+    :param orders: OrderManager для ордеров закрытия.
+    :param trail_percent: Отступ трейлинг-стопа от лучшей цены (0.01 - 1%; 0 - без трейлинга).
+    :param reward_ratio: Отношение расстояния до TP к расстоянию до SL (0 - ордера без TP/SL).
+    """
+
+    def __init__(self, api, orders, trail_percent=0.0, activation_percent=0.0, reward_ratio=2.0,
+                 check_interval=5):
+        self.api = api
+        self.orders = orders
+        self.trail_percent = trail_percent
+        self.activation_percent = activation_percent
+        self.reward_ratio = reward_ratio
+        self.check_interval = check_interval
+        self.ws = None
+        self._trails = {}  # symbol -> _Trail
+        self._subscribed = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def levels(self, symbol, side, price, strategy):
+        """
+        TP/SL для ордера открытия по уровням последней оценки стратегии,
+        округлённые до шага цены инструмента.
+
+        :return: Кортеж (tp, sl); (None, None), если уровни ещё не определены, шаг цены
+            не удалось получить или reward_ratio равен 0.
+        """
+        if not self.reward_ratio:
+            return None, None
+        try:
+            tick_size = self.api.get_tick_size(symbol)
+        except ExchangeError as e:
+            # Ордер без TP/SL лучше, чем ордер, который биржа отклонит из-за точности цены
+            logging.error(f"Не удалось получить шаг цены {symbol}, ордер открытия без TP/SL: {e}")
+            return None, None
+        return exit_levels(side, price, *strategy.cloud(), reward_ratio=self.reward_ratio, tick_size=tick_size)
+
+    def start(self):
+        """ Подключение к публичному потоку и контроль соединения (только при включённом трейлинге) """
+        if not self.trail_percent or self._thread is not None:
+            return
+        self._connect()
+        self._thread = threading.Thread(target=self._monitor, name="ExitEngine", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.check_interval * 2)
+        self._close()
+
+    def _connect(self):
+        self.ws = self.api.open_websocket(channel_type="linear")
+        with self._lock:
+            self._subscribed.clear()
+            symbols = list(self._trails)
+        for symbol in symbols:
+            self._subscribe(symbol)
+
+    def _close(self):
+        if self.ws is not None:
+            try:
+                self.ws.exit()
+            except Exception as e:
+                logging.error(f"Ошибка закрытия WebSocket потока сделок: {e}")
+            self.ws = None
+
+    def _monitor(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                if self.ws is None or not self.ws.is_connected():
+                    logging.warning("WebSocket потока сделок отключён, переподключение...")
+                    self._close()
+                    self._connect()
+            except Exception as e:
+                logging.error(f"Ошибка контроля WebSocket потока сделок: {e}", exc_info=True)
+
+    def _subscribe(self, symbol):
+        ws = self.ws
+        if ws is None:
+            return
+        with self._lock:
+            if symbol in self._subscribed:
+                return
+            self._subscribed.add(symbol)
+        ws.trade_stream(symbol=symbol, callback=self._on_trade)
+
+    def track(self, symbol, side, qty, entry_price, stop=None, take=None):
+        """
+        Начало отслеживания позиции (сразу после ордера открытия).
+
+        :param side: Сторона позиции: "Buy" - длинная, "Sell" - короткая.
+        :param stop: Стоп-лосс на бирже: трейлинг-стоп действует, только когда он ближе к цене.
+        :param take: Тейк-профит на бирже.
+        """
+        if not self.trail_percent:
+            return
+        with self._lock:
+            self._trails[symbol] = _Trail(side, qty, entry_price, stop, take)
+        self._subscribe(symbol)
+
+    def forget(self, symbol):
+        """ Позиция закрыта или закрывается ордером стратегии """
+        with self._lock:
+            self._trails.pop(symbol, None)
+
+    def sync(self, symbol, position):
+        """
+        Сверка с позицией биржи при оценке стратегии: позиция закрыта по TP/SL на
+        бирже или открыта до запуска бота.
+
+        :param position: Открытая позиция Bybit (side, size, avgPrice, stopLoss, takeProfit) или None.
+        """
+        if not self.trail_percent:
+            return
+        if position is None:
+            self.forget(symbol)
+            return
+        with self._lock:
+            trail = self._trails.get(symbol)
+            if trail is not None and trail.side == position["side"]:
+                trail.qty = float(position["size"])
+                return
+        stop = float(position.get("stopLoss") or 0) or None
+        take = float(position.get("takeProfit") or 0) or None
+        # В потоке position цена входа приходит в entryPrice
+        entry_price = position.get("avgPrice") or position.get("entryPrice")
+        self.track(symbol, position["side"], position["size"], entry_price, stop, take)
+
+    def _on_trade(self, message):
+        try:
+            for trade in message.get("data", []):
+                self.on_price(trade["s"], float(trade["p"]))
+        except Exception as e:
+            logging.error(f"Ошибка обработки сделки из потока: {e}", exc_info=True)
+
+    def on_price(self, symbol, price):
+        """
+        Обновление трейлинг-стопа по цене сделки и закрытие позиции при его пробое.
+
+        :return: Order закрытия или None.
+        """
+        with self._lock:
+            trail = self._trails.get(symbol)
+            if trail is None:
+                return None
+            direction = 1 if trail.side == "Buy" else -1
+            if (trail.take is not None and (price - trail.take) * direction >= 0) or \
+                    (trail.exchange_stop is not None and (price - trail.exchange_stop) * direction <= 0):
+                # Позицию закрывает TP/SL на бирже: reduce-only ордер был бы отклонён
+                del self._trails[symbol]
+                return None
+            if (price - trail.best) * direction > 0:
+                trail.best = price
+                # Трейлинг включается после прибыли activation_percent от цены входа
+                if (trail.best - trail.entry_price) * direction >= trail.entry_price * self.activation_percent:
+                    level = trail.best * (1 - self.trail_percent * direction)
+                    if trail.stop is None or (level - trail.stop) * direction > 0:
+                        trail.stop = level
+            if trail.stop is None or (price - trail.stop) * direction > 0:
+                return None
+            # Позиция закрывается один раз: следующие сделки ордер не повторяют
+            del self._trails[symbol]
+        metrics.increment("exits_total", reason="trailing_stop")
+        logging.info(f"Трейлинг-стоп {symbol}: цена {price} пробила уровень {trail.stop:.8g}, закрытие позиции.")
+        return self.orders.submit(
+            symbol, "Sell" if direction == 1 else "Buy", trail.qty, reduce_only=True, expected_price=price,
+            reason=f"Трейлинг-стоп: цена {price} пробила уровень {trail.stop:.8g}.",
+            reason_code="trailing_stop", decided=time.perf_counter(),
+            context={"entry_price": trail.entry_price, "best_price": trail.best, "stop": trail.stop})
@@ -0,0 +1,375 @@
+from collections import deque, namedtuple
+import numpy as np
+
+NAN = float("nan")
+
+# Результат одного обновления движка: сигнал, флаг пересечения и RSI
+Evaluation = namedtuple("Evaluation", ["signal", "cross_flag", "rsi"])
+
+# Векторный расчёт по всей истории (последняя ось - свечи):
+# signal: 1 - BUY, -1 - SELL, 0 - HOLD; cross: 1 - golden_cross, -1 - death_cross, 0 - нет
+IndicatorArrays = namedtuple("IndicatorArrays", [
+    "tenkan_sen", "kijun_sen", "senkou_span_a", "senkou_span_b", "rsi", "signal", "cross"])
+
+# Ряды Ишимоку и RSI без сигналов: не зависят от порогов RSI и глубины проверки креста
+IndicatorLines = namedtuple("IndicatorLines", [
+    "tenkan_sen", "kijun_sen", "senkou_span_a", "senkou_span_b", "rsi"])
+
+SIGNAL_NAMES = {1: "BUY", -1: "SELL", 0: "HOLD"}
+CROSS_NAMES = {1: "golden_cross", -1: "death_cross", 0: None}
+
+
+class RollingRange:
+    """
+    Скользящие максимум и минимум за последние `window` значений.
+
+    Монотонные деки дают амортизированное O(1) на обновление вместо
+    пересчёта rolling(window).max()/min() по всей истории.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._highs = deque()  # (индекс, значение), значения убывают
+        self._lows = deque()  # (индекс, значение), значения возрастают
+        self._count = 0
+
+    def push(self, high, low):
+        index = self._count
+        while self._highs and self._highs[-1][1] <= high:
+            self._highs.pop()
+        self._highs.append((index, high))
+        while self._lows and self._lows[-1][1] >= low:
+            self._lows.pop()
+        self._lows.append((index, low))
+
+        # Удаляем значения, вышедшие за пределы окна
+        oldest = index - self.window
+        if self._highs[0][0] <= oldest:
+            self._highs.popleft()
+        if self._lows[0][0] <= oldest:
+            self._lows.popleft()
+        self._count += 1
+
+    def midpoint(self):
+        """
+        Середина диапазона (max + min) / 2 или NaN, пока окно не заполнено.
+        """
+        if self._count < self.window:
+            return NAN
+        return (self._highs[0][1] + self._lows[0][1]) / 2
+
+
+class EwmMean:
+    """
+    Экспоненциальное среднее с alpha = 1 / length.
+
+    Повторяет рекуррентную формулу pandas ewm(adjust=True, min_periods=length),
+    на которой построена rma из pandas_ta, поэтому значения совпадают
+    с df.ta.rsi() бит в бит для той же последовательности свечей.
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self._decay = 1.0 - 1.0 / length
+        self._weighted = NAN
+        self._old_weight = 1.0
+        self._observations = 0
+
+    def push(self, value):
+        is_observation = value == value
+        self._observations += is_observation
+        weighted = self._weighted
+        if weighted == weighted:
+            self._old_weight *= self._decay
+            if is_observation:
+                if weighted != value:
+                    weighted = self._old_weight * weighted + value
+                    weighted /= self._old_weight + 1.0
+                self._old_weight += 1.0
+        elif is_observation:
+            weighted = value
+        self._weighted = weighted
+        return weighted if self._observations >= self.length else NAN
+
+
+class IchimokuEngine:
+    """
+    Потоковый расчёт Ишимоку и RSI по одной закрытой свече за вызов.
+
+    Даёт те же сигналы, что Strategy.evaluate, Strategy.check_cross_flag и
+    Strategy.calculate_rsi для той же последовательности свечей, но без
+    DataFrame и без пересчёта всей истории на каждой итерации.
+    """
+
+    def __init__(self, rsi_overbought=70, rsi_oversold=30, tenkan_period=9, kijun_period=26,
+                 senkou_b_period=52, displacement=26, rsi_length=14, cross_lookback=3):
+        self.rsi_overbought = rsi_overbought
+        self.rsi_oversold = rsi_oversold
+        self.tenkan_period = tenkan_period
+        self.kijun_period = kijun_period
+        self.senkou_b_period = senkou_b_period
+        self.displacement = displacement
+        self.rsi_length = rsi_length
+        self.cross_lookback = cross_lookback
+        self.reset()
+
+    def reset(self):
+        """
+        Сброс состояния (например, при разрыве в истории свечей).
+        """
+        self._tenkan = RollingRange(self.tenkan_period)
+        self._kijun = RollingRange(self.kijun_period)
+        self._senkou_b = RollingRange(self.senkou_b_period)
+
+        # Кольцевой буфер для сдвига облака на `displacement` свечей вперёд
+        self._span_ring = [(NAN, NAN)] * self.displacement
+        self._ring_pos = 0
+
+        # Tenkan/Kijun за последние cross_lookback + 1 свечей для проверки креста
+        # (по умолчанию сравнение с iloc[-4])
+        window = self.cross_lookback + 1
+        self._lines = deque([(NAN, NAN)] * window, maxlen=window)
+
+        self._gains = EwmMean(self.rsi_length)
+        self._losses = EwmMean(self.rsi_length)
+        self._previous_close = NAN
+
+        self.count = 0
+        self.tenkan_sen = NAN
+        self.kijun_sen = NAN
+        self.senkou_span_a = NAN
+        self.senkou_span_b = NAN
+        self.rsi = NAN
+        self.last = None
+
+    def update(self, high, low, close):
+        """
+        Добавление новой закрытой свечи.
+
+        :param high: Максимум свечи.
+        :param low: Минимум свечи.
+        :param close: Цена закрытия свечи.
+        :return: Evaluation(signal, cross_flag, rsi) для этой свечи.
+        """
+        self._tenkan.push(high, low)
+        self._kijun.push(high, low)
+        self._senkou_b.push(high, low)
+        tenkan_sen = self._tenkan.midpoint()
+        kijun_sen = self._kijun.midpoint()
+
+        # Значения облака, рассчитанные `displacement` свечей назад
+        senkou_span_a, senkou_span_b = self._span_ring[self._ring_pos]
+        self._span_ring[self._ring_pos] = (
+            (tenkan_sen + kijun_sen) / 2, self._senkou_b.midpoint())
+        self._ring_pos = (self._ring_pos + 1) % self.displacement
+
+        self._lines.append((tenkan_sen, kijun_sen))
+
+        # RSI: изменения цены раскладываются на рост и падение, как в pandas_ta
+        change = close - self._previous_close
+        self._previous_close = close
+        if change == change:
+            gain = change if change > 0 else 0.0
+            loss = change if change < 0 else 0.0
+        else:
+            gain = loss = NAN
+        gain_avg = self._gains.push(gain)
+        loss_avg = self._losses.push(loss)
+        try:
+            rsi = 100 * gain_avg / (gain_avg + abs(loss_avg))
+        except ZeroDivisionError:
+            rsi = NAN
+
+        self.count += 1
+        self.tenkan_sen = tenkan_sen
+        self.kijun_sen = kijun_sen
+        self.senkou_span_a = senkou_span_a
+        self.senkou_span_b = senkou_span_b
+        self.rsi = rsi
+        self.last = Evaluation(
+            self._signal(close), self._cross_flag(), rsi)
+        return self.last
+
+    def evaluate(self, close, rsi_overbought, rsi_oversold, cross_lookback):
+        """
+        Evaluation последней свечи с другими порогами RSI и глубиной проверки креста
+        (не больше cross_lookback движка) без повторного расчёта индикаторов.
+
+        :param close: Цена закрытия последней свечи.
+        :return: Evaluation(signal, cross_flag, rsi).
+        """
+        prev_tenkan, prev_kijun = self._lines[-1 - cross_lookback]
+        return Evaluation(
+            signal_name(close, self.senkou_span_a, self.senkou_span_b, self.tenkan_sen, self.kijun_sen,
+                        self.rsi, rsi_overbought, rsi_oversold),
+            cross_name(self.tenkan_sen, self.kijun_sen, prev_tenkan, prev_kijun), self.rsi)
+
+    def _signal(self, close):
+        return signal_name(close, self.senkou_span_a, self.senkou_span_b, self.tenkan_sen, self.kijun_sen,
+                           self.rsi, self.rsi_overbought, self.rsi_oversold)
+
+    def _cross_flag(self):
+        tenkan_sen, kijun_sen = self._lines[-1]
+        prev_tenkan, prev_kijun = self._lines[0]
+        return cross_name(tenkan_sen, kijun_sen, prev_tenkan, prev_kijun)
+
+
+def signal_name(close, senkou_span_a, senkou_span_b, tenkan_sen, kijun_sen, rsi, rsi_overbought, rsi_oversold):
+    """
+    Сигнал стратегии по значениям индикаторов на одной свече.
+
+    :return: "BUY", "SELL" или "HOLD".
+    """
+    # Условия для BUY: цена выше облака, Tenkan Sen выше Kijun Sen, RSI не в зоне перекупленности
+    if close > senkou_span_a and close > senkou_span_b:
+        if tenkan_sen > kijun_sen and rsi < rsi_overbought:
+            return "BUY"
+    # Условия для SELL: цена ниже облака, Tenkan Sen ниже Kijun Sen, RSI не в зоне перепроданности
+    elif close < senkou_span_a and close < senkou_span_b:
+        if tenkan_sen < kijun_sen and rsi > rsi_oversold:
+            return "SELL"
+    return "HOLD"
+
+
+def cross_name(tenkan_sen, kijun_sen, prev_tenkan, prev_kijun):
+    """
+    Флаг пересечения по Tenkan Sen и Kijun Sen на текущей и на более ранней свече.
+
+    :return: "golden_cross", "death_cross" или None.
+    """
+    if tenkan_sen > kijun_sen and prev_tenkan <= prev_kijun:
+        return "golden_cross"
+    elif tenkan_sen < kijun_sen and prev_tenkan >= prev_kijun:
+        return "death_cross"
+    return None
+
+
+def evaluate_lines(lines, close, rsi_overbought=70, rsi_oversold=30, cross_lookback=3):
+    """
+    Evaluation по последней свече из готовых рядов индикаторов (например,
+    опубликованных market_hub.py): пороги RSI и глубина проверки креста свои
+    у каждого бота, ряды Ишимоку и RSI от них не зависят.
+
+    :param lines: IndicatorLines по закрытым свечам до оцениваемой включительно.
+    :param close: Цена закрытия оцениваемой свечи.
+    :return: Evaluation(signal, cross_flag, rsi).
+    """
+    tenkan_sen, kijun_sen = float(lines.tenkan_sen[-1]), float(lines.kijun_sen[-1])
+    rsi = float(lines.rsi[-1])
+    # До начала истории линии не определены, как в IchimokuEngine
+    previous = -1 - cross_lookback
+    if len(lines.tenkan_sen) > cross_lookback:
+        prev_tenkan, prev_kijun = float(lines.tenkan_sen[previous]), float(lines.kijun_sen[previous])
+    else:
+        prev_tenkan = prev_kijun = NAN
+    return Evaluation(
+        signal_name(close, float(lines.senkou_span_a[-1]), float(lines.senkou_span_b[-1]),
+                    tenkan_sen, kijun_sen, rsi, rsi_overbought, rsi_oversold),
+        cross_name(tenkan_sen, kijun_sen, prev_tenkan, prev_kijun), rsi)
+
+
+def rolling_midpoint(high, low, window):
+    """
+    (max(high) + min(low)) / 2 за `window` свечей вдоль последней оси, NaN до заполнения окна.
+    """
+    result = np.full(high.shape, np.nan)
+    if high.shape[-1] >= window:
+        highs = np.lib.stride_tricks.sliding_window_view(high, window, axis=-1).max(axis=-1)
+        lows = np.lib.stride_tricks.sliding_window_view(low, window, axis=-1).min(axis=-1)
+        result[..., window - 1:] = (highs + lows) / 2
+    return result
+
+
+def shift(values, periods):
+    """
+    Сдвиг вперёд на `periods` свечей вдоль последней оси (как Series.shift).
+    """
+    result = np.full(values.shape, np.nan)
+    if periods < values.shape[-1]:
+        result[..., periods:] = values[..., :values.shape[-1] - periods]
+    return result
+
+
+def _decayed_sum(values, decay, block=64):
+    """
+    y[t] = decay * y[t - 1] + values[t] вдоль последней оси.
+
+    Рекуррентность считается блоками: внутри блока - умножением на треугольную
+    матрицу степеней decay, между блоками переносится только последнее значение.
+    """
+    length = values.shape[-1]
+    blocks = -(-length // block)
+    padded = np.zeros(values.shape[:-1] + (blocks * block,))
+    padded[..., :length] = values
+    padded = padded.reshape(values.shape[:-1] + (blocks, block))
+
+    steps = np.arange(block)
+    lag = steps[:, None] - steps[None, :]
+    kernel = np.where(lag >= 0, decay ** np.maximum(lag, 0), 0.0)
+    local = padded @ kernel.T
+
+    # Перенос накопленного значения из предыдущего блока
+    carry_in = np.zeros(values.shape[:-1] + (blocks,))
+    tail_decay = decay ** block
+    carry = np.zeros(values.shape[:-1])
+    for index in range(1, blocks):
+        carry = tail_decay * carry + local[..., index - 1, -1]
+        carry_in[..., index] = carry
+    result = local + carry_in[..., None] * decay ** (steps + 1)
+    return result.reshape(values.shape[:-1] + (blocks * block,))[..., :length]
+
+
+def rsi_array(close, length=14):
+    """
+    RSI по всей истории вдоль последней оси (та же формула, что в pandas_ta).
+    """
+    change = np.diff(close, axis=-1)
+    gains = np.concatenate([np.zeros(close.shape[:-1] + (1,)), np.maximum(change, 0)], axis=-1)
+    losses = np.concatenate([np.zeros(close.shape[:-1] + (1,)), np.maximum(-change, 0)], axis=-1)
+
+    # Нормировка ewm(adjust=True) одинакова для роста и падения и сокращается
+    decay = 1.0 - 1.0 / length
+    gain_sum = _decayed_sum(gains, decay)
+    loss_sum = _decayed_sum(losses, decay)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rsi = 100 * gain_sum / (gain_sum + loss_sum)
+    rsi[..., :length] = np.nan
+    return rsi
+
+
+def indicator_arrays(high, low, close, rsi_overbought=70, rsi_oversold=30, tenkan_period=9,
+                     kijun_period=26, senkou_b_period=52, displacement=26, rsi_length=14,
+                     cross_lookback=3):
+    """
+    Ишимоку, RSI, сигналы и кресты по всей истории одним векторным проходом.
+
+    Массивы могут быть двумерными (символы x свечи); значения на каждой свече
+    совпадают с тем, что вернули бы Strategy.evaluate и Strategy.check_cross_flag
+    по истории до этой свечи.
+
+    :return: IndicatorArrays.
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+
+    tenkan_sen = rolling_midpoint(high, low, tenkan_period)
+    kijun_sen = rolling_midpoint(high, low, kijun_period)
+    senkou_span_a = shift((tenkan_sen + kijun_sen) / 2, displacement)
+    senkou_span_b = shift(rolling_midpoint(high, low, senkou_b_period), displacement)
+    rsi = rsi_array(close, rsi_length)
+
+    with np.errstate(invalid="ignore"):
+        above = (close > senkou_span_a) & (close > senkou_span_b)
+        below = (close < senkou_span_a) & (close < senkou_span_b)
+        buy = above & (tenkan_sen > kijun_sen) & (rsi < rsi_overbought)
+        sell = ~above & below & (tenkan_sen < kijun_sen) & (rsi > rsi_oversold)
+        signal = buy.astype(np.int8) - sell.astype(np.int8)
+
+        previous_tenkan = shift(tenkan_sen, cross_lookback)
+        previous_kijun = shift(kijun_sen, cross_lookback)
+        golden = (tenkan_sen > kijun_sen) & (previous_tenkan <= previous_kijun)
+        death = ~golden & (tenkan_sen < kijun_sen) & (previous_tenkan >= previous_kijun)
+        cross = golden.astype(np.int8) - death.astype(np.int8)
+
+    return IndicatorArrays(tenkan_sen, kijun_sen, senkou_span_a, senkou_span_b, rsi, signal, cross)
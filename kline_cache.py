@@ -0,0 +1,107 @@
+import os
+import numpy as np
+from candles import CandleSeries
+
+
+class KlineCache:
+    """
+    Локальное хранилище свечей: по одному файлу на столбец для каждой пары символ/интервал.
+
+    Файлы только дописываются (кроме последней, ещё формирующейся свечи, которая
+    исправляется на месте) и читаются через np.memmap без загрузки в память.
+    """
+
+    def __init__(self, root="kline_cache"):
+        self.root = root
+
+    def _directory(self, symbol, interval):
+        return os.path.join(self.root, f"{symbol}_{interval}")
+
+    def _path(self, symbol, interval, column):
+        return os.path.join(self._directory(symbol, interval), f"{column}.bin")
+
+    @staticmethod
+    def _dtype(column):
+        return np.int64 if column == "timestamp" else np.float64
+
+    def size(self, symbol, interval):
+        """
+        Количество полностью записанных свечей.
+
+        Столбец времени дописывается последним, поэтому после сбоя посередине
+        записи учитывается минимальная длина среди столбцов.
+        """
+        sizes = []
+        for column in CandleSeries.COLUMNS:
+            path = self._path(symbol, interval, column)
+            if not os.path.exists(path):
+                return 0
+            sizes.append(os.path.getsize(path) // 8)
+        return min(sizes)
+
+    def load(self, symbol, interval):
+        """
+        Вся сохранённая история в виде CandleSeries поверх memmap-массивов.
+
+        :param symbol: Торговый символ.
+        :param interval: Интервал свечей.
+        :return: CandleSeries (пустая, если кэш отсутствует).
+        """
+        rows = self.size(symbol, interval)
+        if rows == 0:
+            return CandleSeries.empty()
+        return CandleSeries(*(
+            np.memmap(self._path(symbol, interval, column), dtype=self._dtype(column),
+                      mode="r", shape=(rows,))
+            for column in CandleSeries.COLUMNS))
+
+    def last_timestamp(self, symbol, interval):
+        """
+        Время открытия последней сохранённой свечи (мс) или None.
+        """
+        rows = self.size(symbol, interval)
+        if rows == 0:
+            return None
+        with open(self._path(symbol, interval, "timestamp"), "rb") as f:
+            f.seek((rows - 1) * 8)
+            return int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+
+    def store(self, symbol, interval, candles):
+        """
+        Сохранение новых свечей.
+
+        Свеча с тем же временем, что и последняя сохранённая, перезаписывает её на месте
+        (обновление формирующейся свечи); более новые свечи дописываются в конец,
+        более старые игнорируются.
+
+        :param symbol: Торговый символ.
+        :param interval: Интервал свечей.
+        :param candles: CandleSeries в хронологическом порядке.
+        """
+        os.makedirs(self._directory(symbol, interval), exist_ok=True)
+        rows = self.size(symbol, interval)
+
+        # Обрезаем хвосты столбцов, оставшиеся от прерванной записи
+        for column in CandleSeries.COLUMNS:
+            path = self._path(symbol, interval, column)
+            if os.path.exists(path) and os.path.getsize(path) != rows * 8:
+                os.truncate(path, rows * 8)
+
+        if rows:
+            last = self.last_timestamp(symbol, interval)
+            position = int(np.searchsorted(candles.timestamp, last))
+            if position < len(candles) and candles.timestamp[position] == last:
+                self._write(symbol, interval, candles[position:position + 1], offset=rows - 1)
+            candles = candles.since(last)
+
+        if len(candles):
+            self._write(symbol, interval, candles, offset=rows)
+
+    def _write(self, symbol, interval, candles, offset):
+        # Время пишется последним: свеча считается сохранённой только после него
+        for column in CandleSeries.COLUMNS[1:] + CandleSeries.COLUMNS[:1]:
+            path = self._path(symbol, interval, column)
+            values = np.ascontiguousarray(getattr(candles, column), dtype=self._dtype(column))
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.seek(offset * 8)
+                f.write(values.tobytes())
@@ -0,0 +1,215 @@
+import atexit
+import gzip
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+# Слушатели очередей, запущенные setup_logging и queued_handler
+_listeners = []
+_compressor = None
+_compressor_lock = threading.Lock()
+
+
+class _Compressor:
+    """
+    Сжатие ротированных логов gzip в отдельном потоке: поток записи логов
+    только переименовывает файл и сразу продолжает писать в новый.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="LogCompressor", daemon=True)
+        self._thread.start()
+
+    def submit(self, source, destination):
+        self._queue.put((source, destination))
+
+    def _run(self):
+        while True:
+            source, destination = self._queue.get()
+            try:
+                with open(source, "rb") as raw, gzip.open(destination, "wb") as packed:
+                    shutil.copyfileobj(raw, packed)
+                os.remove(source)
+            except OSError as e:
+                # Несжатая копия остаётся на диске, запись логов продолжается
+                logging.getLogger(__name__).warning(f"Не удалось сжать лог {source}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+
+def _compressor_instance():
+    global _compressor
+    with _compressor_lock:
+        if _compressor is None:
+            _compressor = _Compressor()
+        return _compressor
+
+
+_rotation_ids = itertools.count()
+
+
+def _namer(name):
+    return name + ".gz"
+
+
+def _rotator(source, destination):
+    # Уникальное имя временного файла: следующая ротация не затрёт ещё не сжатый файл
+    pending = f"{destination}.{os.getpid()}.{next(_rotation_ids)}.tmp"
+    os.replace(source, pending)
+    _compressor_instance().submit(pending, destination)
+
+
+def rotating_handler(path, max_bytes=10 * 1024 * 1024, backup_count=5, when=None, encoding="utf-8"):
+    """
+    Файловый обработчик с ротацией по размеру (max_bytes) или по времени (when,
+    как в TimedRotatingFileHandler, например "midnight") и сжатием старых файлов
+    в фоне (имя.1.gz, имя.2.gz...).
+    """
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backup_count, encoding=encoding, utc=True)
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+    handler.namer = _namer
+    handler.rotator = _rotator
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return handler
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Ограничение частоты сообщений уровня INFO и ниже по модулям (record.module):
+    корзина токенов на rate сообщений в секунду с запасом burst. Предупреждения
+    и ошибки пропускаются всегда; к первому сообщению после паузы добавляется
+    количество отброшенных.
+
+    :param rates: Словарь модуль -> rate для отдельных модулей (например, {"exchange": 5}).
+    """
+
+    def __init__(self, rate=20.0, burst=None, rates=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self._buckets = {}  # модуль -> [токены, время последнего пополнения, отброшено]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.module, self.rate)
+        if not rate:
+            return True
+        burst = self.burst or rate * 5
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(record.module)
+            if bucket is None:
+                bucket = self._buckets[record.module] = [burst, now, 0]
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+        if dropped:
+            record.msg = f"{record.msg} [пропущено сообщений {record.module}: {dropped}]"
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке: запись попадает в очередь
+    как есть, сообщение собирается из msg и args в потоке QueueListener.
+    Очередь внутри процесса, поэтому запись не нужно готовить к сериализации.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def queued_handler(*handlers):
+    """
+    Обработчик для логгера, передающий записи в очередь, и запущенный QueueListener,
+    который в своём потоке форматирует их и отдаёт handlers.
+
+    :return: Кортеж (LazyQueueHandler, QueueListener).
+    """
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    return LazyQueueHandler(log_queue), listener
+
+
+def stop_listener(listener):
+    """ Запись оставшихся сообщений и остановка слушателя """
+    if listener in _listeners:
+        _listeners.remove(listener)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def setup_logging(path="trading.log", level=logging.INFO, max_bytes=10 * 1024 * 1024, backup_count=5,
+                  when=None, rate=20.0, rates=None, console=True):
+    """
+    Настройка корневого логгера: запись в файл с ротацией и в консоль выполняется
+    в отдельном потоке, вызывающий код только ставит запись в очередь.
+    Как и logging.basicConfig, ничего не делает, если у корневого логгера уже
+    есть обработчики (например, логирование настроил benchmark.py или replay.py).
+
+    :param rate: Сообщений INFO в секунду на модуль (0 - без ограничения), см. RateLimitFilter.
+    :return: QueueListener или None, если логирование уже настроено.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    handlers = [rotating_handler(path, max_bytes, backup_count, when)]
+    if console:
+        stream = logging.StreamHandler()
+        stream.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(stream)
+    handler, listener = queued_handler(*handlers)
+    if rate or rates:
+        handler.addFilter(RateLimitFilter(rate, rates=rates))
+    root.setLevel(level)
+    root.addHandler(handler)
+    return listener
+
+
+def env_settings():
+    """
+    Параметры setup_logging из окружения: LOG_MAX_BYTES, LOG_BACKUP_COUNT,
+    LOG_ROTATE_WHEN (пусто - ротация по размеру) и LOG_RATE_LIMIT.
+    """
+    return {
+        "max_bytes": int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+        "backup_count": int(os.getenv("LOG_BACKUP_COUNT", 5)),
+        "when": os.getenv("LOG_ROTATE_WHEN", "") or None,
+        "rate": float(os.getenv("LOG_RATE_LIMIT", 20)),
+    }
+
+
+def shutdown():
+    """ Остановка всех слушателей и ожидание сжатия ротированных файлов """
+    for listener in list(_listeners):
+        stop_listener(listener)
+    if _compressor is not None:
+        _compressor.join()
+
+
+atexit.register(shutdown)
@@ -1,235 +1,273 @@
+import atexit
 import os
 from dotenv import load_dotenv
 import logging
+from account_state import AccountState
 from exchange import BybitAPI
+from exits import ExitEngine
 from strategy import Strategy
 from trade_logger import TradeLogger
-import time
-
-# Загрузка переменных из .env
-load_dotenv()
-
-API_KEY = os.getenv("API_KEY")
-API_SECRET = os.getenv("API_SECRET")
-SYMBOL = os.getenv("SYMBOL")
-INTERVAL = os.getenv("INTERVAL", 15)
-RSI_OVERBOUGHT = int(os.getenv("RSI_OVERBOUGHT", 70))
-RSI_OVERSOLD = int(os.getenv("RSI_OVERSOLD", 30))
-RISK_PERCENT = float(os.getenv("RISK_PERCENT", 1.0))
-TESTNET = os.getenv("TESTNET", "True") == "True"
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("trading.log", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
-
-# Инициализация API и стратегии
-bybit_api = BybitAPI(API_KEY, API_SECRET, TESTNET)
-strategy = Strategy(bybit_api, SYMBOL, INTERVAL, RSI_OVERBOUGHT, RSI_OVERSOLD)
-
-# Инициализация TradeLogger
-# Включить/отключить email уведомления
-trade_logger = TradeLogger(email_enabled=True)
-
-
-def get_position_size(balance, risk_percent, last_price):
+from trade_journal import TradeJournal
+from kline_cache import KlineCache
+from market_feed import KlineFeed
+import metrics
+from market_hub import HubClient
+from log_pipeline import env_settings as log_env_settings, setup_logging
+from order_manager import OrderManager
+from profiler import Profiler
+from rate_limit import RateLimiter
+from replay import CONFIG_KEYS, Recorder
+from scheduler import IntervalScheduler
+from shadow import ShadowStrategy, Variant, parse_variants
+from snapshot import SnapshotStore
+from timeframes import MultiTimeframeStrategy
+from trader import Trader
+
+# Модуль импортируется без побочных эффектов: настройки читаются, логирование
+# настраивается, а API, стратегия и трейдер создаются в setup()
+bybit_api = None
+market_data = None  # HubClient, если свечи берутся из хаба рыночных данных (None - с биржи)
+strategy = None
+trade_logger = None
+account = None
+order_manager = None
+exits = None
+trader = None
+scheduler = None
+recorder = None
+snapshots = None
+profiler = None
+
+
+def load_settings():
+    """
+    Чтение настроек из окружения и файла .env в глобальные переменные модуля.
     """
-    Расчет размера позиции на основе процента риска и последней цены.
+    global API_KEY, API_SECRET, SYMBOL, INTERVAL, RSI_OVERBOUGHT, RSI_OVERSOLD, CROSS_LOOKBACK, RISK_PERCENT, \
+        TESTNET, KLINE_CACHE_DIR, MODE, TRADE_JOURNAL_DB, ACCOUNT_STREAM, METRICS_PORT, METRICS_SUMMARY_SECONDS, \
+        RECORD_FILE, SCHEDULE_GRACE, MTF_INTERVALS, MTF_RULE, SNAPSHOT_FILE, SNAPSHOT_SECONDS, \
+        ORDER_ASYNC, PROFILE_DIR, PROFILE_SOCKET, PROFILE_ITERATIONS, MARKET_HUB_SOCKET, EXIT_REWARD_RATIO, \
+        EXIT_TRAIL_PERCENT, EXIT_TRAIL_ACTIVATION, SHADOW_VARIANTS, SHADOW_BALANCE
 
-    :param balance: Доступный баланс.
-    :param risk_percent: Процент риска от депозита.
-    :param last_price: Последняя цена актива.
-    :return: Размер позиции или None, если расчет невозможен.
+    # Загрузка переменных из .env
+    load_dotenv()
+
+    API_KEY = os.getenv("API_KEY")
+    API_SECRET = os.getenv("API_SECRET")
+    SYMBOL = os.getenv("SYMBOL")
+    INTERVAL = os.getenv("INTERVAL", "15")
+    RSI_OVERBOUGHT = int(os.getenv("RSI_OVERBOUGHT", 70))
+    RSI_OVERSOLD = int(os.getenv("RSI_OVERSOLD", 30))
+    CROSS_LOOKBACK = int(os.getenv("CROSS_LOOKBACK", 3))
+    RISK_PERCENT = float(os.getenv("RISK_PERCENT", 1.0))
+    TESTNET = os.getenv("TESTNET", "True") == "True"
+    KLINE_CACHE_DIR = os.getenv("KLINE_CACHE_DIR", "kline_cache")
+    # Режим работы: "poll" - опрос REST после закрытия каждой свечи, "ws" - оценка по закрытию свечи из WebSocket
+    MODE = os.getenv("MODE", "poll")
+    # Файл журнала сделок SQLite (пустое значение отключает журнал)
+    TRADE_JOURNAL_DB = os.getenv("TRADE_JOURNAL_DB", "trade_journal.db")
+    # Баланс и позиции из приватных потоков WebSocket вместо запросов REST на каждой итерации
+    ACCOUNT_STREAM = os.getenv("ACCOUNT_STREAM", "False") == "True"
+    # Порт HTTP-эндпоинта метрик Prometheus (0 - не запускать) и период сводки метрик в лог
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+    METRICS_SUMMARY_SECONDS = int(os.getenv("METRICS_SUMMARY_SECONDS", 300))
+    # Файл записи запросов и ответов REST для воспроизведения через replay.py (пустое значение - без записи)
+    RECORD_FILE = os.getenv("RECORD_FILE", "")
+    # Задержка запроса свечей после закрытия свечи, секунды (биржа успевает её сформировать)
+    SCHEDULE_GRACE = float(os.getenv("SCHEDULE_GRACE", 2))
+    # Старшие интервалы для подтверждения входа (через запятую, пустое значение - без подтверждения),
+    # собираемые из свечей INTERVAL, и правило подтверждения: all, majority, no_conflict
+    MTF_INTERVALS = os.getenv("MTF_INTERVALS", "")
+    MTF_RULE = os.getenv("MTF_RULE", "no_conflict")
+    # Снимок состояния индикаторов для быстрого перезапуска (пустое значение - без снимков)
+    # и период его записи, секунды
+    SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "state_snapshot.pkl")
+    SNAPSHOT_SECONDS = int(os.getenv("SNAPSHOT_SECONDS", 60))
+    # Отправка ордеров и сверка исполнений в фоновом потоке (False - в основном цикле)
+    ORDER_ASYNC = os.getenv("ORDER_ASYNC", "True") == "True"
+    # Запись воспроизводится только при отправке ордеров в основном цикле: порядок запросов
+    # фонового потока зависит от реального времени (в заголовок записи попадает ORDER_ASYNC=False)
+    if RECORD_FILE:
+        ORDER_ASYNC = False
+    # Профилирование по запросу (SIGUSR1/SIGUSR2 или команда через сокет PROFILE_SOCKET,
+    # пустое значение - без сокета): каталог результатов и итераций в сеансе
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_SOCKET = os.getenv("PROFILE_SOCKET", "")
+    PROFILE_ITERATIONS = int(os.getenv("PROFILE_ITERATIONS", 20))
+    # Сокет хаба рыночных данных market_hub.py: свечи и индикаторы из хаба вместо запросов
+    # к бирже (пустое значение - свечи с биржи)
+    MARKET_HUB_SOCKET = os.getenv("MARKET_HUB_SOCKET", "")
+    # TP/SL ордеров открытия по Kijun Sen и облаку: отношение расстояний до TP и до SL (0 - без TP/SL)
+    EXIT_REWARD_RATIO = float(os.getenv("EXIT_REWARD_RATIO", 2))
+    # Трейлинг-стоп по потоку сделок: отступ от лучшей цены (0.01 - 1%, 0 - выключен)
+    # и прибыль от цены входа, после которой он включается
+    EXIT_TRAIL_PERCENT = float(os.getenv("EXIT_TRAIL_PERCENT", 0))
+    EXIT_TRAIL_ACTIVATION = float(os.getenv("EXIT_TRAIL_ACTIVATION", 0))
+    # Теневые варианты правил "имя:перекупленность:перепроданность:глубина_креста" через запятую:
+    # оцениваются на тех же свечах и торгуют на бумаге (пустое значение - выключено)
+    SHADOW_VARIANTS = os.getenv("SHADOW_VARIANTS", "")
+    SHADOW_BALANCE = float(os.getenv("SHADOW_BALANCE", 1000))
+
+
+def setup():
+    """
+    Настройка логирования, создание API, стратегии и трейдера и восстановление
+    состояния из снимка. Повторный вызов ничего не делает.
     """
+    global recorder, bybit_api, market_data, strategy, trade_logger, account, order_manager, exits, trader, scheduler, \
+        snapshots, profiler
+    if trader is not None:
+        return
+    load_settings()
+
+    # Настройка логирования
+    # Запись логов в файл с ротацией и в консоль - в отдельном потоке, не в цикле торговли
+    setup_logging("trading.log", **log_env_settings())
+
+    # Параметры запуска сохраняются в записи, чтобы воспроизведение шло с теми же настройками
+    recorder = Recorder(RECORD_FILE, meta={key: str(globals()[key]) for key in CONFIG_KEYS}) if RECORD_FILE else None
+
+    # Инициализация API и стратегии
+    bybit_api = BybitAPI(API_KEY, API_SECRET, TESTNET,
+                         kline_cache=KlineCache(KLINE_CACHE_DIR),
+                         rate_limiter=RateLimiter(),
+                         recorder=recorder)
+    # В событийном режиме свечи приходят из потока kline, хаб не используется
+    market_data = HubClient(MARKET_HUB_SOCKET) if MARKET_HUB_SOCKET and MODE != "ws" else None
+    if SHADOW_VARIANTS:
+        variants = [Variant("live", RSI_OVERBOUGHT, RSI_OVERSOLD, CROSS_LOOKBACK)] + parse_variants(SHADOW_VARIANTS)
+        strategy = ShadowStrategy(market_data or bybit_api, SYMBOL, INTERVAL, variants,
+                                  balance=SHADOW_BALANCE, risk_percent=RISK_PERCENT, hub=market_data)
+    else:
+        strategy = Strategy(market_data or bybit_api, SYMBOL, INTERVAL, RSI_OVERBOUGHT, RSI_OVERSOLD,
+                            cross_lookback=CROSS_LOOKBACK, hub=market_data)
+    if MTF_INTERVALS:
+        strategy = MultiTimeframeStrategy(
+            strategy, [interval.strip() for interval in MTF_INTERVALS.split(",") if interval.strip()], MTF_RULE)
+
+    # Инициализация TradeLogger
+    # Включить/отключить email уведомления
+    trade_logger = TradeLogger(email_enabled=True,
+                               journal=TradeJournal(TRADE_JOURNAL_DB) if TRADE_JOURNAL_DB else None)
+
+    # Источник баланса и позиций: локальное состояние по приватным потокам или REST
+    account = AccountState(bybit_api) if ACCOUNT_STREAM else bybit_api
+
+    # Ордера с идемпотентным orderLinkId; сделка записывается по фактическому исполнению
+    order_manager = OrderManager(account, trade_logger, asynchronous=ORDER_ASYNC)
+    if ACCOUNT_STREAM:
+        account.execution_listeners.append(order_manager.on_execution)
+
+    # Уровни выхода из позиции на бирже и трейлинг-стоп внутри свечи
+    exits = ExitEngine(bybit_api, order_manager, EXIT_TRAIL_PERCENT, EXIT_TRAIL_ACTIVATION, EXIT_REWARD_RATIO) \
+        if EXIT_REWARD_RATIO or EXIT_TRAIL_PERCENT else None
+
+    trader = Trader(account, strategy, trade_logger, RISK_PERCENT, orders=order_manager, exits=exits)
+
+    # Итерации опроса выполняются сразу после закрытия свечи, а не каждые 60 секунд
+    scheduler = IntervalScheduler(INTERVAL, SCHEDULE_GRACE)
+
+    # Профилирование итераций выключено, пока его не запросят
+    profiler = Profiler(PROFILE_DIR, PROFILE_ITERATIONS)
+
+    # Индикаторы продолжают считаться с места, где остановился прошлый запуск
+    if SNAPSHOT_FILE:
+        snapshots = SnapshotStore(SNAPSHOT_FILE, SNAPSHOT_SECONDS)
+        snapshots.load(trader)
+        atexit.register(snapshots.save, trader, True)
+
+
+def run_iteration():
+    """
+    Одна итерация опроса REST.
+
+    :return: True, если следующую итерацию нужно выполнить без паузы.
+    """
+    # Без фонового потока исполнения ордеров сверяются в начале итерации
+    if not order_manager.asynchronous:
+        order_manager.reconcile()
+
+    # Получение баланса
+    with metrics.timer("stage_seconds", stage="balance"):
+        balance = account.get_balance()
     if balance == 0:
-        logging.warning("Баланс равен 0, невозможно открыть позицию.")
-        return None
+        logging.warning("Баланс равен 0, пропуск итерации.")
+        return False
 
-    position_value = balance * risk_percent
-    position_size = position_value / last_price
+    # Получение данных свечей
+    with metrics.timer("stage_seconds", stage="candles"):
+        candles = (market_data or bybit_api).get_candles(SYMBOL, INTERVAL)
+    if len(candles) < 2:
+        logging.warning("Недостаточно данных для анализа.")
+        return False
 
-    # Округление до 3 знаков после запятой
-    position_size = round(position_size, 3)
+    # Оценка только по закрытым свечам (последняя свеча ещё формируется)
+    with metrics.timer("stage_seconds", stage="step"):
+        repeat = trader.step(balance, candles.closed())
+    if snapshots is not None:
+        snapshots.save(trader)
+    return repeat
 
-    # Минимальный размер позиции (например, 0.001)
-    min_position_size = 0.001
 
-    # Если размер позиции меньше минимального, возвращаем None
-    if position_size < min_position_size:
-        logging.warning(
-            f"Размер позиции ({position_size}) меньше минимального ({min_position_size}). Позиция не будет открыта."
-        )
-        return None
+def on_candle_close(candles):
+    """
+    Оценка стратегии сразу после закрытия свечи (событийный режим).
 
-    return position_size
+    :param candles: CandleSeries закрытых свечей.
+    """
+    try:
+        with profiler.iteration():
+            with metrics.timer("stage_seconds", stage="balance"):
+                balance = account.get_balance()
+            if balance == 0:
+                logging.warning("Баланс равен 0, пропуск свечи.")
+                return
+            # После закрытия позиции по RSI оценка повторяется сразу, как и в режиме опроса
+            if trader.step(balance, candles):
+                trader.step(account.get_balance(), candles)
+            if snapshots is not None:
+                snapshots.save(trader)
+    except Exception as e:
+        metrics.increment("errors_total", source="candle_close")
+        logging.error(f"Ошибка обработки закрытой свечи: {e}", exc_info=True)
 
 
 def main():
     """
     Основной цикл стратегии.
     """
+    setup()
     logging.info("Запуск стратегии...")
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    if METRICS_SUMMARY_SECONDS:
+        metrics.start_summary(METRICS_SUMMARY_SECONDS)
+    if ACCOUNT_STREAM:
+        account.start()
+    if exits is not None:
+        exits.start()
+    profiler.install_signals()
+    if PROFILE_SOCKET:
+        profiler.serve(PROFILE_SOCKET)
+    if MODE == "ws":
+        # Событийный режим: оценка по флагу confirm из потока kline WebSocket
+        KlineFeed(bybit_api, SYMBOL, INTERVAL, on_candle_close).run()
+        return
+
     while True:
         try:
-            # Получение баланса
-            balance = bybit_api.get_balance()
-            if balance == 0:
-                logging.warning("Баланс равен 0, пропуск итерации.")
-                time.sleep(60)
-                continue
-
-            # Получение данных свечей
-            candles = bybit_api.get_kline_data(
-                SYMBOL, INTERVAL, start=None, end=None)
-            if not candles or len(candles) < 2:
-                logging.warning("Недостаточно данных для анализа.")
-                time.sleep(60)
-                continue
-
-            # Цена закрытия предыдущей завершенной свечи
-            previous_close = float(candles[-2][4])
-
-            # Расчет размера позиции
-            position_size = get_position_size(
-                balance, RISK_PERCENT, previous_close)
-            if position_size is None:
-                logging.warning("Невозможно рассчитать размер позиции.")
-                time.sleep(60)
-                continue
-
-            logging.info(
-                f"Доступный баланс: {balance} USDT. Размер позиции: {position_size}")
-
-            # Проверка открытых позиций
-            open_positions = bybit_api.get_open_positions(SYMBOL)
-            has_open_position = len(open_positions) > 0
-            current_position_side = open_positions[0]["side"].lower(
-            ) if has_open_position else None
-
-            # Оценка сигнала стратегии
-            signal = strategy.evaluate(candles[:-1])
-
-            # Проверка флага пересечения Tenkan Sen и Kijun Sen
-            cross_flag = strategy.check_cross_flag(candles[:-1])
-
-            # Проверка RSI для закрытия позиции
-            rsi_value = strategy.calculate_rsi(candles[:-1])
-            if has_open_position:
-                if current_position_side == "buy" and rsi_value < 50:
-                    logging.info(
-                        "Закрытие длинной позиции по RSI (пересечение 50 сверху вниз)...")
-                    bybit_api.place_order(SYMBOL, "Sell", position_size)
-                    trade_logger.log_trade(
-                        action="SELL",
-                        symbol=SYMBOL,
-                        price=previous_close,
-                        quantity=position_size,
-                        reason="Закрытие длинной позиции по RSI (пересечение 50 сверху вниз).",
-                        context=context
-                    )
-                    continue  # Пропустить оставшуюся часть цикла, так как позиция закрыта
-                elif current_position_side == "sell" and rsi_value > 50:
-                    logging.info(
-                        "Закрытие короткой позиции по RSI (пересечение 50 снизу вверх)...")
-                    bybit_api.place_order(SYMBOL, "Buy", position_size)
-                    trade_logger.log_trade(
-                        action="BUY",
-                        symbol=SYMBOL,
-                        price=previous_close,
-                        quantity=position_size,
-                        reason="Закрытие короткой позиции по RSI (пересечение 50 снизу вверх).",
-                        context=context
-                    )
-                    continue  # Пропустить оставшуюся часть цикла, так как позиция закрыта
-
-            # Формирование контекста для логирования
-            context = {
-                "has_open_position": has_open_position,
-                "current_position_side": current_position_side,
-                "cross_flag": cross_flag,
-                "rsi_value": rsi_value,
-            }
-
-            # Логика открытия/закрытия позиций
-            if signal == "BUY":
-                if has_open_position:
-                    if current_position_side == "sell":
-                        logging.info(
-                            "Закрытие короткой позиции перед открытием длинной...")
-                        bybit_api.place_order(SYMBOL, "Buy", position_size)
-                        trade_logger.log_trade(
-                            action="BUY",
-                            symbol=SYMBOL,
-                            price=previous_close,
-                            quantity=position_size,
-                            reason="Закрытие короткой позиции перед открытием длинной.",
-                            context=context
-                        )
-                    else:
-                        logging.info(
-                            "Длинная позиция уже открыта. Новый ордер не размещается.")
-                else:
-                    # Проверка на золотой крест перед открытием новой позиции
-                    if cross_flag == "golden_cross":
-                        logging.info("Сигнал на покупку. Размещение ордера...")
-                        bybit_api.place_order(SYMBOL, "Buy", position_size)
-                        trade_logger.log_trade(
-                            action="BUY",
-                            symbol=SYMBOL,
-                            price=previous_close,
-                            quantity=position_size,
-                            reason="Сигнал на покупку: цена выше облака Ишимоку, Tenkan Sen > Kijun Sen, RSI < 70.",
-                            context=context
-                        )
-                    else:
-                        logging.info(
-                            "Сигнал на покупку есть, но золотой крест не сформирован. Позиция не открыта.")
-            elif signal == "SELL":
-                if has_open_position:
-                    if current_position_side == "buy":
-                        logging.info(
-                            "Закрытие длинной позиции перед открытием короткой...")
-                        bybit_api.place_order(SYMBOL, "Sell", position_size)
-                        trade_logger.log_trade(
-                            action="SELL",
-                            symbol=SYMBOL,
-                            price=previous_close,
-                            quantity=position_size,
-                            reason="Закрытие длинной позиции перед открытием короткой.",
-                            context=context
-                        )
-                    else:
-                        logging.info(
-                            "Короткая позиция уже открыта. Новый ордер не размещается.")
-                else:
-                    # Проверка на мертвый крест перед открытием новой позиции
-                    if cross_flag == "death_cross":
-                        logging.info("Сигнал на продажу. Размещение ордера...")
-                        bybit_api.place_order(SYMBOL, "Sell", position_size)
-                        trade_logger.log_trade(
-                            action="SELL",
-                            symbol=SYMBOL,
-                            price=previous_close,
-                            quantity=position_size,
-                            reason="Сигнал на продажу: цена ниже облака Ишимоку, Tenkan Sen < Kijun Sen, RSI > 30.",
-                            context=context
-                        )
-                    else:
-                        logging.info(
-                            "Сигнал на продажу есть, но мертвый крест не сформирован. Позиция не открыта.")
-            else:
-                logging.info("Нет торгового сигнала.")
-
-            time.sleep(60)  # Пауза между итерациями (60 секунд)
-
+            with profiler.iteration():
+                repeat = run_iteration()
+            if not repeat and market_data is not None:
+                # Хаб сообщает о закрытой свече сам, как только опубликует её
+                if not market_data.wait(SYMBOL, INTERVAL, scheduler.delay() + scheduler.retry):
+                    scheduler.wait_retry()
+            elif not repeat:
+                scheduler.wait()  # Ожидание закрытия следующей свечи
         except Exception as e:
+            metrics.increment("errors_total", source="main_loop")
             logging.error(f"Ошибка в основном цикле: {e}", exc_info=True)
-            time.sleep(60)
+            scheduler.wait_retry()
 
 
 if __name__ == "__main__":
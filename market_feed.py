@@ -0,0 +1,110 @@
+import logging
+import queue
+import threading
+import numpy as np
+from candles import CandleBuffer
+from transport import ExchangeError
+
+
+class KlineFeed:
+    """
+    Поток свечей через публичный WebSocket kline.{interval}.{symbol}.
+
+    Свечи держатся в памяти (CandleBuffer); по флагу confirm вызывается on_close
+    с закрытыми свечами. При обрыве соединения выполняется переподключение
+    с задержкой и догрузка пропущенных свечей по REST.
+    """
+
+    def __init__(self, api, symbol, interval, on_close, check_interval=5):
+        self.api = api
+        self.symbol = symbol
+        self.interval = interval
+        self.on_close = on_close
+        self.check_interval = check_interval
+        self.running = False
+
+        self._buffer = None
+        self._lock = threading.Lock()
+        self._closed = queue.Queue()
+        self._last_closed = None
+        self._gap = False  # догрузка по REST не удалась и будет повторена
+
+    def _fill_gap(self):
+        """ Догрузка свечей по REST (при старте и после переподключения) """
+        self._gap = True
+        try:
+            candles = self.api.get_candles(self.symbol, self.interval)
+        except ExchangeError as e:
+            logging.error(f"Не удалось догрузить свечи по REST: {e}")
+            return
+        self._gap = False
+        with self._lock:
+            if self._buffer is None:
+                self._buffer = CandleBuffer(candles)
+            else:
+                self._buffer.extend(candles)
+        # Все свечи из REST, кроме последней, уже закрыты
+        if len(candles) >= 2:
+            self._closed.put(int(candles.timestamp[-2]))
+
+    def _connect(self):
+        self.api.connect_websocket(channel_type="linear")
+        self.api.subscribe_kline(self.symbol, self.interval, self._on_kline)
+
+    def _reconnect(self):
+        logging.warning("WebSocket отключён, переподключение...")
+        self.api.close_websocket()
+        self._connect()
+        self._fill_gap()
+
+    def _on_kline(self, message):
+        try:
+            for item in message.get("data", []):
+                timestamp = int(item["start"])
+                row = (timestamp, float(item["open"]), float(item["high"]), float(item["low"]),
+                       float(item["close"]), float(item["volume"]), float(item["turnover"]))
+                with self._lock:
+                    if self._buffer is None:
+                        continue
+                    self._buffer.upsert(row)
+                if item.get("confirm"):
+                    self._closed.put(timestamp)
+        except Exception as e:
+            logging.error(f"Ошибка обработки свечи WebSocket: {e}", exc_info=True)
+
+    def closed_candles(self, timestamp):
+        """
+        Закрытые свечи до указанной включительно (представление без копирования).
+        """
+        with self._lock:
+            candles = self._buffer.series()
+        end = int(np.searchsorted(candles.timestamp, timestamp, side="right"))
+        return candles[:end]
+
+    def run(self):
+        """
+        Основной цикл: ожидание закрытия свечей и контроль соединения.
+        """
+        self.running = True
+        # Сначала подписка, затем REST: свечи, закрывшиеся во время загрузки, придут из потока
+        self._connect()
+        self._fill_gap()
+        while self.running:
+            try:
+                timestamp = self._closed.get(timeout=self.check_interval)
+            except queue.Empty:
+                if not self.api.is_websocket_connected():
+                    self._reconnect()
+                elif self._gap:
+                    self._fill_gap()
+                continue
+
+            # Одна и та же свеча может прийти и из REST, и из WebSocket
+            if self._last_closed is not None and timestamp <= self._last_closed:
+                continue
+            self._last_closed = timestamp
+            self.on_close(self.closed_candles(timestamp))
+        self.api.close_websocket()
+
+    def stop(self):
+        self.running = False
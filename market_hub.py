@@ -0,0 +1,465 @@
+import argparse
+import contextlib
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from dotenv import load_dotenv
+from candles import CandleSeries, is_continuous
+from indicators import IchimokuEngine, IndicatorLines
+from scheduler import IntervalScheduler
+from transport import ExchangeError
+
+# Столбцы сегмента разделяемой памяти: свечи и ряды индикаторов по ним
+COLUMNS = CandleSeries.COLUMNS + IndicatorLines._fields
+# Заголовок сегмента (int64): счётчик seqlock (нечётный во время записи), число свечей,
+# время открытия последней закрытой свечи, ёмкость
+HEADER = 4
+SEQ, ROWS, LAST_CLOSED, CAPACITY = range(HEADER)
+# Пауза между попытками чтения, пока хаб пишет окно (растёт вдвое от первой до последней), с
+READ_MIN_DELAY = 0.00001
+READ_MAX_DELAY = 0.001
+
+
+class _Segment:
+    """
+    Окно последних свечей и индикаторов символа в разделяемой памяти: заголовок
+    и таблица столбцов COLUMNS x capacity (float64; время свечей в float64 точное).
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.header = np.ndarray((HEADER,), dtype=np.int64, buffer=memory.buf)
+        capacity = int(self.header[CAPACITY])
+        self.data = np.ndarray((len(COLUMNS), capacity), dtype=np.float64, buffer=memory.buf, offset=HEADER * 8)
+
+    @classmethod
+    def create(cls, name, capacity):
+        memory = shared_memory.SharedMemory(name=name, create=True, size=(HEADER + len(COLUMNS) * capacity) * 8)
+        np.ndarray((HEADER,), dtype=np.int64, buffer=memory.buf)[:] = (0, 0, -1, capacity)
+        return cls(memory)
+
+    @classmethod
+    def attach(cls, name):
+        # Сегментом владеет хаб: клиент не должен удалять его при своём завершении
+        try:
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:  # Python < 3.13
+            memory = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(memory._name, "shared_memory")
+        return cls(memory)
+
+    def write(self, columns, rows, last_closed):
+        self.header[SEQ] += 1
+        self.data[:, :rows] = columns
+        self.header[ROWS] = rows
+        self.header[LAST_CLOSED] = last_closed
+        self.header[SEQ] += 1
+
+    def read(self, attempts=1000):
+        """
+        Согласованная копия окна: если хаб писал во время чтения, чтение повторяется.
+
+        :return: Кортеж (таблица столбцов, время последней закрытой свечи).
+        """
+        delay = 0.0
+        for _ in range(attempts):
+            seq = int(self.header[SEQ])
+            if not seq % 2:
+                columns = self.data[:, :int(self.header[ROWS])].copy()
+                last_closed = int(self.header[LAST_CLOSED])
+                if int(self.header[SEQ]) == seq:
+                    return columns, last_closed
+            # Хаб пишет окно: уступаем процессор, затем ждём дольше, а не крутимся в цикле
+            time.sleep(delay)
+            delay = min(READ_MAX_DELAY, delay * 2 or READ_MIN_DELAY)
+        raise ExchangeError("Не удалось прочитать свечи из разделяемой памяти хаба.")
+
+    def close(self, unlink=False):
+        # Представления NumPy держат буфер: без их удаления mmap не закрывается
+        self.header = self.data = None
+        self.memory.close()
+        if unlink:
+            with contextlib.suppress(FileNotFoundError):
+                self.memory.unlink()
+
+
+class _Feed:
+    """
+    Свечи одного символа и интервала в хабе: индикаторы считаются потоково по
+    каждой новой закрытой свече, окно последних capacity свечей публикуется в сегмент.
+    """
+
+    def __init__(self, symbol, interval, name, capacity):
+        self.symbol = symbol
+        self.interval = interval
+        self.capacity = capacity
+        self.segment = _Segment.create(name, capacity)
+        self.engine = IchimokuEngine()
+        self.lines = deque(maxlen=capacity)  # значения IndicatorLines по закрытым свечам
+        self.last_timestamp = None
+        self.last_key = None
+
+    def update(self, candles):
+        """
+        Учёт новых свечей и публикация окна.
+
+        :param candles: CandleSeries с формирующейся свечой в конце (как BybitAPI.get_candles).
+        :return: True, если появилась новая закрытая свеча.
+        """
+        closed = candles.closed()
+        if self.last_timestamp is not None and len(closed):
+            # Разрыв в истории, пропуск свечи или учтённая свеча изменилась задним числом -
+            # считаем с нуля, как Strategy
+            position = int(np.searchsorted(closed.timestamp, self.last_timestamp))
+            continuous = is_continuous(closed[position:], self.interval)
+            if not continuous:
+                logging.warning(f"Пропуск свечей {self.symbol} {self.interval} после {self.last_timestamp}: "
+                                f"индикаторы хаба пересчитываются с нуля.")
+            if closed.timestamp[0] > self.last_timestamp or (
+                    position < len(closed) and closed.key(position) != self.last_key) or not continuous:
+                self.engine.reset()
+                self.lines.clear()
+                self.last_timestamp = None
+
+        fresh = closed if self.last_timestamp is None else closed.since(self.last_timestamp)
+        engine = self.engine
+        for high, low, close in zip(fresh.high.tolist(), fresh.low.tolist(), fresh.close.tolist()):
+            engine.update(high, low, close)
+            self.lines.append((engine.tenkan_sen, engine.kijun_sen, engine.senkou_span_a,
+                               engine.senkou_span_b, engine.rsi))
+        if len(fresh):
+            self.last_timestamp = int(fresh.timestamp[-1])
+            self.last_key = closed.key()
+        self._publish(candles)
+        return len(fresh) > 0
+
+    def _publish(self, candles):
+        rows = min(len(candles), self.capacity)
+        if not rows:
+            return
+        start = len(candles) - rows
+        columns = np.full((len(COLUMNS), rows), np.nan)
+        for index, name in enumerate(CandleSeries.COLUMNS):
+            columns[index] = getattr(candles, name)[start:]
+        # У формирующейся свечи индикаторов нет
+        closed_rows = min(rows - 1, len(self.lines))
+        if closed_rows:
+            lines = np.array([self.lines[index] for index in range(len(self.lines) - closed_rows, len(self.lines))])
+            columns[len(CandleSeries.COLUMNS):, rows - 1 - closed_rows:rows - 1] = lines.T
+        last_closed = self.last_timestamp if self.last_timestamp is not None else -1
+        self.segment.write(columns, rows, last_closed)
+
+
+class MarketHub:
+    """
+    Единственный процесс, который ходит на биржу за свечами для нескольких ботов.
+
+    Хаб держит историю свечей (через KlineCache в api.get_candles), после
+    закрытия каждой свечи один раз считает по ней Ишимоку и RSI и публикует окно
+    последних capacity свечей с рядами индикаторов в разделяемую память - по
+    сегменту на символ и интервал. Подписчики получают через Unix-сокет имя
+    сегмента и уведомление "candle СИМВОЛ ИНТЕРВАЛ ВРЕМЯ" о каждой новой закрытой
+    свече; данные читаются из памяти без копирования через сокет (см. HubClient).
+
+    :param api: BybitAPI (достаточно публичных методов).
+    :param feeds: Список пар (символ, интервал).
+    :param path: Путь Unix-сокета.
+    :param capacity: Свечей в окне сегмента.
+    :param grace: Задержка запроса свечей после закрытия свечи, с.
+    """
+
+    def __init__(self, api, feeds, path="market_hub.sock", capacity=2000, grace=2.0):
+        self.api = api
+        self.path = path
+        self.capacity = capacity
+        self.grace = grace
+        self.feeds = {}
+        for symbol, interval in feeds:
+            name = f"ishimoku_{os.getpid()}_{symbol}_{interval}"
+            self.feeds[(symbol, str(interval))] = _Feed(symbol, str(interval), name, capacity)
+        self._subscribers = {key: set() for key in self.feeds}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def poll(self, interval):
+        """
+        Загрузка свечей всех символов интервала, публикация и уведомление подписчиков.
+        """
+        for feed in [feed for feed in self.feeds.values() if feed.interval == str(interval)]:
+            try:
+                candles = self.api.get_candles(feed.symbol, feed.interval)
+            except ExchangeError as e:
+                logging.warning(f"Не удалось получить свечи {feed.symbol} {feed.interval}: {e}")
+                continue
+            if feed.update(candles):
+                self._notify(feed)
+
+    def _notify(self, feed):
+        line = f"candle {feed.symbol} {feed.interval} {feed.last_timestamp}\n".encode("utf-8")
+        with self._lock:
+            subscribers = list(self._subscribers[(feed.symbol, feed.interval)])
+        for connection in subscribers:
+            try:
+                connection.sendall(line)
+            except OSError:
+                self._drop(connection)
+
+    def _drop(self, connection):
+        with self._lock:
+            for subscribers in self._subscribers.values():
+                subscribers.discard(connection)
+        with contextlib.suppress(OSError):
+            connection.close()
+
+    def serve(self):
+        """ Запуск Unix-сокета подписок """
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        server.listen(16)
+        self._server = server
+        threading.Thread(target=self._accept, args=(server,), name="MarketHubAccept", daemon=True).start()
+        logging.info(f"Хаб рыночных данных: {self.path}, потоков свечей: {len(self.feeds)}")
+
+    def _accept(self, server):
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._session, args=(connection,), name="MarketHubClient", daemon=True).start()
+
+    def _session(self, connection):
+        # Команды клиента: "subscribe СИМВОЛ ИНТЕРВАЛ", ответ "ok ИМЯ_СЕГМЕНТА" или "error ТЕКСТ"
+        try:
+            for line in connection.makefile("r", encoding="utf-8"):
+                parts = line.split()
+                if len(parts) != 3 or parts[0] != "subscribe":
+                    reply = "error неизвестная команда"
+                elif (parts[1], parts[2]) not in self.feeds:
+                    reply = f"error хаб не публикует {parts[1]} {parts[2]}"
+                else:
+                    key = (parts[1], parts[2])
+                    with self._lock:
+                        self._subscribers[key].add(connection)
+                    reply = f"ok {self.feeds[key].segment.memory.name}"
+                connection.sendall((reply + "\n").encode("utf-8"))
+        except OSError:
+            pass
+        self._drop(connection)
+
+    def _run_interval(self, interval):
+        scheduler = IntervalScheduler(interval, self.grace)
+        while True:
+            try:
+                self.poll(interval)
+                scheduler.wait()
+            except Exception as e:
+                logging.error(f"Ошибка хаба рыночных данных ({interval}): {e}", exc_info=True)
+                scheduler.wait_retry()
+
+    def run(self):
+        """
+        Первая публикация, запуск сокета и опрос по границам свечей каждого интервала
+        в своём потоке. Блокирует до прерывания.
+        """
+        intervals = sorted({feed.interval for feed in self.feeds.values()})
+        for interval in intervals:
+            self.poll(interval)
+        self.serve()
+        threads = [threading.Thread(target=self._run_interval, args=(interval,), name=f"MarketHub-{interval}",
+                                    daemon=True) for interval in intervals]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        finally:
+            self.close()
+
+    def close(self):
+        """ Остановка сокета и удаление сегментов разделяемой памяти """
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path)
+        for feed in self.feeds.values():
+            feed.segment.close(unlink=True)
+
+
+class HubClient:
+    """
+    Источник свечей для бота из MarketHub вместо биржи: get_candles с тем же
+    результатом, что у BybitAPI.get_candles (формирующаяся свеча последней), и
+    готовые ряды индикаторов по закрытым свечам для Strategy.
+
+    Запросов к бирже за свечами клиент не делает; интервалы, которые хаб не
+    публикует, дают ExchangeError (как недоступная биржа).
+
+    :param path: Путь Unix-сокета хаба.
+    :param timeout: Ожидание ответа хаба на подписку, с.
+    """
+
+    def __init__(self, path="market_hub.sock", timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._socket = None
+        self._replies = queue.Queue()
+        self._segments = {}  # (символ, интервал) -> _Segment
+        self._published = {}  # (символ, интервал) -> время последней закрытой свечи из уведомления
+        self._consumed = {}  # (символ, интервал) -> время последней закрытой свечи при чтении
+        self._snapshots = {}  # (символ, интервал) -> (время свечей, IndicatorLines) последнего чтения
+        self._lock = threading.Lock()
+        self._condition = threading.Condition()
+
+    def _connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.path)
+        except OSError as e:
+            connection.close()
+            raise ExchangeError(f"Хаб рыночных данных недоступен ({self.path}): {e}")
+        for segment in self._segments.values():
+            segment.close()
+        self._segments.clear()
+        self._replies = queue.Queue()
+        self._socket = connection
+        threading.Thread(target=self._read, args=(connection, self._replies), name="HubClient",
+                         daemon=True).start()
+
+    def _read(self, connection, replies):
+        try:
+            for line in connection.makefile("r", encoding="utf-8"):
+                parts = line.split()
+                if parts and parts[0] == "candle" and len(parts) == 4:
+                    with self._condition:
+                        self._published[(parts[1], parts[2])] = int(parts[3])
+                        self._condition.notify_all()
+                elif parts:
+                    replies.put(parts)
+        except OSError:
+            pass
+        with self._condition:
+            # После close() сокет уже снят: закрытие клиентом - не потеря связи
+            if self._socket is connection:
+                logging.warning("Соединение с хабом рыночных данных потеряно.")
+                self._socket = None
+            self._condition.notify_all()
+        replies.put(None)
+
+    def _segment(self, key):
+        with self._lock:
+            if self._socket is None:
+                self._connect()
+            segment = self._segments.get(key)
+            if segment is None:
+                self._socket.sendall(f"subscribe {key[0]} {key[1]}\n".encode("utf-8"))
+                try:
+                    reply = self._replies.get(timeout=self.timeout)
+                except queue.Empty:
+                    reply = None
+                if reply is None:
+                    raise ExchangeError("Хаб рыночных данных не ответил на подписку.")
+                if reply[0] != "ok":
+                    raise ExchangeError(" ".join(reply[1:]))
+                segment = self._segments[key] = _Segment.attach(reply[1])
+            return segment
+
+    def get_candles(self, symbol, interval):
+        """
+        Окно последних свечей из хаба.
+
+        :return: CandleSeries в хронологическом порядке (последняя свеча формируется).
+        """
+        key = (symbol, str(interval))
+        columns, last_closed = self._segment(key).read()
+        width = len(CandleSeries.COLUMNS)
+        candles = CandleSeries(columns[0].astype(np.int64), *columns[1:width])
+        self._snapshots[key] = (candles.timestamp, IndicatorLines(*columns[width:]))
+        self._consumed[key] = last_closed
+        return candles
+
+    def indicator_lines(self, symbol, interval, timestamp):
+        """
+        Ряды индикаторов из последнего чтения get_candles до закрытой свечи timestamp включительно.
+
+        :return: IndicatorLines или None, если такой закрытой свечи в окне нет.
+        """
+        snapshot = self._snapshots.get((symbol, str(interval)))
+        if snapshot is None:
+            return None
+        timestamps, lines = snapshot
+        position = int(np.searchsorted(timestamps, timestamp))
+        # Последняя свеча окна формируется, индикаторов по ней нет
+        if position >= len(timestamps) - 1 or timestamps[position] != timestamp:
+            return None
+        return IndicatorLines(*(values[:position + 1] for values in lines))
+
+    def wait(self, symbol, interval, timeout=None):
+        """
+        Ожидание уведомления о закрытой свече, которую get_candles ещё не возвращал.
+
+        :return: True, если новая свеча опубликована; False по таймауту или при потере связи.
+        """
+        key = (symbol, str(interval))
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._published.get(key, -1) > self._consumed.get(key, -1) or self._socket is None,
+                timeout) and self._socket is not None
+
+    def close(self):
+        with self._lock:
+            # Сокет снимается до закрытия: поток чтения, увидев конец потока, его уже не трогает
+            with self._condition:
+                connection, self._socket = self._socket, None
+                self._condition.notify_all()
+            if connection is not None:
+                with contextlib.suppress(OSError):
+                    connection.shutdown(socket.SHUT_RDWR)
+                connection.close()
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+
+
+def main():
+    from exchange import BybitAPI
+    from kline_cache import KlineCache
+    from log_pipeline import env_settings as log_env_settings, setup_logging
+    from rate_limit import RateLimiter
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Хаб рыночных данных: свечи и индикаторы для нескольких ботов.")
+    parser.add_argument("--symbols", default=os.getenv("SYMBOLS", os.getenv("SYMBOL", "")),
+                        help="Символы через запятую")
+    parser.add_argument("--intervals", default=os.getenv("INTERVAL", "15"), help="Интервалы через запятую")
+    parser.add_argument("--socket", default=os.getenv("MARKET_HUB_SOCKET") or "market_hub.sock")
+    parser.add_argument("--capacity", type=int, default=int(os.getenv("MARKET_HUB_CAPACITY", 2000)),
+                        help="Свечей в окне разделяемой памяти")
+    args = parser.parse_args()
+
+    setup_logging("market_hub.log", **log_env_settings())
+    api = BybitAPI(os.getenv("API_KEY"), os.getenv("API_SECRET"), os.getenv("TESTNET", "True") == "True",
+                   kline_cache=KlineCache(os.getenv("KLINE_CACHE_DIR", "kline_cache")),
+                   rate_limiter=RateLimiter())
+    symbols = [symbol.strip() for symbol in args.symbols.split(",") if symbol.strip()]
+    intervals = [interval.strip() for interval in args.intervals.split(",") if interval.strip()]
+    hub = MarketHub(api, [(symbol, interval) for symbol in symbols for interval in intervals], args.socket,
+                    args.capacity, float(os.getenv("SCHEDULE_GRACE", 2)))
+    try:
+        hub.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
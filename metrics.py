@@ -0,0 +1,201 @@
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import math
+import threading
+import time
+
+# Префикс имён метрик в формате Prometheus
+PREFIX = "trading_"
+
+# Квантили, которые отдаются в Prometheus и в сводке
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """
+    Гистограмма с логарифмически-линейными корзинами (как в HdrHistogram):
+    каждый интервал [2^k, 2^(k+1)) делится на sub_buckets равных частей,
+    поэтому относительная погрешность квантилей не больше 1/sub_buckets
+    при любом разбросе значений, а память не зависит от числа измерений.
+
+    :param lowest: Наименьшее различимое значение (по умолчанию 1 мкс).
+    """
+
+    def __init__(self, sub_buckets=32, lowest=1e-6):
+        self.sub_buckets = sub_buckets
+        self.lowest = lowest
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value):
+        scaled = value / self.lowest
+        if scaled < 1:
+            return 0
+        mantissa, exponent = math.frexp(scaled)  # scaled = mantissa * 2^exponent, mantissa в [0.5, 1)
+        return exponent * self.sub_buckets + int((mantissa * 2 - 1) * self.sub_buckets)
+
+    def _value(self, index):
+        # Середина корзины
+        exponent, sub = divmod(index, self.sub_buckets)
+        return self.lowest * 2.0 ** (exponent - 1) * (1 + (sub + 0.5) / self.sub_buckets)
+
+    def record(self, value):
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+
+class Registry:
+    """
+    Счётчики и гистограммы с метками, общие для всех потоков процесса.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.record(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Замер времени блока в секундах: with registry.timer("stage_seconds", stage="balance"): ...
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self):
+        """
+        Текст в формате Prometheus: гистограммы как summary (квантили, _sum, _count).
+        """
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                metric = PREFIX + name
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} summary")
+                    typed.add(metric)
+                for q in QUANTILES:
+                    lines.append(f"{metric}{_labels(labels + (('quantile', q),))} {histogram.quantile(q):.9g}")
+                lines.append(f"{metric}_sum{_labels(labels)} {histogram.total:.9g}")
+                lines.append(f"{metric}_count{_labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                metric = PREFIX + name
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Однострочная сводка: p50/p99 каждой гистограммы в миллисекундах и значения счётчиков.
+        """
+        parts = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                label = ",".join(str(value) for _, value in labels)
+                parts.append(
+                    f"{name}[{label}] p50={histogram.quantile(0.5) * 1000:.1f}мс "
+                    f"p99={histogram.quantile(0.99) * 1000:.1f}мс n={histogram.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                label = ",".join(str(value) for _, value in labels)
+                parts.append(f"{name}[{label}]={value}")
+        return "; ".join(parts)
+
+
+def _key(name, labels):
+    # Значения меток приводятся к строкам, чтобы ключи сортировались при выводе
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# Общий реестр процесса
+REGISTRY = Registry()
+increment = REGISTRY.increment
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+def serve(port, host="127.0.0.1", registry=REGISTRY):
+    """
+    Запуск HTTP-эндпоинта /metrics в фоновом потоке.
+
+    :return: Экземпляр сервера (server.shutdown() для остановки).
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    logging.info(f"Метрики доступны на http://{host}:{server.server_port}/metrics")
+    return server
+
+
+def start_summary(interval=300, registry=REGISTRY):
+    """
+    Периодическая запись сводки метрик в лог из фонового потока.
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            line = registry.summary()
+            if line:
+                logging.info(f"Метрики: {line}")
+
+    threading.Thread(target=run, name="MetricsSummary", daemon=True).start()
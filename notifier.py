@@ -0,0 +1,170 @@
+import atexit
+import logging
+import queue
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import metrics
+
+
+class SmtpSink:
+    """
+    Отправка уведомлений по почте через одну постоянную SMTP-сессию.
+
+    Соединение открывается при первой отправке и переиспользуется; при обрыве
+    выполняется переподключение и повторная отправка.
+    """
+
+    def __init__(self, sender, recipient, password=None, host="smtp.yandex.ru", port=587,
+                 starttls=True, timeout=10):
+        self.sender = sender
+        self.recipient = recipient
+        self.password = password
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.timeout = timeout
+        self._server = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.password:
+            server.login(self.sender, self.password)
+        self._server = server
+
+    def _is_alive(self):
+        if self._server is None:
+            return False
+        try:
+            return self._server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def send(self, subject, body):
+        msg = MIMEMultipart()
+        msg["From"] = self.sender
+        msg["To"] = self.recipient
+        msg["Subject"] = subject
+        msg.attach(MIMEText(body, "plain"))
+
+        for attempt in range(2):
+            if not self._is_alive():
+                self.close()
+                self._connect()
+            try:
+                self._server.sendmail(self.sender, self.recipient, msg.as_string())
+                return
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+class NotificationDispatcher:
+    """
+    Фоновая отправка уведомлений: вызывающий поток только кладёт сообщение в очередь.
+
+    Сообщения, пришедшие в течение digest_window секунд, объединяются в одну
+    сводку. При переполнении очереди новые сообщения отбрасываются с записью в лог,
+    торговый цикл при этом не ждёт.
+
+    :param sinks: Получатели с методом send(subject, body).
+    """
+
+    def __init__(self, sinks, subject="Торговое уведомление", max_queue=1000, digest_window=2.0,
+                 max_batch=50):
+        self.sinks = list(sinks)
+        self.subject = subject
+        self.digest_window = digest_window
+        self.max_batch = max_batch
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = object()
+        self._thread = threading.Thread(target=self._run, name="NotificationDispatcher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def notify(self, message):
+        """
+        Постановка сообщения в очередь без ожидания.
+
+        :return: False, если очередь переполнена и сообщение отброшено.
+        """
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logging.warning(f"Очередь уведомлений переполнена, отброшено сообщений: {self.dropped}")
+            return False
+
+    def _collect(self, first):
+        # Сбор сообщений, пришедших в пределах окна сводки
+        batch = [first]
+        deadline = time.monotonic() + self.digest_window
+        stop = False
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                message = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if message is self._stop:
+                stop = True
+                break
+            batch.append(message)
+        return batch, stop
+
+    def _deliver(self, batch):
+        if len(batch) == 1:
+            subject, body = self.subject, batch[0]
+        else:
+            subject = f"{self.subject}: сводка ({len(batch)})"
+            body = f"\n{'-' * 40}\n".join(batch)
+        logger = logging.getLogger("TradeLogger")
+        for sink in self.sinks:
+            try:
+                with metrics.timer("notification_seconds", sink=type(sink).__name__):
+                    sink.send(subject, body)
+                logger.info(f"Уведомление отправлено ({type(sink).__name__}, сообщений: {len(batch)}).")
+            except Exception as e:
+                metrics.increment("errors_total", source="notification")
+                logger.error(f"Ошибка при отправке уведомления ({type(sink).__name__}): {e}")
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is self._stop:
+                break
+            batch, stop = self._collect(message)
+            self._deliver(batch)
+            if stop:
+                break
+        for sink in self.sinks:
+            close = getattr(sink, "close", None)
+            if close is not None:
+                close()
+
+    def close(self, timeout=30):
+        """
+        Отправка оставшихся сообщений и остановка фонового потока.
+        """
+        if self._thread.is_alive():
+            self._queue.put(self._stop, timeout=timeout)
+            self._thread.join(timeout)
@@ -0,0 +1,244 @@
+import argparse
+import csv
+import itertools
+import logging
+from multiprocessing import Pool, shared_memory
+import random
+import numpy as np
+from backtest import DEFAULT_FEE_RATE, Backtest
+from candles import CandleSeries
+from indicators import IndicatorArrays
+from kline_cache import KlineCache
+
+# Параметры, которые можно перебирать, и их значения по умолчанию
+DEFAULT_PARAMS = {
+    "rsi_overbought": 70,
+    "rsi_oversold": 30,
+    "risk_percent": 1.0,
+    "tenkan_period": 9,
+    "kijun_period": 26,
+    "senkou_b_period": 52,
+    "rsi_length": 14,
+    "cross_lookback": 3,
+}
+
+RESULT_FIELDS = ["fold", "phase", "start", "stop"] + list(DEFAULT_PARAMS) + [
+    "final_equity", "return_pct", "max_drawdown_pct", "trades", "fees"]
+
+# Столбцы свечей, которые нужны бэктесту (время хранится как float64 - точно до 2**53 мс)
+SHARED_COLUMNS = ("timestamp", "open", "high", "low", "close")
+
+
+class SharedCandles:
+    """
+    Свечи в общей памяти: рабочие процессы подключаются к ним по имени вместо
+    получения копии истории через pickle.
+    """
+
+    def __init__(self, candles):
+        self.length = len(candles)
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=max(1, 8 * len(SHARED_COLUMNS) * self.length))
+        table = np.ndarray((len(SHARED_COLUMNS), self.length), dtype=np.float64, buffer=self.memory.buf)
+        for row, name in enumerate(SHARED_COLUMNS):
+            table[row] = getattr(candles, name)
+
+    @property
+    def descriptor(self):
+        return self.memory.name, self.length
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+# Состояние рабочего процесса: подключённая общая память и свечи поверх неё
+_worker = {}
+
+
+def _attach(descriptor, balance, fee_rate, slippage):
+    # Предупреждения о размере позиции на каждой свече в воркерах не нужны
+    logging.getLogger().setLevel(logging.ERROR)
+    name, length = descriptor
+    memory = shared_memory.SharedMemory(name=name)
+    table = np.ndarray((len(SHARED_COLUMNS), length), dtype=np.float64, buffer=memory.buf)
+    empty = np.zeros(length)
+    _worker.update(
+        memory=memory,
+        candles=CandleSeries(table[0].astype(np.int64), table[1], table[2], table[3], table[4],
+                             empty, empty),
+        balance=balance, fee_rate=fee_rate, slippage=slippage)
+
+
+def _evaluate(task):
+    fold, phase, start, stop, params = task
+    params = dict(DEFAULT_PARAMS, **params)
+    indicator_params = {name: params[name] for name in (
+        "tenkan_period", "kijun_period", "senkou_b_period", "rsi_length", "cross_lookback")}
+    # Индикаторы считаются по всей истории до конца окна, как их видел бы работающий бот:
+    # в начале окна Ишимоку и RSI уже прогреты, торгуются и оцениваются только свечи окна
+    history = Backtest(_worker["candles"][:stop], rsi_overbought=params["rsi_overbought"],
+                       rsi_oversold=params["rsi_oversold"], **indicator_params).indicators()
+    arrays = IndicatorArrays(*(values[start:stop] for values in history))
+    result = Backtest(_worker["candles"][start:stop], _worker["balance"], params["risk_percent"],
+                      params["rsi_overbought"], params["rsi_oversold"], _worker["fee_rate"], _worker["slippage"],
+                      **indicator_params).run(arrays)
+
+    peak = np.maximum.accumulate(result.equity)
+    row = {"fold": fold, "phase": phase, "start": start, "stop": stop}
+    row.update(params)
+    row.update(
+        final_equity=float(result.equity[-1]),
+        return_pct=float((result.equity[-1] / _worker["balance"] - 1) * 100),
+        max_drawdown_pct=float(np.max((peak - result.equity) / peak) * 100),
+        trades=len(result.trades),
+        fees=float(sum(result.fees.values())))
+    return row
+
+
+def grid(space):
+    """
+    Все комбинации значений параметров.
+
+    :param space: Словарь параметр -> список значений.
+    """
+    names = list(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def random_search(space, count, seed=None):
+    """
+    Случайные комбинации значений параметров.
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield {name: rng.choice(values) for name, values in space.items()}
+
+
+def walk_forward_splits(length, folds, train_fraction=0.7):
+    """
+    Последовательные окна (train, test) для walk-forward проверки.
+
+    :return: Список кортежей ((start, stop) обучения, (start, stop) проверки).
+    """
+    size = length // folds
+    splits = []
+    for fold in range(folds):
+        start = fold * size
+        stop = length if fold == folds - 1 else start + size
+        middle = start + int((stop - start) * train_fraction)
+        splits.append(((start, middle), (middle, stop)))
+    return splits
+
+
+class Optimizer:
+    """
+    Перебор параметров стратегии в пуле процессов над общей историей свечей.
+
+    Результаты пишутся в CSV по мере готовности.
+    Требуется Python 3.8+ (multiprocessing.shared_memory).
+    """
+
+    def __init__(self, candles, balance=1000.0, fee_rate=DEFAULT_FEE_RATE, slippage=0.0,
+                 processes=None, metric="final_equity"):
+        self.candles = candles
+        self.balance = balance
+        self.fee_rate = fee_rate
+        self.slippage = slippage
+        self.processes = processes
+        self.metric = metric
+
+    def run(self, combinations, output, folds=1, train_fraction=0.7):
+        """
+        :param combinations: Список словарей параметров.
+        :param output: Путь к CSV с результатами.
+        :param folds: Количество walk-forward окон (1 - вся история без проверки).
+        :return: Список строк результатов.
+        """
+        combinations = list(combinations)
+        shared = SharedCandles(self.candles)
+        rows = []
+        try:
+            with open(output, "w", newline="", encoding="utf-8") as f, \
+                    Pool(self.processes, initializer=_attach,
+                         initargs=(shared.descriptor, self.balance, self.fee_rate, self.slippage)) as pool:
+                writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+                writer.writeheader()
+
+                def collect(tasks):
+                    fold_rows = []
+                    for row in pool.imap_unordered(_evaluate, tasks, chunksize=4):
+                        writer.writerow(row)
+                        f.flush()
+                        fold_rows.append(row)
+                    rows.extend(fold_rows)
+                    return fold_rows
+
+                if folds <= 1:
+                    collect([(0, "full", 0, len(self.candles), params) for params in combinations])
+                    return rows
+
+                for fold, (train, test) in enumerate(walk_forward_splits(len(self.candles), folds, train_fraction)):
+                    train_rows = collect([(fold, "train") + train + (params,) for params in combinations])
+                    best = max(train_rows, key=lambda row: row[self.metric])
+                    params = {name: best[name] for name in DEFAULT_PARAMS}
+                    logging.info(f"Окно {fold}: лучшие параметры {params} ({self.metric}={best[self.metric]:.2f})")
+                    collect([(fold, "test") + test + (params,)])
+            return rows
+        finally:
+            shared.close()
+
+
+def sort_results(path, key, reverse=True):
+    """
+    Чтение CSV результатов, отсортированного по столбцу.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    return sorted(rows, key=lambda row: float(row[key]), reverse=reverse)
+
+
+def _parse_space(items):
+    space = {}
+    for item in items:
+        name, values = item.split("=", 1)
+        if name not in DEFAULT_PARAMS:
+            raise ValueError(f"Неизвестный параметр: {name}")
+        cast = type(DEFAULT_PARAMS[name])
+        space[name] = [cast(value) for value in values.split(",")]
+    return space
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перебор параметров стратегии на свечах из локального кэша.")
+    parser.add_argument("symbol")
+    parser.add_argument("interval")
+    parser.add_argument("--param", action="append", default=[],
+                        help="Значения параметра, например rsi_overbought=60,70,80")
+    parser.add_argument("--random", type=int, help="Количество случайных комбинаций вместо полного перебора")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--folds", type=int, default=1)
+    parser.add_argument("--train-fraction", type=float, default=0.7)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--metric", default="final_equity")
+    parser.add_argument("--cache-dir", default="kline_cache")
+    parser.add_argument("--balance", type=float, default=1000.0)
+    parser.add_argument("--fee-rate", type=float, default=DEFAULT_FEE_RATE)
+    parser.add_argument("--slippage", type=float, default=0.0)
+    parser.add_argument("--output", default="optimizer_results.csv")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    space = _parse_space(args.param)
+    combinations = random_search(space, args.random, args.seed) if args.random else grid(space)
+    candles = KlineCache(args.cache_dir).load(args.symbol, args.interval).closed()
+
+    optimizer = Optimizer(candles, args.balance, args.fee_rate, args.slippage, args.processes, args.metric)
+    optimizer.run(combinations, args.output, args.folds, args.train_fraction)
+    for row in sort_results(args.output, args.metric)[:10]:
+        print({name: row[name] for name in ["fold", "phase"] + list(space) + [args.metric, "trades", "fees"]})
+
+
+if __name__ == "__main__":
+    main()
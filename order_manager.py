@@ -0,0 +1,396 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+import zlib
+import clock
+from exchange import BATCH_ORDER_LIMIT
+import metrics
+from transport import ExchangeError
+
+# Префикс orderLinkId ордеров бота
+LINK_PREFIX = "ik"
+
+# Максимальная длина orderLinkId Bybit
+LINK_ID_LIMIT = 36
+
+# Сколько последних отправленных orderLinkId помнит OrderManager
+SENT_HISTORY = 10000
+
+
+def _bounded_link_id(prefix, symbol, suffix):
+    # Слишком длинный символ заменяется его контрольной суммой, чтобы уложиться в LINK_ID_LIMIT
+    room = LINK_ID_LIMIT - len(prefix) - len(suffix) - 2
+    if len(symbol) > room:
+        symbol = f"{zlib.crc32(symbol.encode()):08x}"[:room]
+    value = f"{prefix}-{symbol}-{suffix}"
+    assert len(value) <= LINK_ID_LIMIT, value
+    return value
+
+
+def link_id(symbol, candle_timestamp, tag, prefix=LINK_PREFIX):
+    """
+    Идемпотентный orderLinkId: одно и то же решение по одной и той же свече
+    (например, повтор после перезапуска) получает тот же идентификатор, и биржа
+    не примет ордер второй раз.
+
+    :param candle_timestamp: Время открытия свечи, по которой принято решение, в мс.
+    :param tag: Код решения (короткая строка или число).
+    :return: Строка не длиннее LINK_ID_LIMIT символов.
+    """
+    return _bounded_link_id(prefix, symbol, f"{int(candle_timestamp) // 1000}-{tag}")
+
+
+class Order:
+    """
+    Ордер OrderManager: параметры решения, ответ биржи и исполнения.
+
+    :param expected_price: Цена, по которой принималось решение (для проскальзывания).
+    :param decided: Момент начала оценки (time.perf_counter) для метрик задержки.
+    :param candle_close_ms: Время закрытия свечи решения в мс.
+    :param tp: Тейк-профит позиции, открываемой ордером.
+    :param sl: Стоп-лосс позиции, открываемой ордером.
+    :param reduce_only: Ордер только уменьшает позицию (закрытие по стопу ExitEngine).
+    """
+
+    def __init__(self, symbol, side, qty, link_id, expected_price=None, reason=None, reason_code=None,
+                 context=None, decided=None, candle_close_ms=None, tp=None, sl=None, reduce_only=False):
+        self.symbol = symbol
+        self.side = side
+        self.qty = float(qty)
+        self.link_id = link_id
+        self.expected_price = expected_price
+        self.reason = reason
+        self.reason_code = reason_code
+        self.context = context or {}
+        self.decided = decided
+        self.candle_close_ms = candle_close_ms
+        self.tp = tp
+        self.sl = sl
+        self.reduce_only = reduce_only
+
+        self.order_id = None
+        self.error = None
+        self.duplicate = False  # ордер с этим orderLinkId был принят раньше, новый ордер не создан
+        self.latency_ms = None
+        self.acknowledged = threading.Event()  # ответ биржи получен (ордер принят или отклонён)
+        self.acknowledged_at = None
+        self.checked_at = None
+        self.executions = {}  # execId -> (qty, price, fee)
+        self.done = False
+        self.resent = False  # orderLinkId уже отправлялся этим процессом
+
+    @property
+    def filled_qty(self):
+        return sum(qty for qty, _, _ in self.executions.values())
+
+    @property
+    def filled(self):
+        return self.filled_qty >= self.qty - 1e-9
+
+    @property
+    def avg_price(self):
+        qty = self.filled_qty
+        return sum(qty * price for qty, price, _ in self.executions.values()) / qty if qty else None
+
+    @property
+    def fee(self):
+        return sum(fee for _, _, fee in self.executions.values())
+
+    def slippage_bps(self, price):
+        """ Проскальзывание цены исполнения относительно цены решения, б.п. (больше 0 - хуже) """
+        if not self.expected_price or price is None:
+            return None
+        direction = 1 if self.side == "Buy" else -1
+        return (price - self.expected_price) / self.expected_price * 1e4 * direction
+
+    def params(self):
+        """ Параметры place_order и place_batch_order для этого ордера """
+        params = {"order_link_id": self.link_id}
+        if self.tp is not None:
+            params["tp"] = self.tp
+        if self.sl is not None:
+            params["sl"] = self.sl
+        if self.reduce_only:
+            params["reduce_only"] = True
+        return params
+
+    def wait(self, timeout=None):
+        """
+        Ожидание ответа биржи.
+
+        :return: True, если биржа приняла новый ордер (не ошибка и не дубликат).
+        """
+        return self.acknowledged.wait(timeout) and self.error is None and not self.duplicate
+
+
+class OrderManager:
+    """
+    Размещение ордеров с идемпотентными orderLinkId, отправкой в фоновом потоке,
+    пакетными запросами и сверкой с исполнениями.
+
+    В асинхронном режиме submit только ставит ордер в очередь. Фоновый поток
+    собирает ордера, поступившие в пределах batch_window секунд (например,
+    сигналы нескольких символов одного цикла), и отправляет их одним запросом
+    order/create-batch; одиночный ордер отправляется обычным place_order.
+    С asynchronous=False ордер отправляется сразу в вызывающем потоке.
+
+    Принятые ордера сверяются с исполнениями: из приватного потока (on_execution,
+    подключается к AccountState.execution_listeners) или запросом get_executions
+    раз в reconcile_delay секунд. После исполнения в TradeLogger и журнал сделок
+    записываются средняя цена исполнения, комиссия и проскальзывание. Если за
+    fill_timeout секунд ордер не исполнился полностью, записывается исполненная
+    часть, а при её отсутствии - цена решения с пометкой.
+
+    :param api: BybitAPI или AccountState (place_order, place_batch_order, get_executions).
+    :param trade_logger: TradeLogger для записи исполненных сделок.
+    """
+
+    def __init__(self, api, trade_logger=None, asynchronous=True, batch=True, batch_window=0.01,
+                 reconcile_delay=1.0, fill_timeout=30.0, ack_timeout=15.0):
+        self.api = api
+        self.trade_logger = trade_logger
+        self.asynchronous = asynchronous
+        self.batch = batch
+        self.batch_window = batch_window
+        self.reconcile_delay = reconcile_delay
+        self.fill_timeout = fill_timeout
+        self.ack_timeout = ack_timeout
+        self._orders = {}  # orderLinkId -> Order: в очереди, отправленные и ждущие исполнения
+        self._sent = {}  # orderLinkId, уже отправленные этим процессом (последние SENT_HISTORY)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._counter = itertools.count(1)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.asynchronous and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="OrderManager", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, symbol, side, qty, link_id=None, **details):
+        """
+        Размещение ордера.
+
+        :param link_id: orderLinkId (см. link_id()); по умолчанию - уникальный по времени.
+        :param details: expected_price, reason, reason_code, context, decided, candle_close_ms, tp, sl,
+            reduce_only (см. Order).
+        :return: Order; в асинхронном режиме ответ биржи можно дождаться через Order.wait.
+        """
+        if link_id is None:
+            link_id = _bounded_link_id(LINK_PREFIX, symbol, f"{int(time.time() * 1000)}-{next(self._counter)}")
+        order = Order(symbol, side, qty, link_id, **details)
+        with self._lock:
+            existing = self._orders.get(link_id)
+            if existing is not None:
+                logging.warning(f"Ордер {link_id} уже отправлен, повтор не выполняется.")
+                return existing
+            self._orders[link_id] = order
+        if self.asynchronous:
+            self.start()
+            self._queue.put(order)
+        else:
+            self._send([order])
+            if order.error is None:
+                self._check(order)
+        return order
+
+    def in_flight(self, symbol):
+        """ Есть ли по символу ордер, на который ещё нет ответа биржи """
+        with self._lock:
+            return any(order.symbol == symbol and not order.acknowledged.is_set()
+                       for order in self._orders.values())
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = [self._queue.get(timeout=min(self.reconcile_delay, 0.5))]
+            except queue.Empty:
+                batch = []
+            if batch:
+                # Ордера, поступившие вслед за первым, уходят тем же запросом
+                limit = BATCH_ORDER_LIMIT if self.batch else 1
+                deadline = time.monotonic() + self.batch_window
+                while len(batch) < limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+            try:
+                if batch:
+                    self._send(batch)
+                self.reconcile()
+            except Exception as e:
+                metrics.increment("errors_total", source="order_manager")
+                logging.error(f"Ошибка обработки ордеров: {e}", exc_info=True)
+
+    def _send(self, orders):
+        with self._lock:
+            for order in orders:
+                order.resent = order.link_id in self._sent
+                self._sent[order.link_id] = True
+            while len(self._sent) > SENT_HISTORY:
+                del self._sent[next(iter(self._sent))]
+        if len(orders) == 1:
+            order = orders[0]
+            started = time.perf_counter()
+            try:
+                response = self.api.place_order(order.symbol, order.side, order.qty, **order.params())
+                result = (response or {}).get("result", {})
+            except Exception as e:
+                result = e
+            self._acknowledge(order, result, started)
+            return
+
+        started = time.perf_counter()
+        try:
+            results = self.api.place_batch_order([
+                dict(order.params(), symbol=order.symbol, side=order.side, qty=order.qty) for order in orders])
+        except Exception as e:
+            results = [e] * len(orders)
+        for order, result in zip(orders, results):
+            self._acknowledge(order, result, started)
+        # Ордера без ответа в пакете считаются не размещёнными, иначе символ остался бы занят
+        for order in orders[len(results):]:
+            self._acknowledge(order, ExchangeError("place_batch_order: нет ответа по ордеру в пакете"), started)
+
+    def _acknowledge(self, order, result, started):
+        finished = time.perf_counter()
+        order.latency_ms = (finished - started) * 1000
+        order.acknowledged_at = order.checked_at = clock.now()
+        if isinstance(result, Exception):
+            order.error = result
+            with self._lock:
+                self._orders.pop(order.link_id, None)
+            order.acknowledged.set()
+            metrics.increment("errors_total", source="order")
+            logging.error(f"Ордер {order.link_id} ({order.side} {order.qty} {order.symbol}) не размещён: {result}")
+            return
+
+        order.order_id = result.get("orderId") or None
+        if order.order_id is None and (order.resent or result.get("retried") is False):
+            # Ордер с этим orderLinkId уже отправлялся этим процессом (сделка записана по тому
+            # ордеру) или был принят до перезапуска: новой сделки нет, в журнал не записывается.
+            # Дубликат на повтор после таймаута - это сам ордер, он сверяется с исполнениями.
+            order.duplicate = True
+            order.acknowledged.set()
+            self._complete(order)
+            return
+        metrics.observe("stage_seconds", finished - started, stage="order")
+        metrics.increment("orders_total", side=order.side, reason_code=order.reason_code)
+        # Задержка от начала оценки и от закрытия свечи до подтверждения ордера
+        if order.decided is not None:
+            metrics.observe("decision_to_order_seconds", finished - order.decided)
+        if order.candle_close_ms is not None:
+            metrics.observe("candle_close_to_order_seconds", max(0.0, time.time() - order.candle_close_ms / 1000))
+        order.acknowledged.set()
+        if order.filled:
+            self._complete(order)
+
+    def on_execution(self, execution):
+        """
+        Исполнение из приватного потока execution.
+        """
+        if execution.get("execType", "Trade") != "Trade":
+            return
+        with self._lock:
+            order = self._orders.get(execution.get("orderLinkId"))
+            if order is None:
+                return
+            self._add_execution(order, execution)
+            if order.order_id is None:
+                order.order_id = execution.get("orderId")
+        if order.filled and order.acknowledged.is_set():
+            self._complete(order)
+
+    @staticmethod
+    def _add_execution(order, execution):
+        order.executions[execution["execId"]] = (
+            float(execution["execQty"]), float(execution["execPrice"]), float(execution.get("execFee") or 0))
+
+    def reconcile(self):
+        """
+        Сверка принятых, но не исполненных ордеров с исполнениями через REST.
+        """
+        now = clock.now()
+        with self._lock:
+            due = [order for order in self._orders.values()
+                   if order.acknowledged_at is not None and not order.done
+                   and now - order.checked_at >= self.reconcile_delay]
+        for order in due:
+            # Последняя проверка исполнений перед истечением fill_timeout: при редкой сверке
+            # (раз в свечу) иначе ордер записывался бы по цене решения
+            if self._check(order) or now - order.acknowledged_at < self.fill_timeout:
+                continue
+            logging.warning(f"Ордер {order.link_id} не исполнился полностью за {self.fill_timeout:.0f} с: "
+                            f"исполнено {order.filled_qty} из {order.qty}.")
+            self._complete(order)
+
+    def _check(self, order):
+        """
+        :return: True, если ордер исполнен полностью и записан.
+        """
+        order.checked_at = clock.now()
+        try:
+            executions = self.api.get_executions(order.symbol, order.link_id)
+        except Exception as e:
+            logging.warning(f"Не удалось получить исполнения ордера {order.link_id}: {e}")
+            return False
+        with self._lock:
+            for execution in executions:
+                if execution.get("execType", "Trade") == "Trade":
+                    self._add_execution(order, execution)
+                    if order.order_id is None:
+                        order.order_id = execution.get("orderId")
+        if not order.filled:
+            return False
+        self._complete(order)
+        return True
+
+    def _complete(self, order):
+        with self._lock:
+            if order.done:
+                return
+            order.done = True
+            self._orders.pop(order.link_id, None)
+        if order.duplicate:
+            logging.info(f"Ордер {order.link_id} уже был размещён, повторно в журнал не записывается.")
+            return
+        price = order.avg_price
+        slippage = order.slippage_bps(price)
+        additional_info = None
+        if price is None:
+            price = order.expected_price
+            additional_info = "Исполнение не подтверждено, указана цена решения."
+        elif not order.filled:
+            additional_info = f"Исполнено частично: {order.filled_qty} из {order.qty}."
+        logging.info("Ордер %s исполнен: %s %s %s по %s%s", order.link_id, order.side, order.filled_qty, order.symbol,
+                     price, f", проскальзывание {slippage:.1f} б.п." if slippage is not None else ".")
+        if self.trade_logger is None:
+            return
+        with metrics.timer("stage_seconds", stage="trade_log"):
+            self.trade_logger.log_trade(
+                action=order.side.upper(),
+                symbol=order.symbol,
+                price=price,
+                quantity=order.filled_qty or order.qty,
+                reason=order.reason,
+                context=order.context,
+                additional_info=additional_info,
+                reason_code=order.reason_code,
+                order_id=order.order_id,
+                latency_ms=order.latency_ms,
+                fee=order.fee if order.executions else None,
+                expected_price=order.expected_price,
+                slippage_bps=slippage
+            )
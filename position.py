@@ -0,0 +1,41 @@
+class Position:
+    """
+    Чистая позиция в одностороннем режиме: ордер противоположной стороны
+    уменьшает её, а при большем объёме разворачивает.
+    """
+
+    def __init__(self):
+        self.qty = 0.0  # > 0 - длинная, < 0 - короткая
+        self.entry_price = 0.0
+
+    @property
+    def side(self):
+        if self.qty > 0:
+            return "buy"
+        if self.qty < 0:
+            return "sell"
+        return None
+
+    def fill(self, side, qty, price):
+        """
+        Исполнение ордера.
+
+        :return: Реализованный PnL.
+        """
+        signed = qty if side == "Buy" else -qty
+        pnl = 0.0
+        if self.qty and (self.qty > 0) != (signed > 0):
+            closed = min(abs(self.qty), qty)
+            pnl = closed * (price - self.entry_price) * (1 if self.qty > 0 else -1)
+        new_qty = round(self.qty + signed, 8)
+        if new_qty == 0:
+            self.entry_price = 0.0
+        elif self.qty == 0 or (new_qty > 0) != (self.qty > 0):
+            self.entry_price = price
+        elif (new_qty > 0) == (signed > 0):
+            self.entry_price = (self.entry_price * abs(self.qty) + price * qty) / abs(new_qty)
+        self.qty = new_qty
+        return pnl
+
+    def unrealized(self, price):
+        return self.qty * (price - self.entry_price)
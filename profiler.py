@@ -0,0 +1,287 @@
+import argparse
+import collections
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import socket
+import sys
+import threading
+import time
+
+# Пустой контекст для итераций без профилирования: ни выделений памяти, ни вызовов
+_IDLE = contextlib.nullcontext()
+
+MODES = ("sample", "cprofile")
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class _Session:
+    """
+    Сеанс профилирования на iterations итераций: выборка стеков ("sample") или cProfile.
+    """
+
+    def __init__(self, mode, iterations, interval):
+        self.mode = mode
+        self.iterations = iterations
+        self.interval = interval
+        self.done = 0
+        self.started = time.time()
+        self.stacks = collections.Counter()  # "a.py:f;b.py:g" -> количество выборок
+        self.samples = 0
+        self.profile = cProfile.Profile() if mode == "cprofile" else None
+        self.thread_id = None  # поток текущей итерации (для выборки стеков)
+        self._active = threading.Event()
+        self._sampler = None
+        self.closed = False
+
+    def enter(self):
+        if self.profile is not None:
+            self.profile.enable()
+            return
+        self.thread_id = threading.get_ident()
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample, name="ProfilerSampler", daemon=True)
+            self._sampler.start()
+        self._active.set()
+
+    def exit(self):
+        if self.profile is not None:
+            self.profile.disable()
+        else:
+            self._active.clear()
+        self.done += 1
+
+    def _sample(self):
+        # Стеки снимаются только во время итерации: ожидание следующей свечи в выборку не попадает
+        while not self.closed:
+            if not self._active.wait(0.5):
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                names = []
+                while frame is not None:
+                    names.append(_frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(names))] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def write(self, directory, top=30):
+        """
+        Запись результатов сеанса.
+
+        :return: Список путей к записанным файлам.
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        base = os.path.join(directory, f"profile-{stamp}-{self.mode}")
+        paths = []
+        if self.profile is not None:
+            self.profile.dump_stats(base + ".prof")
+            paths.append(base + ".prof")
+            summary = io.StringIO()
+            pstats.Stats(self.profile, stream=summary).sort_stats("cumulative").print_stats(top)
+            text = summary.getvalue()
+        else:
+            # Формат collapsed stacks (flamegraph.pl, speedscope): "стек количество" в строке
+            with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            paths.append(base + ".collapsed")
+            text = self._summary(top)
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(text)
+        paths.append(base + ".txt")
+        return paths
+
+    def _summary(self, top):
+        own, total = collections.Counter(), collections.Counter()
+        for stack, count in self.stacks.items():
+            names = stack.split(";")
+            own[names[-1]] += count
+            for name in set(names):
+                total[name] += count
+        lines = [f"Итераций: {self.done}, выборок: {self.samples}, интервал: {self.interval * 1000:.1f} мс",
+                 "", f"{'своё %':>8} {'всего %':>8}  функция"]
+        samples = max(self.samples, 1)
+        for name, count in own.most_common(top):
+            lines.append(f"{count * 100 / samples:8.1f} {total[name] * 100 / samples:8.1f}  {name}")
+        return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """
+    Профилирование работающего бота по запросу, без перезапуска.
+
+    Цикл оборачивает каждую итерацию в iteration(); пока профилирование не
+    запрошено, это возврат готового пустого контекста. Запрос (сигнал, команда
+    через управляющий сокет или start()) включает сеанс на iterations итераций:
+    "sample" - выборка стека потока итерации каждые interval секунд, результат -
+    collapsed stacks для flamegraph и сводка по функциям; "cprofile" - cProfile
+    (файл .prof для pstats/snakeviz и сводка по cumulative).
+
+    :param directory: Каталог для результатов.
+    """
+
+    def __init__(self, directory="profiles", iterations=20, interval=0.005):
+        self.directory = directory
+        self.iterations = iterations
+        self.interval = interval
+        self.last_paths = []
+        self._session = None
+        self._requested = None  # (mode, iterations), выставляется из сигнала или сокета
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self, mode="sample", iterations=None):
+        """ Запрос сеанса; он начнётся с ближайшей итерации """
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим профилирования: {mode}.")
+        self._requested = (mode, iterations or self.iterations)
+
+    def stop(self):
+        """ Досрочное завершение сеанса с записью результатов """
+        with self._lock:
+            session, self._session = self._session, None
+            self._requested = None
+        if session is not None:
+            self._finish(session)
+
+    def status(self):
+        session = self._session
+        if session is not None:
+            return f"{session.mode}: итерация {session.done} из {session.iterations}"
+        if self._requested is not None:
+            return f"{self._requested[0]}: ожидание итерации"
+        return "ожидание" + (f"; последний результат: {', '.join(self.last_paths)}" if self.last_paths else "")
+
+    def iteration(self):
+        """
+        Контекст одной итерации цикла (with profiler.iteration(): ...).
+        """
+        if self._session is None and self._requested is None:
+            return _IDLE
+        return self._profiled()
+
+    @contextlib.contextmanager
+    def _profiled(self):
+        with self._lock:
+            if self._session is None and self._requested is not None:
+                mode, iterations = self._requested
+                self._requested = None
+                self._session = _Session(mode, iterations, self.interval)
+                logging.info(f"Профилирование ({mode}) на {iterations} итераций начато.")
+            session = self._session
+        if session is None:
+            yield
+            return
+        session.enter()
+        try:
+            yield
+        finally:
+            session.exit()
+            if session.done >= session.iterations:
+                with self._lock:
+                    finished = self._session is session
+                    if finished:
+                        self._session = None
+                if finished:
+                    self._finish(session)
+
+    def _finish(self, session):
+        session.closed = True
+        if session._sampler is not None:
+            session._active.set()
+            session._sampler.join(1)
+        try:
+            self.last_paths = session.write(self.directory)
+        except OSError as e:
+            logging.error(f"Не удалось записать результаты профилирования: {e}")
+            return
+        logging.info(f"Профилирование завершено ({session.done} итераций): {', '.join(self.last_paths)}")
+
+    def install_signals(self):
+        """
+        SIGUSR1 - сеанс "sample", SIGUSR2 - сеанс "cprofile" (только в основном потоке и на POSIX).
+        """
+        if not hasattr(signal, "SIGUSR1") or threading.current_thread() is not threading.main_thread():
+            return
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.start("sample"))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.start("cprofile"))
+
+    def serve(self, path):
+        """
+        Управляющий Unix-сокет: команды "sample [N]", "cprofile [N]", "stop", "status"
+        (одна строка на соединение, ответ - одна строка).
+        """
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen(4)
+        self._server = server
+        threading.Thread(target=self._accept, args=(server,), name="ProfilerControl", daemon=True).start()
+        logging.info(f"Управление профилированием: {path}")
+
+    def _accept(self, server):
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            with connection:
+                try:
+                    command = connection.makefile("r", encoding="utf-8").readline()
+                    reply = self.command(command)
+                except Exception as e:
+                    reply = f"ошибка: {e}"
+                with contextlib.suppress(OSError):
+                    connection.sendall((reply + "\n").encode("utf-8"))
+
+    def command(self, line):
+        """
+        Выполнение команды управляющего сокета.
+
+        :return: Текст ответа.
+        """
+        parts = line.split()
+        if not parts or parts[0] == "status":
+            return self.status()
+        if parts[0] == "stop":
+            self.stop()
+            return self.status()
+        iterations = int(parts[1]) if len(parts) > 1 else None
+        self.start(parts[0], iterations)
+        return self.status()
+
+
+def send(path, command):
+    """ Отправка команды работающему боту через управляющий сокет """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(5)
+        client.connect(path)
+        client.sendall((command + "\n").encode("utf-8"))
+        return client.makefile("r", encoding="utf-8").readline().strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Профилирование работающего бота через управляющий сокет.")
+    parser.add_argument("--socket", default=os.getenv("PROFILE_SOCKET", "profiler.sock"))
+    parser.add_argument("command", nargs="?", default="status", choices=MODES + ("stop", "status"))
+    parser.add_argument("iterations", nargs="?", type=int, help="Итераций в сеансе")
+    args = parser.parse_args()
+    command = args.command if args.iterations is None else f"{args.command} {args.iterations}"
+    print(send(args.socket, command))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import threading
+import time
+
+# Лимиты Bybit v5 (запросов в секунду) для используемых эндпоинтов.
+# Публичные эндпоинты ограничены по IP: 600 запросов за 5 секунд.
+DEFAULT_LIMITS = {
+    "market": 120,
+    "order/create": 10,
+    "order/create-batch": 10,
+    "position/list": 50,
+    "position/trading-stop": 10,
+    "account/wallet-balance": 50,
+    "execution/list": 50,
+}
+
+
+class TokenBucket:
+    """
+    Потокобезопасный токен-бакет: `rate` токенов в секунду, не более `capacity` сразу.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens=1):
+        """
+        Резервирование токенов.
+
+        :return: Время ожидания в секундах до момента, когда токены станут доступны.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= tokens
+            wait = max(0.0, -self._tokens / self.rate)
+            return max(wait, self._paused_until - now)
+
+    def pause(self, seconds):
+        """
+        Остановка выдачи токенов на seconds секунд (например, до сброса окна лимита биржи).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            self._paused_until = max(self._paused_until, now + seconds)
+
+    def acquire(self, tokens=1):
+        """
+        Блокирующее получение токенов (вызывается из рабочих потоков).
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Набор токен-бакетов по эндпоинтам Bybit, общий для всех символов процесса.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = dict(DEFAULT_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self._buckets = {endpoint: TokenBucket(rate) for endpoint, rate in self.limits.items()}
+
+    def bucket(self, endpoint):
+        return self._buckets[endpoint]
+
+    def acquire(self, endpoint, tokens=1):
+        bucket = self._buckets.get(endpoint)
+        if bucket is not None:
+            bucket.acquire(tokens)
+
+    def pause(self, endpoint, seconds):
+        bucket = self._buckets.get(endpoint)
+        if bucket is not None:
+            bucket.pause(seconds)
@@ -0,0 +1,359 @@
+import argparse
+import atexit
+from collections import deque
+import gzip
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import clock
+from candles import CandleSeries
+from kline_cache import KlineCache
+import transport
+
+# Версия формата записи
+FORMAT_VERSION = 1
+
+# Параметры main.py, сохраняемые в заголовке записи и восстанавливаемые при воспроизведении
+CONFIG_KEYS = ("SYMBOL", "INTERVAL", "RSI_OVERBOUGHT", "RSI_OVERSOLD", "CROSS_LOOKBACK", "RISK_PERCENT",
+               "MODE", "ACCOUNT_STREAM", "MTF_INTERVALS", "MTF_RULE", "ORDER_ASYNC", "EXIT_REWARD_RATIO",
+               "EXIT_TRAIL_PERCENT")
+
+
+def _normalize(params):
+    # Параметры в том виде, в каком они читаются из записи (кортежи -> списки и т.п.)
+    return json.loads(json.dumps(params))
+
+
+class Recorder:
+    """
+    Запись запросов REST и ответов биржи в сжатый журнал (gzip, одна JSON-строка на событие).
+
+    Каждый запуск начинается с заголовка с параметрами бота; при первом чтении
+    свечей из локального кэша в журнал один раз сохраняется его содержимое,
+    чтобы воспроизведение начиналось с той же истории. Файл дописывается,
+    сжатый поток сбрасывается на диск не реже раза в flush_interval секунд.
+
+    :param meta: Параметры запуска (словарь строк), например CONFIG_KEYS из main.py.
+    """
+
+    def __init__(self, path, meta=None, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+        self._cached = set()
+        atexit.register(self.close)
+        self._write({"type": "header", "version": FORMAT_VERSION, "t": clock.now(), "meta": meta or {}})
+        logging.info(f"Запись запросов к бирже в {path}")
+
+    def _write(self, entry):
+        line = json.dumps(entry, separators=(",", ":"), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            now = time.monotonic()
+            if now - self._flushed >= self.flush_interval:
+                self._file.flush()
+                self._flushed = now
+
+    def call(self, started, duration, endpoint, method, params, response=None, error=None):
+        """
+        Запись одного вызова transport: ответ или исключение ExchangeError.
+        """
+        entry = {"type": "call", "t": started, "d": round(duration, 6), "e": endpoint, "m": method, "p": params}
+        if error is not None:
+            entry["x"] = {"type": type(error).__name__, "message": str(error), "code": error.code}
+        else:
+            entry["r"] = response
+        self._write(entry)
+
+    def cache(self, kline_cache, symbol, interval):
+        """
+        Однократное сохранение кэша свечей символа перед первым обращением к нему.
+        """
+        key = (symbol, str(interval))
+        if key in self._cached:
+            return
+        self._cached.add(key)
+        candles = kline_cache.load(symbol, interval)
+        self._write({"type": "cache", "t": clock.now(), "symbol": symbol, "interval": str(interval),
+                     "columns": [getattr(candles, name).tolist() for name in CandleSeries.COLUMNS]})
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class RecordingTransport:
+    """
+    Обёртка transport.HttpTransport, записывающая каждый вызов в Recorder.
+    """
+
+    def __init__(self, inner, recorder):
+        self.inner = inner
+        self.recorder = recorder
+
+    @property
+    def http(self):
+        return self.inner.http
+
+    def call(self, endpoint, method, idempotent=True, **params):
+        started = clock.now()
+        timer = time.perf_counter()
+        try:
+            response = self.inner.call(endpoint, method, idempotent=idempotent, **params)
+        except transport.ExchangeError as e:
+            self.recorder.call(started, time.perf_counter() - timer, endpoint, method, params, error=e)
+            raise
+        self.recorder.call(started, time.perf_counter() - timer, endpoint, method, params, response=response)
+        return response
+
+
+def read_sessions(path):
+    """
+    Чтение записи.
+
+    :return: Список сессий (по одной на запуск): словари header, calls, cache.
+        Оборванная последняя строка (процесс остановлен во время записи) пропускается.
+    """
+    sessions = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if entry["type"] == "header":
+                    sessions.append({"header": entry, "calls": [], "cache": []})
+                elif sessions:
+                    sessions[-1]["calls" if entry["type"] == "call" else "cache"].append(entry)
+        except (EOFError, gzip.BadGzipFile):
+            pass
+    return sessions
+
+
+class ReplayStop(BaseException):
+    """
+    Остановка воспроизведения. Наследуется от BaseException, как KeyboardInterrupt,
+    чтобы её не перехватывали обработчики ошибок основного цикла.
+    """
+
+
+class ReplayFinished(ReplayStop):
+    """ Запись закончилась """
+
+
+class ReplayDivergence(ReplayStop):
+    """ Бот отправил не тот запрос, что был записан: решения расходятся с записью """
+
+
+class ReplayTransport:
+    """
+    Транспорт воспроизведения: вместо обращения к бирже возвращает записанные
+    ответы по порядку и проверяет, что запросы совпадают с записанными.
+    Виртуальные часы переводятся ко времени записанного запроса.
+    """
+
+    def __init__(self, calls, virtual_clock=None):
+        self._calls = deque(calls)
+        self.clock = virtual_clock or clock.get_clock()
+        self.http = None
+        self.checked = 0
+        self.orders = []  # размещённые ордера: след решений бота
+
+    def call(self, endpoint, method, idempotent=True, **params):
+        if not self._calls:
+            raise ReplayFinished(f"Запись закончилась, проверено запросов: {self.checked}")
+        entry = self._calls.popleft()
+        params = _normalize(params)
+        if (entry["e"], entry["m"], entry["p"]) != (endpoint, method, params):
+            raise ReplayDivergence(
+                f"Запрос {self.checked + 1}: ожидался {entry['m']} {entry['p']}, получен {method} {params}")
+        self.checked += 1
+        if hasattr(self.clock, "advance") and entry["t"] > self.clock.time():
+            self.clock.advance(entry["t"] - self.clock.time())
+        if method == "place_order":
+            self.orders.append({"t": entry["t"], "symbol": params["symbol"], "side": params["side"],
+                                "qty": params["qty"], "ok": "x" not in entry})
+        if "x" in entry:
+            error = getattr(transport, entry["x"]["type"], transport.ExchangeError)
+            raise error(entry["x"]["message"], entry["x"]["code"])
+        return entry["r"]
+
+
+def seed_cache(root, session):
+    """ Кэш свечей в каталоге root с содержимым, сохранённым в записи """
+    cache = KlineCache(root)
+    for entry in session["cache"]:
+        timestamp, *columns = entry["columns"]
+        candles = CandleSeries(np.array(timestamp, dtype=np.int64),
+                               *(np.array(column, dtype=np.float64) for column in columns))
+        if len(candles):
+            cache.store(entry["symbol"], entry["interval"], candles)
+    return cache
+
+
+def replay(session, verbose=False):
+    """
+    Воспроизведение сессии через main.main() на виртуальных часах.
+
+    :return: Словарь: результат (finished/diverged), проверенные запросы, ордера, время.
+    """
+    meta = session["header"]["meta"]
+    if meta.get("MODE", "poll") != "poll" or meta.get("ACCOUNT_STREAM") == "True" \
+            or meta.get("ORDER_ASYNC", "False") == "True" or float(meta.get("EXIT_TRAIL_PERCENT", 0)):
+        raise ValueError("Воспроизводится только режим опроса REST без фоновой отправки ордеров и трейлинга "
+                         "(MODE=poll, ACCOUNT_STREAM=False, ORDER_ASYNC=False, EXIT_TRAIL_PERCENT=0).")
+    # Записи, сделанные до появления TP/SL у ордеров открытия
+    meta.setdefault("EXIT_REWARD_RATIO", "0")
+
+    directory = tempfile.mkdtemp(prefix="replay_")
+    seed_cache(os.path.join(directory, "kline_cache"), session)
+    os.environ.update({key: value for key, value in meta.items() if key in CONFIG_KEYS})
+    os.environ.update(KLINE_CACHE_DIR=os.path.join(directory, "kline_cache"), TRADE_JOURNAL_DB="",
+                      RECORD_FILE="", SNAPSHOT_FILE="", METRICS_PORT="0", METRICS_SUMMARY_SECONDS="0",
+                      ORDER_ASYNC="False", MARKET_HUB_SOCKET="")
+    virtual = clock.VirtualClock(session["header"]["t"])
+    clock.set_clock(virtual)
+
+    # main.setup() настраивает логи и API: файлы создаются во временном каталоге
+    import main
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        main.setup()
+    finally:
+        os.chdir(cwd)
+    if not verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    main.trade_logger.disable()
+    player = ReplayTransport(session["calls"], virtual)
+    main.bybit_api.transport = player
+
+    started = time.perf_counter()
+    result = "finished"
+    message = ""
+    try:
+        main.main()
+    except ReplayFinished as e:
+        message = str(e)
+    except ReplayDivergence as e:
+        result, message = "diverged", str(e)
+    return {"result": result, "message": message, "checked": player.checked, "total": len(session["calls"]),
+            "orders": player.orders, "simulated_s": virtual.time() - session["header"]["t"],
+            "wall_s": time.perf_counter() - started}
+
+
+def record_synthetic(bars, start_bar, seed=0):
+    """
+    Запуск main.main() с записью (RECORD_FILE) против simulator.ExchangeSimulator
+    на синтетических свечах в ускоренном времени; остальные настройки - из окружения.
+    Завершается, когда история свечей закончилась.
+
+    :param start_bar: Свеча, с которой бот начинает торговать (предыдущие - история).
+    """
+    from simulator import ExchangeSimulator, load_candles
+    import main
+
+    main.load_settings()
+    candles = load_candles([main.SYMBOL], main.INTERVAL, synthetic=bars, seed=seed)
+    start = int(candles[main.SYMBOL].timestamp[start_bar])
+    virtual = clock.VirtualClock(start / 1000)
+    clock.set_clock(virtual)
+    exchange = ExchangeSimulator(candles, main.INTERVAL, clock=virtual, start=start)
+
+    def stop(previous, now):
+        if exchange.finished():
+            raise KeyboardInterrupt
+
+    virtual.subscribe(stop)
+    main.setup()
+    main.trade_logger.disable()
+    main.bybit_api.transport.inner = transport.HttpTransport(None, None, client=exchange.client("smoke"))
+    try:
+        main.main()
+    except KeyboardInterrupt:
+        pass
+    main.recorder.close()
+
+
+# Настройки, которые проверка smoke() не берёт из окружения: запись идёт с настройками по умолчанию
+SMOKE_RESET_KEYS = CONFIG_KEYS + ("KLINE_CACHE_DIR", "TRADE_JOURNAL_DB", "SNAPSHOT_FILE", "METRICS_PORT",
+                                  "PROFILE_SOCKET", "MARKET_HUB_SOCKET", "SHADOW_VARIANTS", "RECORD_FILE")
+
+
+def smoke(bars=3000, start_bar=1500, symbol="BTCUSDT"):
+    """
+    Проверка записи и воспроизведения с настройками по умолчанию: запуск с записью
+    на симуляторе и воспроизведение записи, оба - в отдельных процессах.
+
+    :return: Кортеж (отчёт replay(), список ордеров записи); сессия воспроизводится,
+        если отчёт завершён (finished), проверены все запросы и ордера совпали.
+    """
+    directory = tempfile.mkdtemp(prefix="replay_smoke_")
+    path = os.path.join(directory, "session.jsonl.gz")
+    trace = os.path.join(directory, "trace.json")
+    package = os.path.dirname(os.path.abspath(__file__))
+    env = {key: value for key, value in os.environ.items() if key not in SMOKE_RESET_KEYS}
+    env.update(SYMBOL=symbol, RECORD_FILE=path, PYTHONPATH=package)
+    # Каталог запуска - временный: кэш свечей, журнал, снимок и логи (trading.log) создаются в нём
+    subprocess.run([sys.executable, "-c", f"import replay; replay.record_synthetic({int(bars)}, {int(start_bar)})"],
+                   cwd=directory, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    subprocess.run([sys.executable, os.path.join(package, "replay.py"), path, "--trace", trace],
+                   cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(trace, encoding="utf-8") as f:
+        report = json.load(f)
+    recorded = [{"t": entry["t"], "symbol": entry["p"]["symbol"], "side": entry["p"]["side"],
+                 "qty": entry["p"]["qty"], "ok": "x" not in entry}
+                for entry in read_sessions(path)[-1]["calls"] if entry["m"] == "place_order"]
+    return report, recorded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записи запросов к бирже через main.main().")
+    parser.add_argument("path", nargs="?", help="Файл записи (RECORD_FILE)")
+    parser.add_argument("--smoke", type=int, metavar="BARS",
+                        help="Проверка: запись BARS синтетических свечей на симуляторе с настройками "
+                             "по умолчанию и её воспроизведение")
+    parser.add_argument("--session", type=int, default=-1, help="Номер запуска в записи (по умолчанию последний)")
+    parser.add_argument("--trace", help="Файл JSON для следа решений (ордеров)")
+    parser.add_argument("--verbose", action="store_true", help="Логи бота уровня INFO")
+    args = parser.parse_args()
+
+    if args.smoke:
+        report, recorded = smoke(args.smoke, args.smoke // 2)
+        matched = report["result"] == "finished" and report["checked"] == report["total"] \
+            and report["orders"] == recorded
+        print(f"Запись с настройками по умолчанию: запросов {report['total']}, ордеров {len(recorded)}; "
+              f"воспроизведение: проверено {report['checked']}, ордеров {len(report['orders'])} - "
+              + ("совпадает." if matched else f"расхождение. {report['message']}"))
+        sys.exit(0 if matched else 1)
+    if not args.path:
+        parser.error("не указан файл записи")
+    sessions = read_sessions(args.path)
+    if not sessions:
+        sys.exit(f"В {args.path} нет записанных запусков.")
+    report = replay(sessions[args.session], args.verbose)
+    for order in report["orders"]:
+        print(f"{order['t']:.3f} {order['symbol']} {order['side']} {order['qty']}"
+              f"{'' if order['ok'] else ' (отклонён)'}")
+    print(f"Проверено запросов: {report['checked']} из {report['total']}, ордеров: {len(report['orders'])}; "
+          f"{report['simulated_s'] / 3600:.1f} ч за {report['wall_s']:.2f} с")
+    if args.trace:
+        with open(args.trace, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if report["result"] != "finished":
+        print(f"Расхождение с записью: {report['message']}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import time
+from dotenv import load_dotenv
+from account_state import AccountState
+from exchange import BybitAPI
+from exits import ExitEngine
+from kline_cache import KlineCache
+import metrics
+from log_pipeline import env_settings as log_env_settings, setup_logging
+from order_manager import OrderManager
+from rate_limit import RateLimiter
+from scheduler import IntervalScheduler
+from strategy import Strategy
+from timeframes import MultiTimeframeStrategy
+from trade_journal import TradeJournal
+from trade_logger import TradeLogger
+from trader import Trader
+from transport import ExchangeError
+
+
+class MultiSymbolRunner:
+    """
+    Одновременная работа стратегии по нескольким символам в одном процессе.
+
+    Баланс и позиции запрашиваются один раз за цикл для всех символов, свечи
+    загружаются параллельно; все запросы проходят через общий RateLimiter API.
+    Если задан account (AccountState), баланс и позиции читаются из него.
+    Циклы выполняются через grace секунд после закрытия каждой свечи; после
+    ошибки цикл повторяется не позже чем через pause секунд.
+    """
+
+    def __init__(self, api, traders, interval, max_workers=32, pause=60, account=None, grace=2.0):
+        self.api = api
+        self.account = account if account is not None else api
+        self.traders = traders  # symbol -> Trader
+        self.interval = interval
+        self.pause = pause
+        self.scheduler = IntervalScheduler(interval, grace, retry=pause)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def _call(self, func, *args):
+        # pybit работает синхронно, поэтому запросы выполняются в пуле потоков
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def run_cycle(self):
+        """
+        Один цикл по всем символам.
+
+        :return: True, если следующий цикл нужно выполнить без паузы.
+        """
+        balance = await self._call(self.account.get_balance)
+        if balance == 0:
+            logging.warning("Баланс равен 0, пропуск итерации.")
+            return False
+
+        symbols = list(self.traders)
+        results = await asyncio.gather(
+            self._call(self.account.get_all_open_positions),
+            *(self._candles(symbol) for symbol in symbols))
+        positions, all_candles = results[0], results[1:]
+
+        steps = []
+        for symbol, candles in zip(symbols, all_candles):
+            if candles is None:
+                continue
+            if len(candles) < 2:
+                logging.warning(f"Недостаточно данных для анализа {symbol}.")
+                continue
+            steps.append(self._step(symbol, balance, candles.closed(), positions.get(symbol, [])))
+        repeats = await asyncio.gather(*steps)
+        return any(repeats)
+
+    async def _candles(self, symbol):
+        # Ошибка загрузки свечей одного символа не отменяет цикл по остальным
+        try:
+            return await self._call(self.api.get_candles, symbol, self.interval)
+        except ExchangeError as e:
+            logging.warning(f"Не удалось загрузить свечи {symbol}: {e}")
+            return None
+
+    async def _step(self, symbol, balance, candles, open_positions):
+        try:
+            return await self._call(self.traders[symbol].step, balance, candles, open_positions)
+        except Exception as e:
+            metrics.increment("errors_total", source="step")
+            logging.error(f"Ошибка обработки {symbol}: {e}", exc_info=True)
+            return False
+
+    async def run(self):
+        logging.info(f"Запуск стратегии для {len(self.traders)} символов...")
+        while True:
+            try:
+                started = time.perf_counter()
+                repeat = await self.run_cycle()
+                metrics.observe("stage_seconds", time.perf_counter() - started, stage="cycle")
+                if not repeat:
+                    await asyncio.sleep(self.scheduler.delay())
+            except Exception as e:
+                metrics.increment("errors_total", source="main_loop")
+                logging.error(f"Ошибка в основном цикле: {e}", exc_info=True)
+                await asyncio.sleep(min(self.pause, self.scheduler.delay()))
+
+
+def main():
+    load_dotenv()
+
+    symbols = [symbol.strip() for symbol in os.getenv("SYMBOLS", "").split(",") if symbol.strip()]
+    interval = os.getenv("INTERVAL", 15)
+    rsi_overbought = int(os.getenv("RSI_OVERBOUGHT", 70))
+    rsi_oversold = int(os.getenv("RSI_OVERSOLD", 30))
+    cross_lookback = int(os.getenv("CROSS_LOOKBACK", 3))
+    risk_percent = float(os.getenv("RISK_PERCENT", 1.0))
+    mtf_intervals = [item.strip() for item in os.getenv("MTF_INTERVALS", "").split(",") if item.strip()]
+    mtf_rule = os.getenv("MTF_RULE", "no_conflict")
+    reward_ratio = float(os.getenv("EXIT_REWARD_RATIO", 2))
+    trail_percent = float(os.getenv("EXIT_TRAIL_PERCENT", 0))
+
+    # Запись логов в файл с ротацией и в консоль - в отдельном потоке, не в цикле торговли
+    setup_logging("trading.log", **log_env_settings())
+
+    api = BybitAPI(os.getenv("API_KEY"), os.getenv("API_SECRET"),
+                   os.getenv("TESTNET", "True") == "True",
+                   kline_cache=KlineCache(os.getenv("KLINE_CACHE_DIR", "kline_cache")),
+                   rate_limiter=RateLimiter())
+    journal_db = os.getenv("TRADE_JOURNAL_DB", "trade_journal.db")
+    account = None
+    if os.getenv("ACCOUNT_STREAM", "False") == "True":
+        account = AccountState(api)
+        account.start()
+    trade_logger = TradeLogger(email_enabled=True,
+                               journal=TradeJournal(journal_db) if journal_db else None)
+    # Общий OrderManager: ордера символов одного цикла уходят пакетным запросом
+    orders = OrderManager(account or api, trade_logger)
+    if account is not None:
+        account.execution_listeners.append(orders.on_execution)
+    # Один поток сделок на все символы для трейлинг-стопов
+    exits = None
+    if reward_ratio or trail_percent:
+        exits = ExitEngine(api, orders, trail_percent, float(os.getenv("EXIT_TRAIL_ACTIVATION", 0)), reward_ratio)
+        exits.start()
+    traders = {}
+    for symbol in symbols:
+        strategy = Strategy(api, symbol, interval, rsi_overbought, rsi_oversold, cross_lookback=cross_lookback)
+        if mtf_intervals:
+            strategy = MultiTimeframeStrategy(strategy, mtf_intervals, mtf_rule)
+        traders[symbol] = Trader(account or api, strategy, trade_logger, risk_percent, orders=orders,
+                                 exits=exits)
+    metrics_port = int(os.getenv("METRICS_PORT", 0))
+    if metrics_port:
+        metrics.serve(metrics_port)
+    summary_seconds = int(os.getenv("METRICS_SUMMARY_SECONDS", 300))
+    if summary_seconds:
+        metrics.start_summary(summary_seconds)
+    grace = float(os.getenv("SCHEDULE_GRACE", 2))
+    asyncio.run(MultiSymbolRunner(api, traders, interval, account=account, grace=grace).run())
+
+
+if __name__ == "__main__":
+    main()
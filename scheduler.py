@@ -0,0 +1,41 @@
+import logging
+import clock
+from candles import next_candle_ms
+
+
+class IntervalScheduler:
+    """
+    Опрос по границам свечей: пробуждение через grace секунд после закрытия
+    каждой свечи интервала (время на публикацию свечи биржей) вместо
+    фиксированной паузы. Пауза считается от текущего времени до границы,
+    поэтому длительность итераций не накапливается в дрейф.
+
+    :param interval: Интервал свечей Bybit ("1", "15", "D", "W", "M").
+    :param grace: Задержка после закрытия свечи, с.
+    :param retry: Наибольшая пауза перед повтором после ошибки, с.
+    """
+
+    def __init__(self, interval, grace=2.0, retry=60):
+        self.interval = interval
+        self.grace = grace
+        self.retry = retry
+
+    def next_run(self, now=None):
+        """ Момент следующего запуска (с, Unix) """
+        now = clock.now() if now is None else now
+        return next_candle_ms((now - self.grace) * 1000, self.interval) / 1000 + self.grace
+
+    def delay(self, now=None):
+        """ Секунды до следующего запуска """
+        now = clock.now() if now is None else now
+        return max(0.0, self.next_run(now) - now)
+
+    def wait(self):
+        """ Ожидание закрытия следующей свечи """
+        delay = self.delay()
+        logging.debug(f"Следующая оценка через {delay:.1f} с.")
+        clock.sleep(delay)
+
+    def wait_retry(self):
+        """ Пауза после ошибки: не дольше retry секунд и не позже закрытия следующей свечи """
+        clock.sleep(min(self.retry, self.delay()))
@@ -0,0 +1,137 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import time
+import numpy as np
+from dotenv import load_dotenv
+from candles import CandleSeries
+from exchange import BybitAPI
+from indicators import CROSS_NAMES, SIGNAL_NAMES, indicator_arrays
+from kline_cache import KlineCache
+from rate_limit import RateLimiter
+from transport import ExchangeError
+
+
+class Screener:
+    """
+    Сканер рынка: сигналы стратегии сразу по всем бессрочным USDT-контрактам.
+
+    Свечи всех символов складываются в матрицы (символы x свечи), индикаторы
+    считаются одним векторным проходом по всем символам.
+    """
+
+    def __init__(self, api, interval, bars=200, rsi_overbought=70, rsi_oversold=30, max_workers=16,
+                 cross_lookback=3):
+        self.api = api
+        self.interval = interval
+        self.bars = bars
+        self.rsi_overbought = rsi_overbought
+        self.rsi_oversold = rsi_oversold
+        # На сколько свечей назад смотреть при проверке креста, как в Strategy
+        self.cross_lookback = cross_lookback
+        self.max_workers = max_workers
+
+    def load(self, symbols=None):
+        """
+        Загрузка закрытых свечей в матрицы.
+
+        :param symbols: Список символов (по умолчанию - все linear USDT).
+        :return: Кортеж (symbols, high, low, close), матрицы формы (символы, bars).
+        """
+        if symbols is None:
+            symbols = self.api.get_linear_usdt_symbols()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            all_candles = list(executor.map(self._candles, symbols))
+
+        loaded = []
+        high = np.empty((len(symbols), self.bars))
+        low = np.empty((len(symbols), self.bars))
+        close = np.empty((len(symbols), self.bars))
+        for symbol, candles in zip(symbols, all_candles):
+            candles = candles.closed()
+            if len(candles) < self.bars:
+                logging.warning(f"Недостаточно свечей для {symbol}: {len(candles)}.")
+                continue
+            row = len(loaded)
+            high[row] = candles.high[-self.bars:]
+            low[row] = candles.low[-self.bars:]
+            close[row] = candles.close[-self.bars:]
+            loaded.append(symbol)
+        count = len(loaded)
+        return loaded, high[:count], low[:count], close[:count]
+
+    def _candles(self, symbol):
+        # Ошибка по одному символу не прерывает скан остальных
+        try:
+            return self.api.get_candles(symbol, self.interval)
+        except ExchangeError as e:
+            logging.warning(f"Не удалось загрузить свечи {symbol}: {e}")
+            return CandleSeries.empty()
+
+    def rank(self, symbols, high, low, close):
+        """
+        Символы в состоянии BUY/SELL, отсортированные по удалению цены от облака.
+
+        :return: Список словарей symbol, signal, cross_flag, rsi, close, cloud_distance (%).
+        """
+        if not symbols:
+            return []
+        arrays = indicator_arrays(
+            high, low, close, self.rsi_overbought, self.rsi_oversold, cross_lookback=self.cross_lookback)
+        last_close = close[:, -1]
+        cloud_top = np.fmax(arrays.senkou_span_a[:, -1], arrays.senkou_span_b[:, -1])
+        cloud_bottom = np.fmin(arrays.senkou_span_a[:, -1], arrays.senkou_span_b[:, -1])
+        signal = arrays.signal[:, -1]
+        distance = np.where(signal > 0, last_close - cloud_top, cloud_bottom - last_close)
+        distance = distance / last_close * 100
+
+        rows = []
+        for index in np.flatnonzero(signal):
+            rows.append({
+                "symbol": symbols[index],
+                "signal": SIGNAL_NAMES[int(signal[index])],
+                "cross_flag": CROSS_NAMES[int(arrays.cross[index, -1])],
+                "rsi": float(arrays.rsi[index, -1]),
+                "close": float(last_close[index]),
+                "cloud_distance": float(distance[index]),
+            })
+        rows.sort(key=lambda row: row["cloud_distance"], reverse=True)
+        return rows
+
+    def scan(self, symbols=None):
+        started = time.perf_counter()
+        symbols, high, low, close = self.load(symbols)
+        loaded = time.perf_counter()
+        rows = self.rank(symbols, high, low, close)
+        logging.info(
+            f"Скан {len(symbols)} символов: загрузка {loaded - started:.2f} с, "
+            f"расчёт {time.perf_counter() - loaded:.3f} с, сигналов: {len(rows)}")
+        return rows
+
+
+def format_table(rows):
+    lines = [f"{'Символ':<16}{'Сигнал':<8}{'Крест':<14}{'RSI':>8}{'Цена':>14}{'От облака, %':>14}"]
+    for row in rows:
+        lines.append(
+            f"{row['symbol']:<16}{row['signal']:<8}{row['cross_flag'] or '-':<14}"
+            f"{row['rsi']:>8.2f}{row['close']:>14.6g}{row['cloud_distance']:>14.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    api = BybitAPI(os.getenv("API_KEY"), os.getenv("API_SECRET"),
+                   os.getenv("TESTNET", "True") == "True",
+                   kline_cache=KlineCache(os.getenv("KLINE_CACHE_DIR", "kline_cache")),
+                   rate_limiter=RateLimiter())
+    screener = Screener(api, os.getenv("INTERVAL", 15),
+                        rsi_overbought=int(os.getenv("RSI_OVERBOUGHT", 70)),
+                        rsi_oversold=int(os.getenv("RSI_OVERSOLD", 30)),
+                        cross_lookback=int(os.getenv("CROSS_LOOKBACK", 3)))
+    print(format_table(screener.scan()))
+
+
+if __name__ == "__main__":
+    main()
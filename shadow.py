@@ -0,0 +1,146 @@
+from collections import namedtuple
+import logging
+import metrics
+from backtest import DEFAULT_FEE_RATE, MAX_REPEATS
+from candles import as_series
+from indicators import evaluate_lines
+from position import Position
+from strategy import Strategy
+from trader import decide, get_position_size
+
+# Вариант правил стратегии: пороги RSI и глубина проверки креста Tenkan/Kijun
+Variant = namedtuple("Variant", ["name", "rsi_overbought", "rsi_oversold", "cross_lookback"])
+
+
+def parse_variants(text):
+    """
+    Разбор описания вариантов "имя:перекупленность:перепроданность:глубина_креста" через запятую,
+    например "tight:65:35:3,wide:75:25:5".
+
+    :return: Список Variant.
+    """
+    variants = []
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        name, overbought, oversold, lookback = (part.strip() for part in item.split(":"))
+        variants.append(Variant(name, int(overbought), int(oversold), int(lookback)))
+    return variants
+
+
+class PaperBook:
+    """
+    Бумажная торговля одного варианта: те же правила trader.decide и размер позиции,
+    что у Trader, исполнение по цене закрытия свечи решения с комиссией тейкера.
+    """
+
+    def __init__(self, name, balance=1000.0, risk_percent=1.0, fee_rate=DEFAULT_FEE_RATE):
+        self.name = name
+        self.cash = float(balance)
+        self.risk_percent = risk_percent
+        self.fee_rate = fee_rate
+        self.position = Position()
+        self.fees = 0.0
+        self.trades = 0
+        self.last_price = None
+        self.last_timestamp = None
+
+    def step(self, evaluation, price, timestamp):
+        """
+        Решение варианта по закрытой свече и бумажное исполнение (один раз на свечу).
+        """
+        if timestamp == self.last_timestamp:
+            return
+        self.last_timestamp = timestamp
+        self.last_price = price
+        for _ in range(MAX_REPEATS):
+            action, _ = decide(evaluation.signal, evaluation.cross_flag, evaluation.rsi, self.position.side)
+            if action is None:
+                break
+            qty = get_position_size(self.cash, self.risk_percent, price)
+            if qty is None:
+                break
+            fee = qty * price * self.fee_rate
+            pnl = self.position.fill(action.side, qty, price)
+            self.cash += pnl - fee
+            self.fees += fee
+            self.trades += 1
+            metrics.increment("shadow_trades_total", variant=self.name, reason_code=action.reason_code)
+            logging.info("Вариант %s (бумажная сделка): %s %s по %s, PnL %.2f, комиссия %.4f, капитал %.2f.",
+                         self.name, action.side, qty, price, pnl, fee, self.equity())
+            # Закрытие по RSI сразу повторяет оценку, как в основном цикле
+            if not action.repeat:
+                break
+
+    def equity(self):
+        return self.cash + (self.position.unrealized(self.last_price) if self.last_price is not None else 0.0)
+
+
+class ShadowStrategy(Strategy):
+    """
+    Strategy, которая вместе с торгуемым вариантом оценивает теневые варианты
+    правил на тех же свечах.
+
+    Индикаторы считаются одним потоковым проходом (или берутся из хаба), и
+    для каждого варианта остаются только сравнения с его порогами RSI и
+    Tenkan/Kijun на его глубине креста (IchimokuEngine.evaluate). Решение
+    торгуемого варианта возвращается Trader, остальные торгуют на бумаге
+    (PaperBook) с комиссией.
+
+    :param variants: Список Variant; variants[live] - торгуемый вариант.
+    :param balance: Начальный бумажный капитал каждого теневого варианта.
+    """
+
+    def __init__(self, api, symbol, interval, variants, live=0, balance=1000.0, risk_percent=1.0,
+                 fee_rate=DEFAULT_FEE_RATE, hub=None):
+        self.variants = list(variants)
+        self.live = self.variants[live]
+        # Движок хранит Tenkan/Kijun на наибольшую глубину креста среди вариантов
+        super().__init__(api, symbol, interval, self.live.rsi_overbought, self.live.rsi_oversold,
+                         cross_lookback=max(variant.cross_lookback for variant in self.variants), hub=hub)
+        self.cross_lookback = self.live.cross_lookback
+        self.books = {variant.name: PaperBook(variant.name, balance, risk_percent, fee_rate)
+                      for variant in self.variants if variant is not self.live}
+        self.evaluations = {}  # имя варианта -> Evaluation последней оценки
+
+    def _evaluate(self, variant, close):
+        if self._hub_lines is not None:
+            return evaluate_lines(self._hub_lines, close, variant.rsi_overbought, variant.rsi_oversold,
+                                  variant.cross_lookback)
+        return self.engine.evaluate(close, variant.rsi_overbought, variant.rsi_oversold, variant.cross_lookback)
+
+    def update(self, candles):
+        """
+        Оценка всех вариантов по закрытым свечам и бумажные сделки теневых.
+
+        :return: Evaluation торгуемого варианта.
+        """
+        candles = as_series(candles)
+        evaluation = super().update(candles)
+        if evaluation is None or not len(candles):
+            return self.evaluations.get(self.live.name, evaluation)
+        close = float(candles.close[-1])
+        timestamp = int(candles.timestamp[-1])
+        self.evaluations = {variant.name: self._evaluate(variant, close) for variant in self.variants}
+        for name, book in self.books.items():
+            book.step(self.evaluations[name], close, timestamp)
+        return self.evaluations[self.live.name]
+
+    def summary(self):
+        """ Капитал, сделки и комиссии теневых вариантов """
+        return {name: {"equity": book.equity(), "trades": book.trades, "fees": book.fees}
+                for name, book in self.books.items()}
+
+    def params(self):
+        return super().params() + (tuple(self.variants), self.live.name)
+
+    def snapshot(self):
+        state = super().snapshot()
+        state["books"] = self.books
+        return state
+
+    def restore(self, state):
+        if not super().restore(state):
+            return False
+        self.books = state["books"]
+        return True
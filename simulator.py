@@ -0,0 +1,885 @@
+import argparse
+from collections import deque
+import datetime
+from decimal import Decimal
+import logging
+import os
+import random
+import threading
+import time
+import numpy as np
+from candles import interval_ms
+from clock import VirtualClock, get_clock, set_clock
+from exchange import BybitAPI
+from kline_cache import KlineCache
+from position import Position
+from pybit.exceptions import InvalidRequestError
+from rate_limit import DEFAULT_LIMITS
+from scheduler import IntervalScheduler
+from transport import HttpTransport
+
+# Комиссии Bybit по умолчанию для бессрочных контрактов (тейкер/мейкер)
+TAKER_FEE = 0.00055
+MAKER_FEE = 0.0002
+
+# Минимальный объём ордера
+MIN_QTY = 0.001
+
+# Шаг цены (priceFilter.tickSize) для TP/SL ордеров
+TICK_SIZE = "0.01"
+
+# Свечей истории, доступных ботам в момент начала симуляции
+WARMUP_BARS = 200
+
+# Эндпоинт (ключ лимитов и таймаутов transport) для каждого поддерживаемого метода pybit HTTP
+ENDPOINTS = {
+    "get_kline": "market",
+    "get_instruments_info": "market",
+    "get_wallet_balance": "account/wallet-balance",
+    "get_positions": "position/list",
+    "set_trading_stop": "position/trading-stop",
+    "place_order": "order/create",
+    "place_batch_order": "order/create-batch",
+    "cancel_order": "order/cancel",
+    "get_open_orders": "order/realtime",
+    "get_executions": "execution/list",
+}
+
+
+def _fmt(value):
+    # Числа в ответах Bybit передаются строками
+    return repr(round(float(value), 8))
+
+
+def _on_tick(price):
+    # Цена кратна шагу TICK_SIZE (проверка по десятичной записи, как у биржи)
+    return Decimal(str(price)) % Decimal(TICK_SIZE) == 0
+
+
+def _price_at(points, fraction):
+    # Цена на доле fraction внутрисвечного пути из четырёх точек (три равных по времени отрезка)
+    position = fraction * 3
+    leg = min(int(position), 2)
+    return points[leg] + (points[leg + 1] - points[leg]) * (position - leg)
+
+
+class _Rejected(Exception):
+    """ Отказ биржи с кодом retCode """
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class SimMarket:
+    """
+    Свечи одного символа и цена внутри свечи в произвольный момент.
+
+    Внутри свечи цена идёт по пути open -> low -> high -> close для растущей
+    свечи и open -> high -> low -> close для падающей, каждый отрезок занимает
+    треть свечи. Формирующаяся свеча отдаётся только в пройденной части,
+    поэтому боты не видят будущих цен.
+    """
+
+    def __init__(self, symbol, candles, interval):
+        self.symbol = symbol
+        self.candles = candles
+        self.interval = str(interval)
+        self.step = interval_ms(interval)
+        self.end = int(candles.timestamp[-1]) + self.step
+        self._rows = {}
+
+    def index(self, now):
+        """ Индекс свечи, открытой к моменту now (мс), или -1 """
+        return int(np.searchsorted(self.candles.timestamp, now, side="right")) - 1
+
+    def _path(self, i):
+        c = self.candles
+        if c.close[i] >= c.open[i]:
+            return c.open[i], c.low[i], c.high[i], c.close[i]
+        return c.open[i], c.high[i], c.low[i], c.close[i]
+
+    def _fraction(self, i, now):
+        return min(max((now - int(self.candles.timestamp[i])) / self.step, 0.0), 1.0)
+
+    def price(self, now):
+        """ Последняя цена в момент now или None до начала истории """
+        i = self.index(now)
+        if i < 0:
+            return None
+        return _price_at(self._path(i), self._fraction(i, now))
+
+    def row(self, i, now=None):
+        """ Свеча i в формате get_kline (формирующаяся в момент now - только пройденная часть) """
+        c = self.candles
+        fraction = 1.0 if now is None else self._fraction(i, now)
+        if fraction >= 1.0:
+            row = self._rows.get(i)
+            if row is None:
+                row = self._rows[i] = [str(int(c.timestamp[i]))] + [
+                    _fmt(column[i]) for column in (c.open, c.high, c.low, c.close, c.volume, c.turnover)]
+            return row
+        points = self._path(i)
+        price = _price_at(points, fraction)
+        seen = points[:min(int(fraction * 3), 2) + 1] + (price,)
+        return [str(int(c.timestamp[i])), _fmt(c.open[i]), _fmt(max(seen)), _fmt(min(seen)), _fmt(price),
+                _fmt(c.volume[i] * fraction), _fmt(c.turnover[i] * fraction)]
+
+    def legs(self, start, end):
+        """
+        Отрезки движения цены между моментами start и end (мс).
+
+        :return: Список (цена в начале, цена в конце, gap); gap=True - скачок между
+            закрытием свечи и открытием следующей, уровни внутри него не торгуются.
+        """
+        legs = []
+        first = self.index(start)
+        last = self.index(end)
+        for i in range(max(first, 0), last + 1):
+            points = self._path(i)
+            if i > first and i > 0 and self.candles.close[i - 1] != points[0]:
+                legs.append((self.candles.close[i - 1], points[0], True))
+            begin = self._fraction(i, start) if i == first else 0.0
+            finish = self._fraction(i, end)
+            for leg in range(3):
+                a = max(begin, leg / 3)
+                b = min(finish, (leg + 1) / 3)
+                if a < b:
+                    legs.append((_price_at(points, a), _price_at(points, b), False))
+        return legs
+
+
+class SimAccount:
+    """
+    Аккаунт симулятора: кошелёк USDT, чистые позиции по символам, TP/SL позиций и активные лимитные ордера.
+    """
+
+    def __init__(self, name, balance, max_executions=10000):
+        self.name = name
+        self.wallet = float(balance)
+        self.realized = 0.0
+        self.fees = 0.0
+        self.positions = {}  # symbol -> Position
+        self.stops = {}  # symbol -> [takeProfit, stopLoss]
+        self.orders = {}  # orderId -> активный ордер
+        self.link_ids = set()
+        self.executions = deque(maxlen=max_executions)
+        self.sockets = []
+        self.requests = {}  # endpoint -> [секунда, количество запросов]
+        self.order_count = 0
+        self.fill_count = 0
+
+    def watches(self, symbol):
+        """ Есть ли у аккаунта уровни, которые нужно проверять при движении цены символа """
+        position = self.positions.get(symbol)
+        if position is not None and position.qty and self.stops.get(symbol):
+            return True
+        return any(order["symbol"] == symbol for order in self.orders.values())
+
+
+class SimWebSocket:
+    """
+    Подключение к потокам симулятора с методами pybit WebSocket:
+    kline_stream, trade_stream, position_stream, order_stream, execution_stream, wallet_stream.
+    """
+
+    def __init__(self, exchange, channel_type, account=None):
+        self.exchange = exchange
+        self.channel_type = channel_type
+        self.account = account
+        self.topics = {}  # топик -> callback
+        self.connected = True
+
+    def kline_stream(self, interval, symbol, callback):
+        self.exchange.subscribe_kline(self, symbol, interval, callback)
+
+    def trade_stream(self, symbol, callback):
+        self.exchange.subscribe_trades(self, symbol, callback)
+
+    def _private(self, topic, callback):
+        if self.account is None:
+            raise ValueError(f"Поток {topic} доступен только в приватном подключении.")
+        self.topics[topic] = callback
+
+    def position_stream(self, callback):
+        self._private("position", callback)
+
+    def order_stream(self, callback):
+        self._private("order", callback)
+
+    def execution_stream(self, callback):
+        self._private("execution", callback)
+
+    def wallet_stream(self, callback):
+        self._private("wallet", callback)
+
+    def is_connected(self):
+        return self.connected
+
+    def exit(self):
+        self.connected = False
+
+
+class SimClient:
+    """
+    Клиент аккаунта симулятора с методами pybit HTTP; ответы возвращаются как
+    при return_response_headers=True: (ответ, время выполнения, заголовки).
+    """
+
+    def __init__(self, exchange, account):
+        self.exchange = exchange
+        self.account = account
+
+    def __getattr__(self, method):
+        if method not in ENDPOINTS:
+            raise AttributeError(method)
+        return lambda **params: self.exchange.request(self.account, method, params)
+
+
+class ExchangeSimulator:
+    """
+    Локальная биржа для бумажной торговли и нагрузочных прогонов без сети.
+
+    Реализует используемую BybitAPI часть v5 (свечи, инструменты, ордера с TP/SL,
+    позиции, кошелёк, исполнения) и потоки WebSocket (kline, publicTrade, order,
+    execution, position, wallet). Рынок воспроизводится по историческим или
+    синтетическим свечам; рыночные ордера исполняются по текущей цене с проскальзыванием,
+    лимитные ордера, тейк-профит и стоп-лосс - при прохождении цены через уровень.
+    Все аккаунты торгуют по одним и тем же ценам и не влияют на рынок.
+
+    Время берётся из часов процесса (clock): с VirtualClock события обрабатываются
+    при каждом переводе часов, и неделя торговли проходит за секунды.
+
+    :param candles: Словарь symbol -> CandleSeries одного интервала.
+    :param start: Время биржи в момент создания (мс); по умолчанию через WARMUP_BARS свечей от начала истории.
+    :param latency: Задержка каждого запроса в секундах (по часам симуляции), jitter - случайная добавка к ней.
+    :param error_rate: Доля запросов, завершающихся временной ошибкой 10016.
+    :param rate_limits: Лимиты запросов в секунду по эндпоинтам на аккаунт (None - без лимитов).
+    """
+
+    def __init__(self, candles, interval, clock=None, start=None, balance=10000.0, taker_fee=TAKER_FEE,
+                 maker_fee=MAKER_FEE, slippage=0.0, leverage=10, latency=0.0, jitter=0.0, error_rate=0.0,
+                 rate_limits=None, seed=0, tick=1.0):
+        self.interval = str(interval)
+        self.markets = {symbol: SimMarket(symbol, series, interval)
+                        for symbol, series in candles.items() if len(series)}
+        if not self.markets:
+            raise ValueError("Нет свечей для симуляции.")
+        self.clock = clock or get_clock()
+        if start is None:
+            start = max(int(market.candles.timestamp[min(WARMUP_BARS, len(market.candles) - 1)])
+                        for market in self.markets.values())
+        self._offset = start - self.clock.time() * 1000
+        self.balance = balance
+        self.taker_fee = taker_fee
+        self.maker_fee = maker_fee
+        self.slippage = slippage
+        self.leverage = leverage
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limits = rate_limits
+        self.tick = tick
+        self.accounts = {}
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._ids = 0
+        self._last = self.now()
+        self._public = []
+        self._outbox = []
+        self._lock = threading.RLock()
+        self._ticker = None
+        if hasattr(self.clock, "subscribe"):
+            self.clock.subscribe(lambda previous, now: self.sync())
+
+    def now(self):
+        """ Время биржи в мс """
+        return int(self.clock.time() * 1000 + self._offset)
+
+    def finished(self):
+        """ История свечей закончилась по всем символам """
+        return self.now() >= max(market.end for market in self.markets.values())
+
+    def account(self, name):
+        with self._lock:
+            account = self.accounts.get(name)
+            if account is None:
+                account = self.accounts[name] = SimAccount(name, self.balance)
+            return account
+
+    def client(self, api_key):
+        """ Клиент для transport.HttpTransport(client=...) """
+        return SimClient(self, self.account(api_key))
+
+    def websocket(self, channel_type="linear", api_key=None):
+        """ Новое подключение к потокам (private - потоки аккаунта api_key) """
+        with self._lock:
+            if channel_type == "private":
+                account = self.account(api_key)
+                ws = SimWebSocket(self, channel_type, account)
+                account.sockets.append(ws)
+            else:
+                ws = SimWebSocket(self, channel_type)
+                self._public.append(ws)
+        if not hasattr(self.clock, "subscribe"):
+            self._start_ticker()
+        return ws
+
+    def subscribe_kline(self, ws, symbol, interval, callback):
+        self._market(symbol)
+        if str(interval) != self.interval:
+            raise ValueError(f"Симулятор отдаёт только свечи интервала {self.interval}.")
+        ws.topics[f"kline.{interval}.{symbol}"] = callback
+
+    def subscribe_trades(self, ws, symbol, callback):
+        self._market(symbol)
+        ws.topics[f"publicTrade.{symbol}"] = callback
+
+    def drop_websockets(self):
+        """ Обрыв всех подключений (проверка переподключения и сверки состояния) """
+        with self._lock:
+            for ws in self._public + [ws for account in self.accounts.values() for ws in account.sockets]:
+                ws.connected = False
+            self._public = []
+            for account in self.accounts.values():
+                account.sockets = []
+
+    def _start_ticker(self):
+        # С реальными часами события потоков рассылаются фоновым потоком раз в tick секунд
+        with self._lock:
+            if self._ticker is not None:
+                return
+            self._ticker = threading.Thread(target=self._tick, name="ExchangeSimulator", daemon=True)
+            self._ticker.start()
+
+    def _tick(self):
+        while True:
+            time.sleep(self.tick)
+            self.sync()
+
+    def sync(self):
+        """ Обработка движения цены до текущего момента и рассылка событий потоков """
+        with self._lock:
+            self._sync(self.now())
+            messages, self._outbox = self._outbox, []
+        self._dispatch(messages)
+
+    def _dispatch(self, messages):
+        for callback, message in messages:
+            try:
+                callback(message)
+            except Exception as e:
+                logging.error(f"Ошибка обработчика потока симулятора: {e}", exc_info=True)
+
+    def request(self, account, method, params):
+        """
+        Выполнение запроса pybit HTTP от имени аккаунта.
+
+        :return: (ответ, время выполнения, заголовки) или исключение pybit InvalidRequestError.
+        """
+        started = time.perf_counter()
+        if self.latency or self.jitter:
+            self.clock.sleep(self.latency + self._random.uniform(0, self.jitter))
+        headers = {}
+        error = None
+        with self._lock:
+            now = self.now()
+            self._sync(now)
+            self.requests += 1
+            try:
+                headers, allowed = self._limit(account, ENDPOINTS[method], now)
+                if not allowed:
+                    raise _Rejected(10006, "Too many visits!")
+                if self.error_rate and self._random.random() < self.error_rate:
+                    raise _Rejected(10016, "Internal system error (simulated)")
+                result = getattr(self, "_" + method)(account, now, **params)
+            except _Rejected as e:
+                error = e
+            messages, self._outbox = self._outbox, []
+        self._dispatch(messages)
+        if error is not None:
+            raise InvalidRequestError(request=f"{method} {params}", message=error.message,
+                                      status_code=error.code, time=now, resp_headers=headers)
+        # Пакетные запросы возвращают коды по каждому элементу в retExtInfo
+        ext_info = result.pop("retExtInfo", {})
+        response = {"retCode": 0, "retMsg": "OK", "result": result, "retExtInfo": ext_info, "time": now}
+        return response, datetime.timedelta(seconds=time.perf_counter() - started), headers
+
+    def _limit(self, account, endpoint, now):
+        """
+        Учёт запроса в окне лимита: окно - секунда времени биржи, а время сброса
+        в заголовке - по реальным часам, как его читает transport.
+
+        :return: (заголовки X-Bapi-Limit-*, запрос укладывается в лимит).
+        """
+        if not self.rate_limits or endpoint not in self.rate_limits:
+            return {}, True
+        limit = self.rate_limits[endpoint]
+        second = now // 1000
+        window = account.requests.get(endpoint)
+        if window is None or window[0] != second:
+            window = account.requests[endpoint] = [second, 0]
+        window[1] += 1
+        reset = int(time.time() * 1000) + (second + 1) * 1000 - now
+        headers = {"X-Bapi-Limit": str(limit), "X-Bapi-Limit-Status": str(max(limit - window[1], 0)),
+                   "X-Bapi-Limit-Reset-Timestamp": str(reset)}
+        return headers, window[1] <= limit
+
+    def _market(self, symbol):
+        market = self.markets.get(symbol)
+        if market is None:
+            raise _Rejected(10001, f"symbol invalid: {symbol}")
+        return market
+
+    def _next_id(self, prefix):
+        self._ids += 1
+        return f"{prefix}-{self._ids:010d}"
+
+    # Движение цены: TP/SL, лимитные ордера и потоки свечей
+
+    def _sync(self, now):
+        if now <= self._last:
+            return
+        previous, self._last = self._last, now
+        active = [account for account in self.accounts.values() if account.stops or account.orders]
+        for symbol, market in self.markets.items():
+            watchers = [account for account in active if account.watches(symbol)]
+            trades = [ws for ws in self._public if ws.connected and f"publicTrade.{symbol}" in ws.topics]
+            legs = market.legs(previous, now) if watchers or trades else ()
+            if watchers:
+                for a, b, gap in legs:
+                    for account in watchers:
+                        self._match(account, market, a, b, gap, now)
+            if trades:
+                self._publish_trades(market, legs, trades, now)
+            self._publish_klines(market, previous, now)
+
+    def _match(self, account, market, a, b, gap, now):
+        symbol = market.symbol
+        low, high = min(a, b), max(a, b)
+        events = []
+        position = account.positions.get(symbol)
+        stops = account.stops.get(symbol)
+        if position is not None and position.qty and stops:
+            for kind, level in zip(("TakeProfit", "StopLoss"), stops):
+                if level and low <= level <= high:
+                    events.append((abs(level - a), level, kind))
+        for order in account.orders.values():
+            if order["symbol"] == symbol and low <= float(order["price"]) <= high:
+                events.append((abs(float(order["price"]) - a), float(order["price"]), order["orderId"]))
+
+        # Уровни исполняются в порядке прохождения цены; на гэпе - по цене открытия
+        for _, level, kind in sorted(events, key=lambda event: event[0]):
+            price = b if gap else level
+            if kind in ("TakeProfit", "StopLoss"):
+                position = account.positions.get(symbol)
+                stops = account.stops.get(symbol)
+                if position is None or not position.qty or not stops or level not in stops:
+                    continue
+                side = "Sell" if position.qty > 0 else "Buy"
+                order = self._order(symbol, side, "Market", abs(position.qty), now, reduce_only=True,
+                                    create_type=f"CreateBy{kind}")
+                account.order_count += 1
+                self._execute(account, order, abs(position.qty), self._slipped(side, price), self.taker_fee,
+                              False, now)
+            else:
+                order = account.orders.pop(kind, None)
+                if order is not None:
+                    self._execute(account, order, float(order["qty"]), price, self.maker_fee, True, now)
+
+    def _publish_klines(self, market, previous, now):
+        topic = f"kline.{self.interval}.{market.symbol}"
+        sockets = [ws for ws in self._public if ws.connected and topic in ws.topics]
+        if not sockets:
+            return
+        items = []
+        current = market.index(now)
+        for i in range(max(market.index(previous), 0), current + 1):
+            close_time = int(market.candles.timestamp[i]) + market.step
+            if previous < close_time <= now:
+                items.append(self._kline_item(market, i, now, True))
+        if current >= 0 and now < market.end:
+            items.append(self._kline_item(market, current, now, False))
+        for item in items:
+            message = {"topic": topic, "data": [item], "ts": now, "type": "snapshot"}
+            self._outbox.extend((ws.topics[topic], message) for ws in sockets)
+
+    def _publish_trades(self, market, legs, sockets, now):
+        # Сделка в конце каждого отрезка пути цены: в потоке видны экстремумы свечи
+        topic = f"publicTrade.{market.symbol}"
+        data = [{"T": now, "s": market.symbol, "S": "Buy" if b >= a else "Sell", "v": _fmt(MIN_QTY),
+                 "p": _fmt(b), "i": self._next_id("trade"), "BT": False} for a, b, _ in legs]
+        if data:
+            message = {"topic": topic, "type": "snapshot", "ts": now, "data": data}
+            self._outbox.extend((ws.topics[topic], message) for ws in sockets)
+
+    def _kline_item(self, market, i, now, confirm):
+        row = market.row(i, now)
+        start = int(row[0])
+        return {"start": start, "end": start + market.step - 1, "interval": self.interval,
+                "open": row[1], "high": row[2], "low": row[3], "close": row[4],
+                "volume": row[5], "turnover": row[6], "confirm": confirm, "timestamp": now}
+
+    # Исполнение ордеров
+
+    def _order(self, symbol, side, order_type, qty, now, price=None, time_in_force="GTC", reduce_only=False,
+               take_profit=None, stop_loss=None, link_id=None, create_type="CreateByUser"):
+        return {"category": "linear", "symbol": symbol, "orderId": self._next_id("sim"),
+                "orderLinkId": link_id or "", "side": side, "orderType": order_type,
+                "price": _fmt(price) if price is not None else "0", "qty": _fmt(qty), "timeInForce": time_in_force,
+                "orderStatus": "New", "avgPrice": "0", "cumExecQty": "0", "cumExecFee": "0",
+                "takeProfit": _fmt(take_profit) if take_profit else "", "stopLoss": _fmt(stop_loss) if stop_loss else "",
+                "reduceOnly": reduce_only, "createType": create_type,
+                "createdTime": str(now), "updatedTime": str(now)}
+
+    def _slipped(self, side, price):
+        return price * (1 + self.slippage) if side == "Buy" else price * (1 - self.slippage)
+
+    def _execute(self, account, order, qty, price, fee_rate, is_maker, now):
+        symbol = order["symbol"]
+        position = account.positions.setdefault(symbol, Position())
+        before = position.qty
+        pnl = position.fill(order["side"], qty, price)
+        fee = qty * price * fee_rate
+        account.wallet += pnl - fee
+        account.realized += pnl
+        account.fees += fee
+        account.fill_count += 1
+
+        # TP/SL позиции снимаются при закрытии и развороте, TP/SL ордера ставятся на позицию
+        if not position.qty or (before > 0) != (position.qty > 0):
+            account.stops.pop(symbol, None)
+        if position.qty and (order["takeProfit"] or order["stopLoss"]):
+            account.stops[symbol] = [float(order["takeProfit"] or 0) or None, float(order["stopLoss"] or 0) or None]
+
+        order.update(orderStatus="Filled", avgPrice=_fmt(price), cumExecQty=_fmt(qty), cumExecFee=_fmt(fee),
+                     updatedTime=str(now))
+        execution = {"category": "linear", "symbol": symbol, "execId": self._next_id("exec"),
+                     "orderId": order["orderId"], "orderLinkId": order["orderLinkId"], "side": order["side"],
+                     "orderType": order["orderType"], "execType": "Trade", "execPrice": _fmt(price),
+                     "execQty": _fmt(qty), "execValue": _fmt(qty * price), "execFee": _fmt(fee),
+                     "feeRate": _fmt(fee_rate), "isMaker": is_maker, "execPnl": _fmt(pnl),
+                     "closedSize": _fmt(min(abs(before), qty) if before and (before > 0) != (order["side"] == "Buy")
+                                        else 0),
+                     "createType": order["createType"], "execTime": str(now)}
+        account.executions.append(execution)
+        self._publish(account, "order", [dict(order)], now)
+        self._publish(account, "execution", [execution], now)
+        self._publish(account, "position", [self._position_info(account, self.markets[symbol], now)], now)
+        self._publish(account, "wallet", self._wallet_info(account, now), now)
+
+    def _publish(self, account, topic, data, now):
+        message = {"id": self._next_id("msg"), "topic": topic, "creationTime": now, "data": data}
+        self._outbox.extend((ws.topics[topic], message) for ws in account.sockets
+                            if ws.connected and topic in ws.topics)
+
+    def _margin(self, account):
+        return sum(abs(position.qty) * position.entry_price / self.leverage
+                   for position in account.positions.values())
+
+    def _unrealized(self, account, now):
+        return sum(position.unrealized(self.markets[symbol].price(now) or position.entry_price)
+                   for symbol, position in account.positions.items() if position.qty)
+
+    def _available(self, account, now):
+        return max(0.0, account.wallet - self._margin(account) + min(self._unrealized(account, now), 0.0))
+
+    def _position_info(self, account, market, now):
+        position = account.positions.get(market.symbol) or Position()
+        take_profit, stop_loss = account.stops.get(market.symbol) or (None, None)
+        price = market.price(now) or position.entry_price
+        return {"category": "linear", "symbol": market.symbol, "positionIdx": 0, "tradeMode": 0,
+                "side": {"buy": "Buy", "sell": "Sell"}.get(position.side, ""),
+                "size": _fmt(abs(position.qty)), "avgPrice": _fmt(position.entry_price),
+                "entryPrice": _fmt(position.entry_price),
+                "positionValue": _fmt(abs(position.qty) * position.entry_price),
+                "leverage": str(self.leverage), "markPrice": _fmt(price),
+                "unrealisedPnl": _fmt(position.unrealized(price)),
+                "takeProfit": _fmt(take_profit) if take_profit else "0",
+                "stopLoss": _fmt(stop_loss) if stop_loss else "0",
+                "positionStatus": "Normal", "updatedTime": str(now)}
+
+    def _wallet_info(self, account, now):
+        unrealized = self._unrealized(account, now)
+        coin = {"coin": "USDT", "walletBalance": _fmt(account.wallet), "equity": _fmt(account.wallet + unrealized),
+                "availableToWithdraw": _fmt(self._available(account, now)), "unrealisedPnl": _fmt(unrealized),
+                "cumRealisedPnl": _fmt(account.realized - account.fees)}
+        return [{"accountType": "UNIFIED", "totalEquity": coin["equity"], "totalWalletBalance": coin["walletBalance"],
+                 "totalAvailableBalance": coin["availableToWithdraw"], "coin": [coin]}]
+
+    # Методы REST (имена - как у pybit HTTP с префиксом "_")
+
+    def _get_kline(self, account, now, symbol, interval, start=None, end=None, limit=None, **_):
+        market = self._market(symbol)
+        if str(interval) != self.interval:
+            raise _Rejected(10001, f"Симулятор отдаёт только свечи интервала {self.interval}.")
+        timestamps = market.candles.timestamp
+        stop = market.index(now) + 1
+        if end is not None:
+            stop = min(stop, int(np.searchsorted(timestamps, int(end), side="right")))
+        first = 0 if start is None else int(np.searchsorted(timestamps, int(start), side="left"))
+        first = max(first, stop - min(int(limit or 200), 1000))
+        # Закрытые свечи отдаются из готовых строк, пересчитывается только формирующаяся
+        current = market.index(now)
+        rows = [market.row(i, now) if i == current else market.row(i) for i in range(stop - 1, first - 1, -1)]
+        return {"category": "linear", "symbol": symbol, "list": rows}
+
+    def _get_instruments_info(self, account, now, symbol=None, **_):
+        return {"category": "linear", "nextPageCursor": "", "list": [
+            {"symbol": name, "contractType": "LinearPerpetual", "status": "Trading", "baseCoin": name[:-4],
+             "quoteCoin": "USDT", "settleCoin": "USDT", "priceFilter": {"tickSize": TICK_SIZE},
+             "lotSizeFilter": {"minOrderQty": _fmt(MIN_QTY), "qtyStep": _fmt(MIN_QTY)}}
+            for name in self.markets if symbol is None or name == symbol]}
+
+    def _get_wallet_balance(self, account, now, accountType="UNIFIED", coin=None, **_):
+        return {"list": self._wallet_info(account, now)}
+
+    def _get_positions(self, account, now, symbol=None, settleCoin=None, **_):
+        if symbol is not None:
+            markets = [self._market(symbol)]
+        else:
+            markets = [self.markets[name] for name, position in account.positions.items() if position.qty]
+        return {"category": "linear", "nextPageCursor": "",
+                "list": [self._position_info(account, market, now) for market in markets]}
+
+    def _set_trading_stop(self, account, now, symbol, takeProfit=None, stopLoss=None, **_):
+        market = self._market(symbol)
+        position = account.positions.get(symbol)
+        if position is None or not position.qty:
+            raise _Rejected(10001, "can not set tp/sl/ts for zero position")
+        stops = account.stops.setdefault(symbol, [None, None])
+        if takeProfit is not None:
+            stops[0] = float(takeProfit) or None
+        if stopLoss is not None:
+            stops[1] = float(stopLoss) or None
+        self._publish(account, "position", [self._position_info(account, market, now)], now)
+        return {}
+
+    def _place_order(self, account, now, symbol, side, orderType, qty, price=None, timeInForce="GTC",
+                     takeProfit=None, stopLoss=None, reduceOnly=False, orderLinkId=None, **_):
+        market = self._market(symbol)
+        last = market.price(now)
+        if side not in ("Buy", "Sell") or orderType not in ("Market", "Limit"):
+            raise _Rejected(10001, "params error: side or orderType invalid")
+        qty = float(qty)
+        if qty < MIN_QTY or last is None:
+            raise _Rejected(10001, "Qty invalid")
+        if orderType == "Limit" and not price:
+            raise _Rejected(10001, "params error: price is required for Limit order")
+        if orderLinkId and orderLinkId in account.link_ids:
+            raise _Rejected(110072, "OrderLinkedID is duplicate")
+
+        position = account.positions.get(symbol) or Position()
+        signed = qty if side == "Buy" else -qty
+        if reduceOnly:
+            if not position.qty or (position.qty > 0) == (signed > 0):
+                raise _Rejected(110017, "current position is zero, cannot fix reduce-only order qty")
+            qty = min(qty, abs(position.qty))
+            signed = qty if side == "Buy" else -qty
+        if not all(_on_tick(level) for level in (takeProfit, stopLoss) if level):
+            raise _Rejected(10001, "params error: TakeProfit/StopLoss price precision")
+        take_profit = float(takeProfit) if takeProfit else None
+        stop_loss = float(stopLoss) if stopLoss else None
+        reference = float(price) if orderType == "Limit" else last
+        direction = 1 if side == "Buy" else -1
+        if (take_profit and (take_profit - reference) * direction <= 0) or \
+                (stop_loss and (reference - stop_loss) * direction <= 0):
+            raise _Rejected(10001, "TakeProfit/StopLoss set for Buy position should be higher/lower than base price")
+        increase = max(0.0, abs(position.qty + signed) - abs(position.qty))
+        if increase * reference / self.leverage > self._available(account, now):
+            raise _Rejected(110007, "ab not enough for new order")
+
+        order = self._order(symbol, side, orderType, qty, now, price=float(price) if price else None,
+                            time_in_force=timeInForce or "GTC", reduce_only=bool(reduceOnly),
+                            take_profit=take_profit, stop_loss=stop_loss, link_id=orderLinkId)
+        if orderLinkId:
+            account.link_ids.add(orderLinkId)
+        account.order_count += 1
+        if orderType == "Market":
+            self._execute(account, order, qty, self._slipped(side, last), self.taker_fee, False, now)
+        elif (float(price) - last) * direction >= 0:
+            # Лимитный ордер по цене не хуже рынка исполняется сразу как тейкер
+            self._execute(account, order, qty, last, self.taker_fee, False, now)
+        elif timeInForce in ("IOC", "FOK"):
+            order.update(orderStatus="Cancelled", updatedTime=str(now))
+            self._publish(account, "order", [dict(order)], now)
+        else:
+            account.orders[order["orderId"]] = order
+            self._publish(account, "order", [dict(order)], now)
+        return {"orderId": order["orderId"], "orderLinkId": order["orderLinkId"]}
+
+    def _place_batch_order(self, account, now, category="linear", request=(), **_):
+        if not 0 < len(request) <= 10:
+            raise _Rejected(10001, "params error: request length must be 1..10")
+        results, statuses = [], []
+        for item in request:
+            try:
+                result = self._place_order(account, now, **item)
+                statuses.append({"code": 0, "msg": "OK"})
+            except _Rejected as e:
+                result = {"orderId": "", "orderLinkId": item.get("orderLinkId", "")}
+                statuses.append({"code": e.code, "msg": e.message})
+            results.append(dict(result, category=category, symbol=item.get("symbol"), createAt=str(now)))
+        return {"list": results, "retExtInfo": {"list": statuses}}
+
+    def _cancel_order(self, account, now, symbol, orderId=None, orderLinkId=None, **_):
+        for order_id, order in list(account.orders.items()):
+            if order["symbol"] == symbol and (order_id == orderId or (orderLinkId and order["orderLinkId"] == orderLinkId)):
+                del account.orders[order_id]
+                order.update(orderStatus="Cancelled", updatedTime=str(now))
+                self._publish(account, "order", [dict(order)], now)
+                return {"orderId": order_id, "orderLinkId": order["orderLinkId"]}
+        raise _Rejected(110001, "order not exists or too late to cancel")
+
+    def _get_open_orders(self, account, now, symbol=None, **_):
+        return {"category": "linear", "nextPageCursor": "",
+                "list": [dict(order) for order in account.orders.values() if symbol in (None, order["symbol"])]}
+
+    def _get_executions(self, account, now, symbol=None, orderId=None, orderLinkId=None, limit=50, **_):
+        executions = [execution for execution in reversed(account.executions)
+                      if symbol in (None, execution["symbol"]) and orderId in (None, execution["orderId"])
+                      and orderLinkId in (None, execution["orderLinkId"])]
+        return {"category": "linear", "nextPageCursor": "", "list": executions[:min(int(limit or 50), 100)]}
+
+
+class SimulatedAPI(BybitAPI):
+    """
+    BybitAPI поверх симулятора: те же методы, transport (повторы, размыкатель,
+    метрики) и потоки WebSocket, но без обращения к сети.
+    """
+
+    def __init__(self, exchange, api_key="sim", kline_cache=None, rate_limiter=None, recorder=None):
+        transport = HttpTransport(api_key, None, rate_limiter=rate_limiter, client=exchange.client(api_key))
+        super().__init__(api_key, None, kline_cache=kline_cache, rate_limiter=rate_limiter, transport=transport,
+                         recorder=recorder)
+        self.exchange = exchange
+
+    def open_websocket(self, channel_type="linear", max_delay=60):
+        return self.exchange.websocket(channel_type, self.api_key)
+
+
+def run_bot(api, trader, symbol, interval, exchange, poll=60, grace=None):
+    """
+    Цикл опроса одного бота, как в main.main(): баланс, свечи, шаг стратегии и пауза.
+    Завершается, когда история свечей симулятора закончилась.
+
+    :param grace: Если задан, пауза длится до закрытия следующей свечи плюс grace секунд
+        (IntervalScheduler), иначе poll секунд.
+    """
+    scheduler = IntervalScheduler(interval, grace, retry=poll) if grace is not None else None
+
+    def pause(error=False):
+        if scheduler is None:
+            exchange.clock.sleep(poll)
+        else:
+            delay = scheduler.delay(exchange.now() / 1000)
+            exchange.clock.sleep(min(poll, delay) if error else delay)
+
+    try:
+        while not exchange.finished():
+            try:
+                repeat = False
+                balance = api.get_balance()
+                if balance:
+                    candles = api.get_candles(symbol, interval)
+                    if len(candles) >= 2:
+                        repeat = trader.step(balance, candles.closed())
+                if not repeat:
+                    pause()
+            except Exception as e:
+                logging.error(f"Бот {api.api_key}: ошибка итерации: {e}")
+                pause(error=True)
+    finally:
+        if hasattr(exchange.clock, "leave"):
+            exchange.clock.leave()
+
+
+def load_candles(symbols, interval, cache_dir=None, synthetic=0, seed=0):
+    """
+    Свечи для симуляции: из KlineCache или синтетические (benchmark.synthetic_candles).
+    """
+    if synthetic:
+        from benchmark import synthetic_candles
+        return {symbol: synthetic_candles(synthetic, seed + i, interval) for i, symbol in enumerate(symbols)}
+    cache = KlineCache(cache_dir)
+    # Копия в память: memmap кэша может дописываться работающим ботом
+    return {symbol: cache.load(symbol, interval)[:] for symbol in symbols}
+
+
+def main():
+    from dotenv import load_dotenv
+    from strategy import Strategy
+    from trade_logger import TradeLogger
+    from trader import Trader
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Прогон ботов на локальном симуляторе биржи в ускоренном времени.")
+    parser.add_argument("--symbols", default=os.getenv("SYMBOL", "BTCUSDT"), help="Символы через запятую")
+    parser.add_argument("--interval", default=str(os.getenv("INTERVAL", 15)))
+    parser.add_argument("--bots", type=int, default=1, help="Количество ботов (символы распределяются по кругу)")
+    parser.add_argument("--cache-dir", default=os.getenv("KLINE_CACHE_DIR", "kline_cache"))
+    parser.add_argument("--synthetic", type=int, default=0, help="Синтетическая история из N свечей вместо кэша")
+    parser.add_argument("--balance", type=float, default=10000.0)
+    parser.add_argument("--risk", type=float, default=float(os.getenv("RISK_PERCENT", 1.0)))
+    parser.add_argument("--taker-fee", type=float, default=TAKER_FEE)
+    parser.add_argument("--maker-fee", type=float, default=MAKER_FEE)
+    parser.add_argument("--slippage", type=float, default=0.0, help="Проскальзывание рыночных ордеров (доля цены)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка запроса, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля запросов с временной ошибкой")
+    parser.add_argument("--rate-limits", action="store_true", help="Лимиты запросов Bybit на аккаунт")
+    parser.add_argument("--poll", type=float, default=60, help="Пауза между итерациями бота, с")
+    parser.add_argument("--grace", type=float,
+                        help="Опрос после закрытия каждой свечи с задержкой grace с (вместо паузы --poll)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    # Уровень задаётся обработчику: журнал сделок TradeLogger пишет с уровнем INFO в свой логгер
+    handler = logging.StreamHandler()
+    handler.setLevel(args.log_level)
+    logging.basicConfig(level=args.log_level, format="%(asctime)s [%(levelname)s] %(message)s", handlers=[handler])
+
+    symbols = [symbol.strip() for symbol in args.symbols.split(",") if symbol.strip()]
+    candles = load_candles(symbols, args.interval, args.cache_dir, args.synthetic, args.seed)
+    clock = VirtualClock(0, participants=args.bots)
+    set_clock(clock)
+    exchange = ExchangeSimulator(candles, args.interval, clock=clock, balance=args.balance,
+                                 taker_fee=args.taker_fee, maker_fee=args.maker_fee, slippage=args.slippage,
+                                 latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                 rate_limits=DEFAULT_LIMITS if args.rate_limits else None, seed=args.seed)
+    started_at = exchange.now()
+
+    trade_logger = TradeLogger(log_file=os.devnull)
+    threads = []
+    for i in range(args.bots):
+        symbol = symbols[i % len(symbols)]
+        api = SimulatedAPI(exchange, api_key=f"bot{i}")
+        strategy = Strategy(api, symbol, args.interval, int(os.getenv("RSI_OVERBOUGHT", 70)),
+                            int(os.getenv("RSI_OVERSOLD", 30)), cross_lookback=int(os.getenv("CROSS_LOOKBACK", 3)))
+        trader = Trader(api, strategy, trade_logger, args.risk)
+        threads.append(threading.Thread(target=run_bot, name=f"bot{i}", daemon=True,
+                                        args=(api, trader, symbol, args.interval, exchange, args.poll,
+                                              args.grace)))
+
+    wall = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall
+
+    simulated = (exchange.now() - started_at) / 1000
+    equity = []
+    for name, account in exchange.accounts.items():
+        equity.append(float(exchange._wallet_info(account, exchange.now())[0]["totalEquity"]))
+        print(f"{name:<8} ордеров: {account.order_count:>5}  исполнений: {account.fill_count:>5}  "
+              f"PnL: {account.realized:>12.2f}  комиссии: {account.fees:>10.2f}  капитал: {equity[-1]:>12.2f}")
+    print(f"Ботов: {args.bots}, запросов: {exchange.requests}, смоделировано {simulated / 3600:.1f} ч "
+          f"за {wall:.1f} с (ускорение x{simulated / max(wall, 1e-9):.0f})")
+    if equity:
+        print(f"Капитал: среднее {np.mean(equity):.2f}, мин. {min(equity):.2f}, макс. {max(equity):.2f}")
+
+
+if __name__ == "__main__":
+    main()
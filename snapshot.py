@@ -0,0 +1,68 @@
+import logging
+import os
+import pickle
+import clock
+
+# Версия формата снимка; увеличивается при изменении состояния IchimokuEngine и Trader
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotStore:
+    """
+    Снимки состояния трейдера на диске: потоковые индикаторы стратегии (включая
+    старшие интервалы MultiTimeframeStrategy) и позиция, увиденная при последней оценке.
+
+    После перезапуска состояние восстанавливается из снимка: первой оценке нужны
+    только свечи, закрывшиеся после снимка, а старшие интервалы не загружаются
+    заново. Снимок с другими параметрами стратегии или другой версии не используется.
+
+    Файл перезаписывается атомарно (временный файл и os.replace) не чаще раза
+    в interval секунд.
+
+    :param path: Путь к файлу снимка.
+    :param interval: Минимальный промежуток между записями, с.
+    """
+
+    def __init__(self, path, interval=60):
+        self.path = path
+        self.interval = interval
+        self._saved = None
+
+    def load(self, trader):
+        """
+        Восстановление состояния трейдера из снимка.
+
+        :return: True, если состояние восстановлено.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logging.warning(f"Не удалось прочитать снимок состояния {self.path}: {e}")
+            return False
+        if state.get("version") != SNAPSHOT_VERSION or not trader.restore(state["trader"]):
+            logging.info(f"Снимок состояния {self.path} не подходит к текущим настройкам и не используется.")
+            return False
+        logging.info(f"Состояние восстановлено из снимка {self.path} "
+                     f"({clock.now() - state['time']:.0f} с назад).")
+        return True
+
+    def save(self, trader, force=False):
+        """
+        Запись снимка, если с прошлой записи прошло не меньше interval секунд (или force).
+        """
+        now = clock.now()
+        if not force and self._saved is not None and now - self._saved < self.interval:
+            return
+        state = {"version": SNAPSHOT_VERSION, "time": now, "trader": trader.snapshot()}
+        temporary = self.path + ".tmp"
+        try:
+            with open(temporary, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logging.warning(f"Не удалось записать снимок состояния {self.path}: {e}")
+            return
+        self._saved = now
@@ -1,29 +1,148 @@
-import pandas as pd
-import pandas_ta as ta  # Импортируем pandas_ta вместо talib
+import logging
+import numpy as np
+from candles import as_series, is_continuous
+from indicators import IchimokuEngine, evaluate_lines
 
 
 class Strategy:
-    def __init__(self, api, symbol, interval, rsi_overbought, rsi_oversold):
+    def __init__(self, api, symbol, interval, rsi_overbought, rsi_oversold, cross_lookback=3, hub=None):
         self.api = api
         self.symbol = symbol
         self.interval = interval
         self.rsi_overbought = rsi_overbought
         self.rsi_oversold = rsi_oversold
+        # На сколько свечей назад смотреть при проверке креста (3 - сравнение с iloc[-4])
+        self.cross_lookback = cross_lookback
+
+        # Потоковый движок индикаторов, время и OHLC последней учтённой свечи
+        self.engine = IchimokuEngine(
+            rsi_overbought, rsi_oversold, cross_lookback=cross_lookback)
+        self.last_timestamp = None
+        self.last_key = None
+        # Клиент хаба рыночных данных (HubClient): индикаторы по свечам из хаба
+        # уже посчитаны, по ним определяются только сигнал и крест
+        self.hub = hub
+        self._hub_lines = None  # IndicatorLines последней оценки по данным хаба
+
+    def update(self, candles):
+        """
+        Инкрементальная оценка стратегии: в движок подаются только новые закрытые свечи.
+
+        Результат совпадает с evaluate, check_cross_flag и calculate_rsi для той же
+        истории, но стоит O(1) на свечу вместо пересчёта DataFrame. Если свечи получены
+        из хаба (hub), берутся опубликованные им ряды индикаторов.
+
+        :param candles: CandleSeries закрытых свечей (или список свечей Bybit).
+        :return: Evaluation(signal, cross_flag, rsi).
+        """
+        candles = as_series(candles)
+        if self.hub is not None and len(candles):
+            lines = self.hub.indicator_lines(self.symbol, self.interval, int(candles.timestamp[-1]))
+            if lines is not None:
+                # Потоковое состояние по этим свечам не накоплено: при возврате к движку счёт с нуля
+                if self.last_timestamp is not None:
+                    self.engine.reset()
+                    self.last_timestamp = None
+                self._hub_lines = lines
+                return evaluate_lines(lines, float(candles.close[-1]), self.rsi_overbought,
+                                      self.rsi_oversold, self.cross_lookback)
+
+        if self.last_timestamp is not None and len(candles):
+            # Разрыв в истории (например, после долгого простоя) или учтённая свеча
+            # изменилась задним числом - считаем с нуля
+            position = int(np.searchsorted(candles.timestamp, self.last_timestamp))
+            if candles.timestamp[0] > self.last_timestamp or (
+                    position < len(candles) and candles.key(position) != self.last_key) or \
+                    not self._continuous(candles[position:]):
+                self.engine.reset()
+                self.last_timestamp = None
+
+        self._hub_lines = None
+        if self.last_timestamp is not None:
+            candles = candles.since(self.last_timestamp)
+        if len(candles):
+            for high, low, close in zip(candles.high.tolist(), candles.low.tolist(),
+                                        candles.close.tolist()):
+                self.engine.update(high, low, close)
+            self.last_timestamp = int(candles.timestamp[-1])
+            self.last_key = candles.key()
+
+        return self.engine.last
+
+    def _continuous(self, candles):
+        """
+        Новые свечи идут подряд за последней учтённой, без пропусков.
+
+        :param candles: Свечи начиная с последней учтённой.
+        """
+        if is_continuous(candles, self.interval):
+            return True
+        logging.warning(f"Пропуск свечей {self.symbol} {self.interval} после {self.last_timestamp}: "
+                        f"индикаторы пересчитываются с нуля.")
+        return False
+
+    def cloud(self):
+        """
+        Уровни Ишимоку последней оценки для стопов (см. exits.exit_levels).
+
+        :return: Кортеж (kijun_sen, senkou_span_a, senkou_span_b); NaN, пока история короче периодов.
+        """
+        lines = self._hub_lines
+        if lines is not None:
+            return float(lines.kijun_sen[-1]), float(lines.senkou_span_a[-1]), float(lines.senkou_span_b[-1])
+        return self.engine.kijun_sen, self.engine.senkou_span_a, self.engine.senkou_span_b
+
+    def params(self):
+        """ Параметры, при которых сохранённое состояние движка остаётся верным """
+        return (self.symbol, str(self.interval), self.rsi_overbought, self.rsi_oversold, self.cross_lookback)
+
+    def snapshot(self):
+        """
+        Состояние потокового расчёта для снимка на диске (SnapshotStore).
+        """
+        return {"params": self.params(), "engine": self.engine,
+                "last_timestamp": self.last_timestamp, "last_key": self.last_key}
+
+    def restore(self, state):
+        """
+        Восстановление состояния из snapshot().
+
+        :return: True, если параметры стратегии совпали и состояние восстановлено.
+        """
+        if state.get("params") != self.params():
+            return False
+        self.engine = state["engine"]
+        self.last_timestamp = state["last_timestamp"]
+        self.last_key = state["last_key"]
+        return True
+
+    @staticmethod
+    def _frame(candles):
+        """
+        DataFrame поверх столбцов CandleSeries (свечи уже в хронологическом порядке).
+
+        :param candles: CandleSeries или список свечей Bybit.
+        :return: DataFrame со столбцами timestamp, open, high, low, close, volume.
+        """
+        # pandas и pandas_ta нужны только эталонным расчётам (бэктест, сверка в benchmark.py):
+        # основной цикл работает на IchimokuEngine и не тратит время на их импорт при запуске
+        import pandas as pd
+        # Сам импорт регистрирует аксессор df.ta, имя модуля дальше не используется
+        import pandas_ta  # noqa: F401
+
+        candles = as_series(candles)
+        return pd.DataFrame({name: getattr(candles, name) for name in (
+            "timestamp", "open", "high", "low", "close", "volume")})
 
     def evaluate(self, candles):
         """
         Оценка сигнала стратегии на основе данных свечей.
 
-        :param candles: Список свечей.
+        :param candles: CandleSeries (или список свечей Bybit).
         :return: Сигнал "BUY", "SELL" или "HOLD".
         """
-        # Переворачиваем данные свечей, чтобы последняя свеча была самой актуальной
-        candles = candles[::-1]
-
-        # Преобразование данных свечей в DataFrame
-        df = pd.DataFrame([candle[:6] for candle in candles], columns=[
-                          "timestamp", "open", "high", "low", "close", "volume"])
-        df["close"] = df["close"].astype(float)
+        # Преобразование данных свечей в DataFrame (последняя свеча - самая актуальная)
+        df = self._frame(candles)
 
         # Расчёт индикаторов Ишимоку
         high = df["high"]
@@ -60,16 +179,11 @@ class Strategy:
         """
         Расчет RSI на основе данных свечей.
 
-        :param candles: Список свечей.
+        :param candles: CandleSeries (или список свечей Bybit).
         :return: Последнее значение RSI.
         """
-        # Переворачиваем данные свечей, чтобы последняя свеча была самой актуальной
-        candles = candles[::-1]
-
-        # Преобразование данных свечей в DataFrame
-        df = pd.DataFrame([candle[:6] for candle in candles], columns=[
-            "timestamp", "open", "high", "low", "close", "volume"])
-        df["close"] = df["close"].astype(float)
+        # Преобразование данных свечей в DataFrame (последняя свеча - самая актуальная)
+        df = self._frame(candles)
 
         # Расчёт RSI с использованием pandas_ta
         df.ta.rsi(length=14, append=True)  # Добавляем RSI к DataFrame
@@ -81,16 +195,11 @@ class Strategy:
         """
         Проверка флага пересечения Tenkan Sen и Kijun Sen.
 
-        :param candles: Список свечей.
+        :param candles: CandleSeries (или список свечей Bybit).
         :return: "golden_cross", "death_cross" или None, если пересечения нет.
         """
-        # Переворачиваем данные свечей, чтобы последняя свеча была самой актуальной
-        candles = candles[::-1]
-
-        # Преобразование данных свечей в DataFrame
-        df = pd.DataFrame([candle[:6] for candle in candles], columns=[
-                          "timestamp", "open", "high", "low", "close", "volume"])
-        df["close"] = df["close"].astype(float)
+        # Преобразование данных свечей в DataFrame (последняя свеча - самая актуальная)
+        df = self._frame(candles)
 
         # Расчёт индикаторов Ишимоку
         high = df["high"]
@@ -102,10 +211,11 @@ class Strategy:
 
         # Проверка пересечения Tenkan Sen и Kijun Sen
         # увеличил показатель с 2 до 4 чтобы крест держался дольше
-        if tenkan_sen.iloc[-1] > kijun_sen.iloc[-1] and tenkan_sen.iloc[-4] <= kijun_sen.iloc[-4]:
+        previous = -1 - self.cross_lookback
+        if tenkan_sen.iloc[-1] > kijun_sen.iloc[-1] and tenkan_sen.iloc[previous] <= kijun_sen.iloc[previous]:
             return "golden_cross"  # Золотой крест: Tenkan Sen пересекает Kijun Sen снизу вверх
         # увеличил показатель с 2 до 4 чтобы крест держался дольше
-        elif tenkan_sen.iloc[-1] < kijun_sen.iloc[-1] and tenkan_sen.iloc[-4] >= kijun_sen.iloc[-4]:
+        elif tenkan_sen.iloc[-1] < kijun_sen.iloc[-1] and tenkan_sen.iloc[previous] >= kijun_sen.iloc[previous]:
             return "death_cross"  # Мертвый крест: Tenkan Sen пересекает Kijun Sen сверху вниз
 
         return None  # Пересечения нет
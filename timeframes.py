@@ -0,0 +1,243 @@
+import logging
+from candles import CandleBuffer, CandleSeries, as_series, candle_start_ms, interval_ms, next_candle_ms
+from strategy import Strategy
+from transport import ExchangeError
+
+OPPOSITE = {"BUY": "SELL", "SELL": "BUY"}
+
+# Правила подтверждения сигнала базового интервала старшими интервалами:
+# функция (сигнал, сигналы старших интервалов) -> True, если вход разрешён
+CONFIRM_RULES = {
+    # Все старшие интервалы дают тот же сигнал
+    "all": lambda signal, others: all(other == signal for other in others),
+    # Тот же сигнал на большинстве старших интервалов
+    "majority": lambda signal, others: sum(other == signal for other in others) * 2 > len(others),
+    # Ни один старший интервал не даёт противоположного сигнала
+    "no_conflict": lambda signal, others: OPPOSITE[signal] not in others,
+}
+
+
+class TimeframeAggregator:
+    """
+    Свечи старшего интервала, собираемые из закрытых свечей базового интервала.
+
+    Для текущей свечи хранятся только открытие, максимум, минимум, закрытие,
+    объём и оборот; закрытые свечи копятся в CandleBuffer.
+
+    :param interval: Старший интервал Bybit ("60", "240", "D", "W", "M").
+    :param base_interval: Интервал входящих свечей; должен делить interval нацело.
+    """
+
+    def __init__(self, interval, base_interval):
+        step, base = interval_ms(interval), interval_ms(base_interval)
+        if step <= base or step % base:
+            raise ValueError(f"Интервал {interval} нельзя собрать из свечей {base_interval}.")
+        self.interval = interval
+        self.base_ms = base
+        self.buffer = CandleBuffer()
+        self._bucket = None  # [start, open, high, low, close, volume, turnover]
+        self._end = None
+        self._complete = False  # свеча собирается с начала интервала
+
+    def seed(self, candles):
+        """
+        Добавление истории закрытых свечей интервала (например, из REST при старте).
+        """
+        self.buffer.extend(candles)
+        last = self.buffer.last_timestamp()
+        if self._bucket is not None and last is not None and self._bucket[0] <= last:
+            self._bucket = None
+
+    def add(self, row):
+        """
+        Учёт одной закрытой свечи базового интервала.
+
+        :param row: Кортеж (timestamp, open, high, low, close, volume, turnover).
+        :return: Количество закрытых свечей интервала (больше 1 только при пропуске в данных).
+        """
+        timestamp = int(row[0])
+        closed = 0
+        bucket = self._bucket
+        # Границы интервала считаются только для первой базовой свечи в нём
+        if bucket is None or not bucket[0] <= timestamp < self._end:
+            start = candle_start_ms(timestamp, self.interval)
+            last = self.buffer.last_timestamp()
+            if last is not None and start <= last:
+                return 0  # свеча интервала уже есть в истории
+            if bucket is not None:
+                # Последние базовые свечи интервала пропущены: свеча закрывается по имеющимся
+                closed += self._close()
+            bucket = None
+        if bucket is None:
+            self._bucket = [start] + [float(value) for value in row[1:7]]
+            self._end = next_candle_ms(start, self.interval)
+            self._complete = timestamp == start
+        else:
+            bucket[2] = max(bucket[2], row[2])
+            bucket[3] = min(bucket[3], row[3])
+            bucket[4] = float(row[4])
+            bucket[5] += row[5]
+            bucket[6] += row[6]
+        if timestamp + self.base_ms >= self._end:
+            closed += self._close()
+        return closed
+
+    def _close(self):
+        bucket, self._bucket = self._bucket, None
+        # Начало интервала раньше начала истории базовых свечей: свеча неполная и не выдаётся
+        if not self._complete:
+            return 0
+        self.buffer.upsert(bucket)
+        return 1
+
+    def series(self):
+        """ Закрытые свечи интервала (CandleSeries без копирования) """
+        return self.buffer.series()
+
+
+class Resampler:
+    """
+    Несколько старших интервалов из одного потока закрытых свечей базового интервала.
+
+    :param on_close: Функция on_close(interval, candles), вызываемая после update
+        для каждого интервала, у которого закрылась свеча; candles - все закрытые свечи интервала.
+    """
+
+    def __init__(self, base_interval, intervals, on_close=None):
+        self.base_interval = base_interval
+        self.aggregators = {interval: TimeframeAggregator(interval, base_interval) for interval in intervals}
+        self.on_close = on_close
+        self.last_timestamp = None
+
+    def seed(self, interval, candles):
+        self.aggregators[interval].seed(as_series(candles))
+
+    def update(self, candles):
+        """
+        Учёт базовых свечей новее уже обработанных.
+
+        :param candles: CandleSeries закрытых свечей базового интервала.
+        :return: Список интервалов, у которых закрылась хотя бы одна свеча.
+        """
+        candles = as_series(candles)
+        if self.last_timestamp is not None:
+            candles = candles.since(self.last_timestamp)
+        if not len(candles):
+            return []
+        closed = []
+        for row in zip(*(getattr(candles, name).tolist() for name in CandleSeries.COLUMNS)):
+            for interval, aggregator in self.aggregators.items():
+                if aggregator.add(row) and interval not in closed:
+                    closed.append(interval)
+        self.last_timestamp = int(candles.timestamp[-1])
+        if self.on_close is not None:
+            for interval in closed:
+                self.on_close(interval, self.aggregators[interval].series())
+        return closed
+
+
+class MultiTimeframeStrategy:
+    """
+    Стратегия базового интервала с подтверждением входа старшими интервалами.
+
+    Старшие интервалы собираются Resampler из тех же свечей, что приходят в update,
+    и оцениваются своими Strategy при закрытии их свечей. Свечи старших интервалов
+    запрашиваются у API один раз при первом update для прогрева индикаторов.
+
+    Сигнал BUY/SELL заменяется на HOLD, если правило rule из CONFIRM_RULES не
+    выполнено; крест и RSI берутся с базового интервала, поэтому выходы по RSI
+    не задерживаются. Интерфейс как у Strategy (symbol, interval, update).
+
+    :param strategy: Strategy базового интервала.
+    :param intervals: Старшие интервалы для подтверждения.
+    """
+
+    def __init__(self, strategy, intervals, rule="no_conflict"):
+        if rule not in CONFIRM_RULES:
+            raise ValueError(f"Неизвестное правило подтверждения: {rule}.")
+        self.strategy = strategy
+        self.api = strategy.api
+        self.symbol = strategy.symbol
+        self.interval = strategy.interval
+        self.rule = rule
+        self.strategies = {
+            interval: Strategy(strategy.api, strategy.symbol, interval, strategy.rsi_overbought,
+                               strategy.rsi_oversold, cross_lookback=strategy.cross_lookback)
+            for interval in intervals
+        }
+        self.evaluations = dict.fromkeys(intervals)  # последняя оценка каждого старшего интервала
+        self.resampler = Resampler(strategy.interval, intervals, on_close=self._on_close)
+        self._seeded = False
+
+    def _seed(self):
+        for interval in self.strategies:
+            try:
+                candles = self.api.get_candles(self.symbol, interval)
+            except ExchangeError as e:
+                logging.warning(f"Не удалось загрузить свечи {self.symbol} {interval} для прогрева: {e}")
+                continue
+            self.resampler.seed(interval, candles.closed())
+            self._on_close(interval, self.resampler.aggregators[interval].series())
+
+    def _on_close(self, interval, candles):
+        if len(candles):
+            self.evaluations[interval] = self.strategies[interval].update(candles)
+
+    def cloud(self):
+        return self.strategy.cloud()
+
+    def params(self):
+        return (self.strategy.params(), self.rule, tuple(str(interval) for interval in self.strategies))
+
+    def snapshot(self):
+        """
+        Состояние базового и старших интервалов для снимка на диске (SnapshotStore).
+        """
+        return {"params": self.params(), "base": self.strategy.snapshot(),
+                "strategies": {interval: strategy.snapshot() for interval, strategy in self.strategies.items()},
+                "evaluations": self.evaluations, "aggregators": self.resampler.aggregators,
+                "last_timestamp": self.resampler.last_timestamp}
+
+    def restore(self, state):
+        """
+        Восстановление состояния из snapshot(); старшие интервалы после этого не загружаются заново.
+
+        :return: True, если параметры совпали и состояние восстановлено.
+        """
+        if state.get("params") != self.params():
+            return False
+        self.strategy.restore(state["base"])
+        for interval, strategy in self.strategies.items():
+            strategy.restore(state["strategies"][interval])
+        self.evaluations = state["evaluations"]
+        self.resampler.aggregators = state["aggregators"]
+        self.resampler.last_timestamp = state["last_timestamp"]
+        self._seeded = True
+        return True
+
+    def confirmations(self):
+        """ Сигналы старших интервалов (None - интервал ещё не оценён) """
+        return {interval: evaluation.signal if evaluation is not None else None
+                for interval, evaluation in self.evaluations.items()}
+
+    def update(self, candles):
+        """
+        Оценка по закрытым свечам базового интервала.
+
+        :param candles: CandleSeries закрытых свечей (или список свечей Bybit).
+        :return: Evaluation(signal, cross_flag, rsi) базового интервала с подтверждённым сигналом.
+        """
+        candles = as_series(candles)
+        if not self._seeded:
+            self._seeded = True
+            if self.api is not None:
+                self._seed()
+        self.resampler.update(candles)
+        evaluation = self.strategy.update(candles)
+        if evaluation is None or evaluation.signal not in OPPOSITE:
+            return evaluation
+        confirmations = self.confirmations()
+        if CONFIRM_RULES[self.rule](evaluation.signal, list(confirmations.values())):
+            return evaluation
+        logging.info("Сигнал %s не подтверждён старшими интервалами: %s.", evaluation.signal, confirmations)
+        return evaluation._replace(signal="HOLD")
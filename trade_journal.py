@@ -0,0 +1,242 @@
+import argparse
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+from position import Position
+
+# Комиссия тейкера Bybit, если фактическая комиссия сделки неизвестна
+DEFAULT_FEE_RATE = 0.00055
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trades (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    symbol TEXT NOT NULL,
+    action TEXT NOT NULL,
+    price REAL NOT NULL,
+    qty REAL NOT NULL,
+    fee REAL NOT NULL,
+    pnl REAL NOT NULL,
+    position_qty REAL NOT NULL,
+    entry_price REAL NOT NULL,
+    reason_code TEXT,
+    rsi REAL,
+    cross_flag TEXT,
+    order_id TEXT,
+    latency_ms REAL,
+    expected_price REAL,
+    slippage_bps REAL
+);
+CREATE INDEX IF NOT EXISTS trades_ts ON trades (ts);
+CREATE INDEX IF NOT EXISTS trades_symbol_ts ON trades (symbol, ts);
+CREATE TABLE IF NOT EXISTS daily (
+    day TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    trades INTEGER NOT NULL,
+    volume REAL NOT NULL,
+    pnl REAL NOT NULL,
+    fees REAL NOT NULL,
+    PRIMARY KEY (day, symbol)
+) WITHOUT ROWID;
+"""
+
+TRADE_FIELDS = ("id", "ts", "symbol", "action", "price", "qty", "fee", "pnl", "position_qty",
+                "entry_price", "reason_code", "rsi", "cross_flag", "order_id", "latency_ms",
+                "expected_price", "slippage_bps")
+
+# Столбцы, добавленные после первой версии схемы: (имя, тип)
+MIGRATIONS = (("expected_price", "REAL"), ("slippage_bps", "REAL"))
+
+
+def _day(ts):
+    return datetime.datetime.fromtimestamp(ts / 1000, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+def _to_ms(date):
+    """
+    Дата "ГГГГ-ММ-ДД" (UTC) в миллисекунды.
+    """
+    parsed = datetime.datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+class TradeJournal:
+    """
+    Журнал сделок в SQLite (режим WAL) с типизированными полями.
+
+    Реализованный PnL считается по чистой позиции символа в момент записи,
+    дневные итоги по символам ведутся в отдельной таблице, поэтому сводки
+    за любой период не перебирают все сделки.
+    """
+
+    def __init__(self, path="trade_journal.db", fee_rate=DEFAULT_FEE_RATE):
+        self.path = path
+        self.fee_rate = fee_rate
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # Журналы, созданные до появления новых столбцов, дополняются ими на месте
+        existing = {row["name"] for row in self._db.execute("PRAGMA table_info(trades)")}
+        with self._db:
+            for name, kind in MIGRATIONS:
+                if name not in existing:
+                    self._db.execute(f"ALTER TABLE trades ADD COLUMN {name} {kind}")
+
+    def _position(self, symbol):
+        # Позиция восстанавливается по последней записи символа
+        position = self._positions.get(symbol)
+        if position is None:
+            position = Position()
+            row = self._db.execute(
+                "SELECT position_qty, entry_price FROM trades WHERE symbol = ? ORDER BY ts DESC, id DESC LIMIT 1",
+                (symbol,)).fetchone()
+            if row is not None:
+                position.qty, position.entry_price = row["position_qty"], row["entry_price"]
+            self._positions[symbol] = position
+        return position
+
+    def record(self, symbol, action, price, qty, ts=None, fee=None, reason_code=None, rsi=None,
+               cross_flag=None, order_id=None, latency_ms=None, expected_price=None, slippage_bps=None):
+        """
+        Запись сделки.
+
+        :param action: "BUY" или "SELL".
+        :param ts: Время сделки в миллисекундах (по умолчанию - текущее).
+        :param fee: Комиссия (по умолчанию - оценка по fee_rate).
+        :param expected_price: Цена решения, если price - фактическая цена исполнения.
+        :param slippage_bps: Проскальзывание относительно expected_price, б.п.
+        :return: Реализованный PnL сделки.
+        """
+        if ts is None:
+            ts = int(time.time() * 1000)
+        price, qty = float(price), float(qty)
+        if fee is None:
+            fee = price * qty * self.fee_rate
+        with self._lock:
+            position = self._position(symbol)
+            pnl = position.fill(action.capitalize(), qty, price)
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO trades (ts, symbol, action, price, qty, fee, pnl, position_qty, entry_price,"
+                    " reason_code, rsi, cross_flag, order_id, latency_ms, expected_price, slippage_bps)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (ts, symbol, action, price, qty, fee, pnl, position.qty, position.entry_price,
+                     reason_code, rsi, cross_flag, order_id, latency_ms, expected_price, slippage_bps))
+                self._db.execute(
+                    "INSERT INTO daily (day, symbol, trades, volume, pnl, fees) VALUES (?, ?, 1, ?, ?, ?)"
+                    " ON CONFLICT (day, symbol) DO UPDATE SET trades = trades + 1,"
+                    " volume = volume + excluded.volume, pnl = pnl + excluded.pnl, fees = fees + excluded.fees",
+                    (_day(ts), symbol, price * qty, pnl, fee))
+        return pnl
+
+    def summary(self, symbol=None, since=None, until=None, period="all"):
+        """
+        Сделки, объём, PnL и комиссии по символам за период.
+
+        :param since: Первый день "ГГГГ-ММ-ДД" включительно.
+        :param until: Последний день "ГГГГ-ММ-ДД" включительно.
+        :param period: Группировка: "day", "month" или "all".
+        :return: Список словарей period, symbol, trades, volume, pnl, fees, net.
+        """
+        key = {"day": "day", "month": "substr(day, 1, 7)", "all": "'all'"}[period]
+        conditions, params = self._conditions(symbol, since, until, "day", str)
+        query = (f"SELECT {key} AS period, symbol, SUM(trades) AS trades, SUM(volume) AS volume,"
+                 f" SUM(pnl) AS pnl, SUM(fees) AS fees, SUM(pnl) - SUM(fees) AS net FROM daily"
+                 f"{conditions} GROUP BY period, symbol ORDER BY period, symbol")
+        return [dict(row) for row in self._db.execute(query, params)]
+
+    def by_reason(self, symbol=None, since=None, until=None):
+        """
+        Сделки, PnL, комиссии и среднее проскальзывание (б.п.) по кодам причин.
+        """
+        conditions, params = self._conditions(symbol, since, until, "ts", _to_ms)
+        query = ("SELECT reason_code, COUNT(*) AS trades, SUM(pnl) AS pnl, SUM(fee) AS fees,"
+                 " AVG(slippage_bps) AS slippage_bps FROM trades"
+                 f"{conditions} GROUP BY reason_code ORDER BY fees DESC")
+        return [dict(row) for row in self._db.execute(query, params)]
+
+    def trades(self, symbol=None, since=None, until=None, reason_code=None, limit=100):
+        """
+        Последние сделки, новые первыми.
+        """
+        conditions, params = self._conditions(symbol, since, until, "ts", _to_ms)
+        if reason_code is not None:
+            conditions += " AND reason_code = ?" if conditions else " WHERE reason_code = ?"
+            params.append(reason_code)
+        query = f"SELECT * FROM trades{conditions} ORDER BY ts DESC, id DESC LIMIT ?"
+        return [dict(row) for row in self._db.execute(query, params + [limit])]
+
+    @staticmethod
+    def _conditions(symbol, since, until, column, convert):
+        clauses, params = [], []
+        if symbol is not None:
+            clauses.append("symbol = ?")
+            params.append(symbol)
+        if since is not None:
+            clauses.append(f"{column} >= ?")
+            params.append(convert(since))
+        if until is not None:
+            if column == "ts":
+                clauses.append("ts < ?")
+                params.append(_to_ms(until) + 86400000)
+            else:
+                clauses.append(f"{column} <= ?")
+                params.append(convert(until))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _format(rows, fields):
+    lines = ["\t".join(fields)]
+    for row in rows:
+        lines.append("\t".join(
+            f"{row[name]:.6g}" if isinstance(row[name], float) else str(row[name]) for name in fields))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запросы к журналу сделок.")
+    parser.add_argument("--db", default=os.getenv("TRADE_JOURNAL_DB", "trade_journal.db"))
+    parser.add_argument("--symbol")
+    parser.add_argument("--since", help="Первый день ГГГГ-ММ-ДД (UTC)")
+    parser.add_argument("--until", help="Последний день ГГГГ-ММ-ДД (UTC)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary = commands.add_parser("summary", help="PnL, комиссии и количество сделок")
+    summary.add_argument("--period", choices=("day", "month", "all"), default="all")
+    commands.add_parser("reasons", help="Итоги по кодам причин")
+    trades = commands.add_parser("trades", help="Последние сделки")
+    trades.add_argument("--reason")
+    trades.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    journal = TradeJournal(args.db)
+    try:
+        if args.command == "summary":
+            rows = journal.summary(args.symbol, args.since, args.until, args.period)
+            print(_format(rows, ["period", "symbol", "trades", "volume", "pnl", "fees", "net"]))
+        elif args.command == "reasons":
+            rows = journal.by_reason(args.symbol, args.since, args.until)
+            print(_format(rows, ["reason_code", "trades", "pnl", "fees", "slippage_bps"]))
+        else:
+            rows = journal.trades(args.symbol, args.since, args.until, args.reason, args.limit)
+            print(_format(rows, TRADE_FIELDS))
+    finally:
+        journal.close()
+
+
+if __name__ == "__main__":
+    main()
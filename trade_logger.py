@@ -1,29 +1,46 @@
 import logging
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import os
-from dotenv import load_dotenv
+from log_pipeline import env_settings, queued_handler, rotating_handler, stop_listener
+from notifier import NotificationDispatcher, SmtpSink
 
-# Загрузка переменных из .env
-load_dotenv()
+
+def _rotation_settings():
+    settings = env_settings()
+    return {"max_bytes": settings["max_bytes"], "backup_count": settings["backup_count"], "when": settings["when"]}
 
 
 class TradeLogger:
-    def __init__(self, log_file="trade_logs.log", email_enabled=False):
+    def __init__(self, log_file="trade_logs.log", email_enabled=False, sinks=None, journal=None):
         self.log_file = log_file
         self.email_enabled = email_enabled
+        # Структурированный журнал сделок (TradeJournal) для запросов и сводок
+        self.journal = journal
 
-        # Настройка логирования в файл
+        # Настройка логирования в файл: запись с ротацией выполняется в потоке QueueListener,
+        # размещение ордера не ждёт диска
         self.logger = logging.getLogger("TradeLogger")
         self.logger.setLevel(logging.INFO)
-        file_handler = logging.FileHandler(self.log_file, encoding="utf-8")
-        formatter = logging.Formatter(
-            "%(asctime)s [%(levelname)s] %(message)s")
-        file_handler.setFormatter(formatter)
-        self.logger.addHandler(file_handler)
-
-    def log_trade(self, action, symbol, price, quantity, reason, context, additional_info=None):
+        handler, self._listener = queued_handler(rotating_handler(self.log_file, **_rotation_settings()))
+        self.logger.addHandler(handler)
+
+        # Уведомления отправляются в фоновом потоке, чтобы не задерживать размещение ордеров
+        self.dispatcher = None
+        if sinks is None and email_enabled:
+            sinks = [SmtpSink(
+                sender=os.getenv("EMAIL"),
+                recipient=os.getenv("EMAIL_RECIPIENT"),
+                password=os.getenv("EMAIL_PASSWORD"),
+                host=os.getenv("SMTP_HOST", "smtp.yandex.ru"),
+                port=int(os.getenv("SMTP_PORT", 587)),
+                starttls=os.getenv("SMTP_STARTTLS", "True") == "True",
+            )]
+        if sinks:
+            self.dispatcher = NotificationDispatcher(
+                sinks, digest_window=float(os.getenv("NOTIFY_DIGEST_SECONDS", 2.0)))
+
+    def log_trade(self, action, symbol, price, quantity, reason, context, additional_info=None,
+                  reason_code=None, order_id=None, latency_ms=None, fee=None, expected_price=None,
+                  slippage_bps=None):
         """
         Логирование сделки с обоснованием и контекстом.
 
@@ -34,6 +51,12 @@ class TradeLogger:
         :param reason: Обоснование сделки.
         :param context: Контекст сделки (например, наличие открытой позиции, тип креста и т.д.).
         :param additional_info: Дополнительная информация (опционально).
+        :param reason_code: Код причины сделки (например, "entry_long").
+        :param order_id: Идентификатор ордера на бирже.
+        :param latency_ms: Время размещения ордера в миллисекундах.
+        :param fee: Комиссия сделки (если известна).
+        :param expected_price: Цена, по которой принималось решение (если цена сделки - цена исполнения).
+        :param slippage_bps: Проскальзывание относительно expected_price, б.п.
         """
         message = (
             f"Сделка: {action}\n"
@@ -44,47 +67,47 @@ class TradeLogger:
             f"Контекст: {context}\n"
         )
 
+        if slippage_bps is not None:
+            message += f"Цена решения: {expected_price} (проскальзывание {slippage_bps:.1f} б.п.)\n"
+
         if additional_info:
             message += f"Дополнительная информация: {additional_info}\n"
 
         # Логирование в файл
         self.logger.info(message)
 
+        # Запись в журнал сделок
+        if self.journal is not None:
+            try:
+                self.journal.record(
+                    symbol, action, price, quantity, fee=fee, reason_code=reason_code,
+                    rsi=context.get("rsi_value"), cross_flag=context.get("cross_flag"),
+                    order_id=order_id, latency_ms=latency_ms, expected_price=expected_price,
+                    slippage_bps=slippage_bps)
+            except Exception as e:
+                self.logger.error(f"Ошибка записи в журнал сделок: {e}")
+
         # Отправка по электронной почте (если включено)
         if self.email_enabled:
             self.send_email(message)
 
     def send_email(self, message):
         """
-        Отправка сообщения по электронной почте.
+        Постановка сообщения в очередь на отправку (без ожидания SMTP).
 
         :param message: Текст сообщения.
         """
-        try:
-            email = os.getenv("EMAIL")
-            password = os.getenv("EMAIL_PASSWORD")
-            recipient = os.getenv("EMAIL_RECIPIENT")
-
-            msg = MIMEMultipart()
-            msg["From"] = email
-            msg["To"] = recipient
-            msg["Subject"] = "Торговое уведомление"
-
-            msg.attach(MIMEText(message, "plain"))
-
-            server = smtplib.SMTP("smtp.yandex.ru", 587)
-            server.starttls()
-            server.login(email, password)
-            server.sendmail(email, recipient, msg.as_string())
-            server.quit()
-
-            self.logger.info("Сообщение отправлено по электронной почте.")
-        except Exception as e:
-            self.logger.error(f"Ошибка при отправке email: {e}")
+        if self.dispatcher is not None:
+            self.dispatcher.notify(message)
 
     def disable(self):
         """
         Отключение логирования.
         """
         self.logger.handlers.clear()
+        self.logger.propagate = False
+        stop_listener(self._listener)
         self.email_enabled = False
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+            self.dispatcher = None
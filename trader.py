@@ -0,0 +1,274 @@
+from collections import namedtuple
+import logging
+import time
+from candles import interval_ms
+import metrics
+from order_manager import link_id
+
+# Торговое действие: сторона ордера, код причины, сообщение в лог и обоснование сделки.
+# repeat=True означает, что позиция закрыта и оценку нужно сразу повторить.
+Action = namedtuple("Action", ["side", "reason_code", "message", "reason", "repeat"])
+
+RSI_EXIT_LONG = Action(
+    "Sell", "rsi_exit_long",
+    "Закрытие длинной позиции по RSI (пересечение 50 сверху вниз)...",
+    "Закрытие длинной позиции по RSI (пересечение 50 сверху вниз).", True)
+RSI_EXIT_SHORT = Action(
+    "Buy", "rsi_exit_short",
+    "Закрытие короткой позиции по RSI (пересечение 50 снизу вверх)...",
+    "Закрытие короткой позиции по RSI (пересечение 50 снизу вверх).", True)
+CLOSE_SHORT_BEFORE_LONG = Action(
+    "Buy", "close_short_before_long",
+    "Закрытие короткой позиции перед открытием длинной...",
+    "Закрытие короткой позиции перед открытием длинной.", False)
+CLOSE_LONG_BEFORE_SHORT = Action(
+    "Sell", "close_long_before_short",
+    "Закрытие длинной позиции перед открытием короткой...",
+    "Закрытие длинной позиции перед открытием короткой.", False)
+ENTRY_LONG = Action(
+    "Buy", "entry_long",
+    "Сигнал на покупку. Размещение ордера...",
+    "Сигнал на покупку: цена выше облака Ишимоку, Tenkan Sen > Kijun Sen, RSI < 70.", False)
+ENTRY_SHORT = Action(
+    "Sell", "entry_short",
+    "Сигнал на продажу. Размещение ордера...",
+    "Сигнал на продажу: цена ниже облака Ишимоку, Tenkan Sen < Kijun Sen, RSI > 30.", False)
+
+# Индекс действия в ACTIONS - код решения в orderLinkId
+ACTIONS = (RSI_EXIT_LONG, RSI_EXIT_SHORT, CLOSE_SHORT_BEFORE_LONG, CLOSE_LONG_BEFORE_SHORT,
+           ENTRY_LONG, ENTRY_SHORT)
+
+
+def get_position_size(balance, risk_percent, last_price):
+    """
+    Расчет размера позиции на основе процента риска и последней цены.
+
+    :param balance: Доступный баланс.
+    :param risk_percent: Процент риска от депозита.
+    :param last_price: Последняя цена актива.
+    :return: Размер позиции или None, если расчет невозможен.
+    """
+    if balance == 0:
+        logging.warning("Баланс равен 0, невозможно открыть позицию.")
+        return None
+
+    position_value = balance * risk_percent
+    position_size = position_value / last_price
+
+    # Округление до 3 знаков после запятой
+    position_size = round(position_size, 3)
+
+    # Минимальный размер позиции (например, 0.001)
+    min_position_size = 0.001
+
+    # Если размер позиции меньше минимального, возвращаем None
+    if position_size < min_position_size:
+        logging.warning(
+            f"Размер позиции ({position_size}) меньше минимального ({min_position_size}). Позиция не будет открыта."
+        )
+        return None
+
+    return position_size
+
+
+def decide(signal, cross_flag, rsi_value, position_side):
+    """
+    Правила открытия и закрытия позиций без обращения к бирже.
+
+    :param signal: Сигнал стратегии "BUY", "SELL" или "HOLD".
+    :param cross_flag: "golden_cross", "death_cross" или None.
+    :param rsi_value: Значение RSI по последней закрытой свече.
+    :param position_side: Сторона открытой позиции ("buy", "sell") или None.
+    :return: Кортеж (Action или None, сообщение для лога).
+    """
+    # Проверка RSI для закрытия позиции
+    if position_side == "buy" and rsi_value < 50:
+        return RSI_EXIT_LONG, RSI_EXIT_LONG.message
+    elif position_side == "sell" and rsi_value > 50:
+        return RSI_EXIT_SHORT, RSI_EXIT_SHORT.message
+
+    if signal == "BUY":
+        if position_side == "sell":
+            return CLOSE_SHORT_BEFORE_LONG, CLOSE_SHORT_BEFORE_LONG.message
+        elif position_side is not None:
+            return None, "Длинная позиция уже открыта. Новый ордер не размещается."
+        # Проверка на золотой крест перед открытием новой позиции
+        elif cross_flag == "golden_cross":
+            return ENTRY_LONG, ENTRY_LONG.message
+        return None, "Сигнал на покупку есть, но золотой крест не сформирован. Позиция не открыта."
+    elif signal == "SELL":
+        if position_side == "buy":
+            return CLOSE_LONG_BEFORE_SHORT, CLOSE_LONG_BEFORE_SHORT.message
+        elif position_side is not None:
+            return None, "Короткая позиция уже открыта. Новый ордер не размещается."
+        # Проверка на мертвый крест перед открытием новой позиции
+        elif cross_flag == "death_cross":
+            return ENTRY_SHORT, ENTRY_SHORT.message
+        return None, "Сигнал на продажу есть, но мертвый крест не сформирован. Позиция не открыта."
+
+    return None, "Нет торгового сигнала."
+
+
+class Trader:
+    def __init__(self, api, strategy, trade_logger, risk_percent, orders=None, exits=None):
+        self.api = api
+        self.strategy = strategy
+        self.trade_logger = trade_logger
+        # OrderManager: размещение с идемпотентным orderLinkId и запись сделки по
+        # фактическому исполнению; без него ордер размещается напрямую через api
+        self.orders = orders
+        # ExitEngine: TP/SL ордеров открытия по Ишимоку и трейлинг-стоп по потоку сделок
+        self.exits = exits
+        self.symbol = strategy.symbol
+        self.risk_percent = risk_percent
+        # Последняя закрытая свеча (время и OHLC), по которой оценка завершилась без ордера
+        self.evaluated_key = None
+        # Сторона позиции при последней оценке; после восстановления из снимка
+        # сверяется с биржей при первой оценке
+        self.position_side = None
+        self._check_restored = False
+
+    def step(self, balance, candles, open_positions=None):
+        """
+        Оценка стратегии по закрытым свечам и размещение ордера при необходимости.
+
+        :param balance: Доступный баланс USDT.
+        :param candles: CandleSeries закрытых свечей.
+        :param open_positions: Уже полученные открытые позиции по символу (None - запросить).
+        :return: True, если позиция закрыта по RSI и оценку нужно сразу повторить.
+        """
+        step_started = time.perf_counter()
+        # Те же закрытые свечи, что и при прошлой оценке без ордера: решение не изменится,
+        # индикаторы и позиции не пересчитываются
+        key = candles.key()
+        if key is not None and key == self.evaluated_key:
+            metrics.increment("steps_skipped_total")
+            logging.debug("Новых закрытых свечей нет, оценка пропущена.")
+            return False
+        # Ответа на ордер по символу ещё нет: позиция на бирже может измениться
+        if self.orders is not None and self.orders.in_flight(self.symbol):
+            logging.info("Ордер по %s ещё не подтверждён биржей, оценка отложена.", self.symbol)
+            return False
+
+        # Цена закрытия предыдущей завершенной свечи
+        previous_close = float(candles.close[-1])
+
+        # Расчет размера позиции
+        position_size = get_position_size(
+            balance, self.risk_percent, previous_close)
+        if position_size is None:
+            logging.warning("Невозможно рассчитать размер позиции.")
+            return False
+
+        # Сообщения на пути от сигнала до ордера форматируются в потоке записи логов
+        logging.info("Доступный баланс: %s USDT. Размер позиции: %s", balance, position_size)
+
+        # Проверка открытых позиций
+        if open_positions is None:
+            with metrics.timer("stage_seconds", stage="positions"):
+                open_positions = self.api.get_open_positions(self.symbol)
+        has_open_position = len(open_positions) > 0
+        current_position_side = open_positions[0]["side"].lower(
+        ) if has_open_position else None
+        if self._check_restored:
+            self._check_restored = False
+            if current_position_side != self.position_side:
+                logging.warning(f"Позиция {self.symbol} изменилась, пока бот был остановлен: "
+                                f"{self.position_side} -> {current_position_side}.")
+        self.position_side = current_position_side
+        if self.exits is not None:
+            self.exits.sync(self.symbol, open_positions[0] if has_open_position else None)
+
+        # Оценка сигнала стратегии, флага пересечения Tenkan Sen и Kijun Sen
+        # и RSI за одно инкрементальное обновление по закрытым свечам
+        with metrics.timer("stage_seconds", stage="indicators"):
+            signal, cross_flag, rsi_value = self.strategy.update(candles)
+        metrics.increment("signals_total", signal=signal)
+
+        # Формирование контекста для логирования
+        context = {
+            "has_open_position": has_open_position,
+            "current_position_side": current_position_side,
+            "cross_flag": cross_flag,
+            "rsi_value": rsi_value,
+        }
+
+        action, message = decide(
+            signal, cross_flag, rsi_value, current_position_side)
+        logging.info(message)
+        if action is None:
+            self.evaluated_key = key
+            return False
+        self.evaluated_key = None
+        candle_close_ms = int(candles.timestamp[-1]) + interval_ms(self.strategy.interval)
+
+        # Новая позиция открывается с TP/SL на бирже, закрываемая стратегией снимается с трейлинга
+        tp = sl = None
+        entry = action in (ENTRY_LONG, ENTRY_SHORT)
+        if self.exits is not None:
+            if entry:
+                tp, sl = self.exits.levels(self.symbol, action.side, previous_close, self.strategy)
+                context.update(tp=tp, sl=sl)
+            else:
+                self.exits.forget(self.symbol)
+
+        if self.orders is not None:
+            order = self.orders.submit(
+                self.symbol, action.side, position_size,
+                link_id=link_id(self.symbol, candles.timestamp[-1], ACTIONS.index(action)),
+                expected_price=previous_close, reason=action.reason, reason_code=action.reason_code,
+                context=context, decided=step_started, candle_close_ms=candle_close_ms, tp=tp, sl=sl)
+            if entry and self.exits is not None:
+                self.exits.track(self.symbol, action.side, position_size, previous_close, sl, tp)
+            # Повторная оценка после закрытия по RSI - только когда биржа приняла новый ордер
+            return action.repeat and order.wait(self.orders.ack_timeout)
+
+        started = time.perf_counter()
+        try:
+            response = self.api.place_order(self.symbol, action.side, position_size, tp=tp, sl=sl)
+        except Exception:
+            metrics.increment("errors_total", source="order")
+            raise
+        finished = time.perf_counter()
+        latency_ms = (finished - started) * 1000
+        metrics.observe("stage_seconds", finished - started, stage="order")
+        metrics.increment("orders_total", side=action.side, reason_code=action.reason_code)
+        # Задержка от начала оценки и от закрытия свечи до подтверждения ордера
+        metrics.observe("decision_to_order_seconds", finished - step_started)
+        metrics.observe("candle_close_to_order_seconds", max(0.0, time.time() - candle_close_ms / 1000))
+        order_id = None
+        if response and response.get("retCode") == 0:
+            order_id = response.get("result", {}).get("orderId")
+        with metrics.timer("stage_seconds", stage="trade_log"):
+            self.trade_logger.log_trade(
+                action=action.side.upper(),
+                symbol=self.symbol,
+                price=previous_close,
+                quantity=position_size,
+                reason=action.reason,
+                context=context,
+                reason_code=action.reason_code,
+                order_id=order_id,
+                latency_ms=latency_ms
+            )
+        return action.repeat
+
+    def snapshot(self):
+        """
+        Состояние стратегии и позиция при последней оценке для SnapshotStore.
+        """
+        return {"strategy": self.strategy.snapshot(), "position_side": self.position_side}
+
+    def restore(self, state):
+        """
+        Восстановление состояния из snapshot(). Решение о пропуске оценки
+        (evaluated_key) не восстанавливается: первая оценка после запуска всегда
+        запрашивает позиции.
+
+        :return: True, если состояние стратегии восстановлено.
+        """
+        if not self.strategy.restore(state["strategy"]):
+            return False
+        self.position_side = state["position_side"]
+        self._check_restored = True
+        return True
@@ -0,0 +1,295 @@
+import logging
+import random
+import threading
+import time
+import clock
+import metrics
+from pybit.exceptions import FailedRequestError, InvalidRequestError
+from pybit.unified_trading import HTTP
+import requests
+from requests.adapters import HTTPAdapter
+
+# Коды ошибок Bybit v5, при которых запрос не был выполнен и его можно повторить:
+# таймаут сервера, неверное время/recv_window, превышение лимита, внутренняя ошибка,
+# перезапуск сервиса, защита по частоте, таймаут ответа сопоставления ордеров
+RETRYABLE_CODES = {10000, 10002, 10006, 10016, 10019, 10429, 170007}
+
+# Коды превышения лимита: повтор после сброса окна лимита
+RATE_LIMIT_CODES = {10006, 10429}
+
+# HTTP-статусы временной недоступности
+RETRYABLE_STATUS = {500, 502, 503, 504}
+
+# Таймауты (подключение, чтение) в секундах по эндпоинтам
+DEFAULT_TIMEOUTS = {
+    "market": (3.05, 5),
+    "order/create": (3.05, 10),
+    "order/create-batch": (3.05, 10),
+    "position/list": (3.05, 5),
+    "position/trading-stop": (3.05, 5),
+    "account/wallet-balance": (3.05, 5),
+    "execution/list": (3.05, 5),
+}
+
+
+def _describe(error):
+    # Исключения pybit включают в текст весь запрос, в лог достаточно сообщения и кода
+    if isinstance(error, (InvalidRequestError, FailedRequestError)):
+        return f"{error.message} (код {error.status_code})"
+    return str(error)
+
+
+class ExchangeError(Exception):
+    """
+    Ошибка запроса к бирже.
+
+    :param code: Код ошибки Bybit (retCode) или HTTP-статус, None для сетевых ошибок.
+    :param attempts: Количество отправленных попыток запроса (больше 1 - ответ получен на повтор).
+    """
+
+    def __init__(self, message, code=None, attempts=1):
+        super().__init__(message)
+        self.code = code
+        self.attempts = attempts
+
+
+class TransientError(ExchangeError):
+    """
+    Временная ошибка (сеть, перегрузка, лимит), повторы исчерпаны.
+    """
+
+
+class CircuitOpenError(TransientError):
+    """
+    Запрос не отправлен: эндпоинт временно отключён после серии ошибок.
+    """
+
+
+class CircuitBreaker:
+    """
+    Размыкатель: после failure_threshold неудачных вызовов подряд запросы
+    отклоняются reset_timeout секунд, затем пропускается один пробный запрос.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened = None
+        self._trial = None  # поток, выполняющий пробный запрос
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened is None:
+                return True
+            if self._trial is not None or time.monotonic() - self._opened < self.reset_timeout:
+                return False
+            self._trial = threading.get_ident()
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened = None
+            self._trial = None
+
+    def failure(self):
+        """
+        :return: True, если размыкатель только что разомкнулся.
+        """
+        with self._lock:
+            self.failures += 1
+            self._trial = None
+            if self._opened is not None:
+                self._opened = time.monotonic()
+                return False
+            if self.failures >= self.failure_threshold:
+                self._opened = time.monotonic()
+                return True
+            return False
+
+    def release(self):
+        """
+        Завершение вызова: если пробный запрос этого потока не закончился ни success(),
+        ни failure() (непредвиденное исключение), следующий пробный запрос снова разрешается.
+        """
+        with self._lock:
+            if self._trial == threading.get_ident():
+                self._trial = None
+
+
+class HttpTransport:
+    """
+    Вызовы REST Bybit через pybit с пулом keep-alive соединений, таймаутами
+    по эндпоинтам, повторами с экспоненциальной задержкой и случайным разбросом,
+    учётом заголовков X-Bapi-Limit-* и размыкателем на каждый эндпоинт.
+
+    Ответы с ненулевым retCode и исчерпанные повторы поднимают ExchangeError,
+    вызывающий код не получает "пустых" данных вместо ошибки.
+
+    :param client: Готовый клиент с методами pybit HTTP для всех эндпоинтов
+        (например, клиент simulator.ExchangeSimulator) вместо подключения к Bybit.
+    """
+
+    def __init__(self, api_key, api_secret, testnet=True, rate_limiter=None, timeouts=None,
+                 pool_size=32, max_attempts=4, base_delay=0.05, max_delay=2.0,
+                 failure_threshold=5, reset_timeout=30, client=None):
+        self.rate_limiter = rate_limiter
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+        if client is not None:
+            self.http = client
+            self.session = None
+            self._clients = {}
+            return
+
+        # Повторы и ожидания pybit отключены: retry_codes содержит несуществующий код
+        options = dict(testnet=testnet, api_key=api_key, api_secret=api_secret, max_retries=1,
+                       retry_codes={-1}, force_retry=False, return_response_headers=True)
+        self.http = HTTP(timeout=(3.05, 10), **options)
+        self.session = self.http.client
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+
+        # Отдельный клиент на каждый таймаут, все используют одну сессию и пул соединений
+        self._clients = {}
+        for endpoint, timeout in self.timeouts.items():
+            client = HTTP(timeout=timeout, **options)
+            client.client = self.session
+            self._clients[endpoint] = client
+
+    def breaker(self, endpoint):
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def _backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    def _reset_delay(self, headers):
+        # Секунды до сброса окна лимита по заголовку X-Bapi-Limit-Reset-Timestamp
+        try:
+            reset = int(headers["X-Bapi-Limit-Reset-Timestamp"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        return min(max(0.0, reset / 1000 - time.time()), 60.0)
+
+    def _honour_limits(self, endpoint, headers):
+        if self.rate_limiter is None or not headers:
+            return
+        try:
+            remaining = int(headers["X-Bapi-Limit-Status"])
+        except (KeyError, TypeError, ValueError):
+            return
+        if remaining <= 0:
+            delay = self._reset_delay(headers)
+            if delay:
+                logging.warning(f"Лимит {endpoint} исчерпан, пауза {delay * 1000:.0f} мс до сброса окна.")
+                self.rate_limiter.pause(endpoint, delay)
+
+    def call(self, endpoint, method, idempotent=True, **params):
+        """
+        Вызов метода pybit HTTP.
+
+        :param endpoint: Ключ эндпоинта для лимитов, таймаутов и размыкателя ("market", "order/create"...).
+        :param method: Имя метода pybit (например, "get_kline").
+        :param idempotent: False для запросов, повтор которых после отправки может их задублировать
+            (такие запросы повторяются только при ошибке подключения и отклонении биржей).
+        :return: Ответ Bybit (словарь) с retCode 0.
+        """
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            metrics.increment("api_circuit_open_total", endpoint=endpoint)
+            raise CircuitOpenError(f"{endpoint}: запросы приостановлены после серии ошибок")
+        client = self._clients.get(endpoint, self.http)
+
+        try:
+            attempt = 0
+            while True:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire(endpoint)
+                delay = None
+                try:
+                    response, _, headers = self._request(client, endpoint, method, params)
+                    breaker.success()
+                    self._honour_limits(endpoint, headers)
+                    return response
+                except InvalidRequestError as e:
+                    if e.status_code not in RETRYABLE_CODES:
+                        # Запрос отклонён по существу: это не сбой связи, размыкатель не трогаем
+                        breaker.success()
+                        raise ExchangeError(f"{method}: {e.message}", e.status_code, attempt + 1) from e
+                    error = e
+                    if e.status_code in RATE_LIMIT_CODES:
+                        delay = self._reset_delay(e.resp_headers)
+                        if delay is not None and self.rate_limiter is not None:
+                            self.rate_limiter.pause(endpoint, delay)
+                except FailedRequestError as e:
+                    # 409 - ответ не удалось разобрать
+                    if e.status_code not in RETRYABLE_STATUS and e.status_code != 409:
+                        breaker.success()
+                        raise ExchangeError(f"{method}: {e.message}", e.status_code) from e
+                    if not idempotent:
+                        self._failed(endpoint, breaker)
+                        raise TransientError(f"{method}: {e.message}", e.status_code) from e
+                    error = e
+                except requests.exceptions.ConnectTimeout as e:
+                    error = e
+                except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                    if not idempotent:
+                        # Запрос мог дойти до биржи: повтор может открыть вторую позицию
+                        self._failed(endpoint, breaker)
+                        raise TransientError(f"{method}: {e}") from e
+                    error = e
+
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    self._failed(endpoint, breaker)
+                    raise TransientError(f"{method}: {_describe(error)} (попыток: {attempt})",
+                                         getattr(error, "status_code", None)) from error
+                if delay is None:
+                    delay = self._backoff(attempt - 1)
+                logging.warning(f"{method}: {_describe(error)}. Повтор {attempt} через {delay * 1000:.0f} мс.")
+                clock.sleep(delay)
+        finally:
+            # Пробный запрос не должен остаться "занятым" после непредвиденного исключения
+            breaker.release()
+
+    def _request(self, client, endpoint, method, params):
+        # Один запрос без повторов с замером времени по эндпоинту и коду ответа
+        code = "error"
+        started = time.perf_counter()
+        try:
+            result = getattr(client, method)(**params)
+            code = 0
+            return result
+        except (InvalidRequestError, FailedRequestError) as e:
+            code = e.status_code
+            raise
+        except requests.exceptions.Timeout:
+            code = "timeout"
+            raise
+        except requests.exceptions.ConnectionError:
+            code = "connection"
+            raise
+        finally:
+            metrics.observe("api_request_seconds", time.perf_counter() - started,
+                            endpoint=endpoint, method=method, code=code)
+
+    def _failed(self, endpoint, breaker):
+        if breaker.failure():
+            logging.error(f"Эндпоинт {endpoint} отключён на {breaker.reset_timeout} с после "
+                          f"{breaker.failures} ошибок подряд.")